@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+# The app modules are imported directly, like Streamlit does when running the apps
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'water_bodies_mapping'))
+
+import contributions_db  # noqa: E402
+
+
+# Fixture that runs a test from an empty folder, so the relative database and storage paths point into it
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(contributions_db, 'LEGACY_DATABASE_PATHS', [])
+    monkeypatch.setattr(contributions_db, '_pools', {})
+    yield tmp_path
+
+
+# Function to write a small GeoTIFF with two square water bodies and a nodata corner
+def write_geotiff(file_path, size=64, nodata=-9999.0, count=1, crs='EPSG:4326', transform=None):
+    data = np.full((count, size, size), 0.1, dtype=np.float32)
+    data[:, 5:15, 5:15] = 0.9
+    data[:, 30:50, 30:50] = 0.8
+    data[:, :3, :3] = nodata
+    profile = dict(driver='GTiff', width=size, height=size, count=count, dtype='float32', nodata=nodata,
+                   crs=crs, transform=transform or from_origin(28.4, -20.0, 0.0001, 0.0001))
+    with rasterio.open(file_path, 'w', **profile) as dst:
+        dst.write(data)
+    return file_path
+
+
+@pytest.fixture
+def geotiff(tmp_path):
+    return str(write_geotiff(tmp_path / 'sample.tif'))
@@ -0,0 +1,57 @@
+import contributions_db
+
+
+def rollup(conn):
+    return conn.execute('SELECT granularity, period, count, bytes, cumulative_bytes FROM contribution_rollup '
+                        'ORDER BY granularity, period').fetchall()
+
+
+# Function to compare the trigger-maintained rollup with one recomputed from scratch
+def assert_rollup_consistent(conn):
+    maintained = rollup(conn)
+    contributions_db.rebuild_rollup(conn)
+    assert maintained == rollup(conn)
+
+
+def test_triggers_keep_the_rollup_equal_to_a_rebuild(workdir):
+    with contributions_db.connection() as conn:
+        for timestamp, size in (('2024-01-01T10:15:00', 100), ('2024-01-01T10:45:00', 50), ('2024-01-02T09:00:00', None),
+                                ('2024-02-10T12:00:00', 400), (None, 999), ('2023-12-31T23:59:00', 7)):
+            conn.execute('INSERT INTO contributions (map_name, timestamp, file_path, file_size) VALUES (?, ?, ?, ?)',
+                         ('map', timestamp, 'map.tif', size))
+        assert_rollup_consistent(conn)
+
+        conn.execute("UPDATE contributions SET file_size = 80 WHERE timestamp = '2024-01-01T10:45:00'")
+        conn.execute("UPDATE contributions SET timestamp = '2024-03-01T08:00:00' WHERE timestamp IS NULL")
+        conn.execute("UPDATE contributions SET timestamp = NULL WHERE timestamp = '2023-12-31T23:59:00'")
+        assert_rollup_consistent(conn)
+
+        conn.execute("DELETE FROM contributions WHERE timestamp LIKE '2024-01-01%' OR timestamp IS NULL")
+        assert_rollup_consistent(conn)
+
+    assert contributions_db.size_over_time('month') == [('2024-01', 1, 0, 0), ('2024-02', 1, 400, 400), ('2024-03', 1, 999, 1399)]
+
+
+def test_contributions_without_timestamp_are_left_out(workdir):
+    contributions_db.insert_contribution('map', 'tester', 't@example.com', None, 'map.tif', 10)
+    contributions_db.insert_contribution('map', 'tester', 't@example.com', '2024-05-01T13:30:00', 'map.tif', 20)
+    assert contributions_db.size_over_time('hour') == [('2024-05-01 13:00', 1, 20, 20)]
+    assert contributions_db.count_contributions() == 2
+
+
+def test_outdated_triggers_are_replaced_and_the_rollup_rebuilt(workdir, monkeypatch):
+    with contributions_db.connection() as conn:
+        conn.execute('DROP TRIGGER contributions_rollup_insert')
+        conn.execute('CREATE TRIGGER contributions_rollup_insert AFTER INSERT ON contributions BEGIN SELECT 1; END')
+        conn.execute("INSERT INTO contributions (map_name, timestamp, file_size) VALUES ('map', '2024-01-01T10:00:00', 5)")
+    assert contributions_db.size_over_time('day') == []
+
+    monkeypatch.setattr(contributions_db, '_pools', {})
+    assert contributions_db.size_over_time('day') == [('2024-01-01', 1, 5, 5)]
+
+    # Up-to-date triggers are left alone, so opening the database again does not recompute the rollup
+    rebuilds = []
+    monkeypatch.setattr(contributions_db, 'rebuild_rollup', rebuilds.append)
+    monkeypatch.setattr(contributions_db, '_pools', {})
+    contributions_db.init_database()
+    assert rebuilds == []
@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pytest
+
+import excel_cache
+
+
+@pytest.fixture(params=[True, False], ids=['parquet', 'sqlite'])
+def workbook(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_cache, 'PARQUET_AVAILABLE', request.param)
+    excel_path = str(tmp_path / 'water bodies.xlsx')
+    pd.DataFrame({
+        'water body name': ['Lake A', 'Dam B'],
+        'area (square meters)': [1200.5, 300.0],
+        'surveyed': pd.to_datetime(['2024-01-01', '2024-02-01']),
+    }).to_excel(excel_path, index=False)
+    return excel_path
+
+
+def test_second_read_comes_from_the_cache_in_its_format(workbook, monkeypatch):
+    first = excel_cache.read_excel_cached(workbook)
+    _, meta_path, data_path = excel_cache.cache_paths(workbook)
+    assert os.path.exists(meta_path) and os.path.exists(data_path)
+    assert sorted(os.listdir(os.path.dirname(data_path))) == sorted([os.path.basename(meta_path), os.path.basename(data_path)])
+
+    def no_excel(*args, **kwargs):
+        raise AssertionError('the workbook was parsed again')
+
+    monkeypatch.setattr(pd, 'read_excel', no_excel)
+    second = excel_cache.read_excel_cached(workbook)
+    pd.testing.assert_frame_equal(first, second, check_dtype=False)
+    assert str(second['surveyed'].dtype).startswith('datetime64')
+
+
+def test_changed_workbook_is_converted_again(workbook):
+    excel_cache.read_excel_cached(workbook)
+    pd.DataFrame({'water body name': ['Lake C'], 'area (square meters)': [5.0]}).to_excel(workbook, index=False)
+    assert list(excel_cache.read_excel_cached(workbook)['water body name']) == ['Lake C']
+
+
+def test_remove_cached_workbook_drops_both_files(workbook):
+    excel_cache.read_excel_cached(workbook)
+    excel_cache.remove_cached_workbook(workbook)
+    _, meta_path, data_path = excel_cache.cache_paths(workbook)
+    assert not os.path.exists(meta_path) and not os.path.exists(data_path)
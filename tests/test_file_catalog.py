@@ -0,0 +1,68 @@
+import io
+import os
+
+import contributions_db
+import file_catalog
+from upload_storage import save_upload
+
+
+def test_reconcile_catalogues_only_managed_files(workdir, monkeypatch):
+    folder = os.path.dirname(contributions_db.DATABASE_PATH)
+    contributions_db.insert_contribution('map', 'tester', 't@example.com', '2024-01-01T10:00:00', 'x.tif', 1)
+    for name in ('map.tif', 'roads.shp', 'map.tif.aux.xml', 'notes.txt'):
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(name.encode())
+    hashed = []
+    monkeypatch.setattr(file_catalog, 'file_sha256', lambda path: hashed.append(os.path.basename(path)) or 'sha')
+
+    file_catalog.reconcile(folder, force=True)
+    assert sorted(hashed) == ['map.tif', 'roads.shp']
+    assert file_catalog.list_names(folder) == ['map.tif', 'roads.shp']
+
+    os.remove(os.path.join(folder, 'roads.shp'))
+    file_catalog.reconcile(folder, force=True)
+    assert file_catalog.list_names(folder) == ['map.tif']
+    assert sorted(hashed) == ['map.tif', 'roads.shp']
+
+
+def test_search_matches_names_and_contribution_metadata(workdir):
+    os.makedirs('maps')
+    for name, contributor in (('Lake Kariba.tif', 'Tendai Moyo'), ('Dam wall.tif', 'Rudo Ncube')):
+        stored = save_upload(io.BytesIO(name.encode()), os.path.join('maps', name))
+        contributions_db.insert_contribution(name, contributor, 'c@example.com', '2024-01-01T10:00:00', stored['path'])
+        file_catalog.add_file(stored['published_path'], stored['sha256'])
+
+    assert [f['name'] for f in file_catalog.list_files('maps', search='kariba')] == ['Lake Kariba.tif']
+    assert [f['name'] for f in file_catalog.list_files('maps', search='Ncube')] == ['Dam wall.tif']
+    assert file_catalog.count_files('maps', search='Dam', match='prefix') == 1
+    # Prefix search ignores case, like the trigram index behind contains search
+    assert [f['name'] for f in file_catalog.list_files('maps', search='lake k', match='prefix')] == ['Lake Kariba.tif']
+    assert file_catalog.count_files('maps', search='DAM WALL', match='prefix') == 1
+    assert file_catalog.count_files('maps', search='am') == 1
+
+
+def test_search_metadata_follows_edited_and_deleted_contributions(workdir):
+    os.makedirs('maps')
+    stored = save_upload(io.BytesIO(b'map'), os.path.join('maps', 'map.tif'))
+    for contributor in ('Tendai Moyo', 'Rudo Ncube'):
+        contributions_db.insert_contribution('Survey', contributor, 'c@example.com', '2024-01-01T10:00:00', stored['path'])
+    file_catalog.add_file(stored['published_path'], stored['sha256'])
+    assert file_catalog.count_files('maps', search='Moyo') == 1
+
+    with contributions_db.connection() as conn:
+        conn.execute("UPDATE contributions SET contributor = 'Chipo Dube' WHERE contributor = 'Tendai Moyo'")
+    assert file_catalog.count_files('maps', search='Moyo') == 0
+    assert file_catalog.count_files('maps', search='Dube') == 1
+    assert file_catalog.count_files('maps', search='Ncube') == 1
+
+    with contributions_db.connection() as conn:
+        conn.execute("DELETE FROM contributions WHERE contributor = 'Rudo Ncube'")
+    assert file_catalog.count_files('maps', search='Ncube') == 0
+    assert file_catalog.count_files('maps', search='Dube') == 1
+
+
+def test_prefix_search_uses_the_lowercase_name_index(workdir):
+    with contributions_db.connection() as conn:
+        source, where, params = file_catalog._filters('maps', None, 'lake', 'prefix')
+        plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN SELECT c.name FROM {source} WHERE {where}', params))
+    assert 'idx_file_catalog_name_lower' in plan
@@ -0,0 +1,46 @@
+import socket
+import urllib.request
+
+import pytest
+
+import file_server
+
+
+@pytest.fixture
+def no_server(monkeypatch):
+    for name in ('ADAPT_FILE_SERVER_URL', 'ADAPT_FILE_SERVER_PORT', 'ADAPT_FILE_SERVER_HOST'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(file_server, '_server', None)
+    monkeypatch.setattr(file_server, '_base_url', None)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize('env', [{}, {'ADAPT_FILE_SERVER_PORT': '8502'}, {'ADAPT_FILE_SERVER_URL': 'https://maps.example.org/files'}])
+def test_server_stays_off_without_a_public_url_and_fixed_port(no_server, monkeypatch, tmp_path, env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    assert file_server.ensure_server() is None
+    assert file_server.file_url(str(tmp_path / 'map.tif')) is None
+    assert file_server._server is None
+
+
+def test_links_use_the_public_url_and_stream_the_file(no_server, monkeypatch, tmp_path):
+    port = free_port()
+    monkeypatch.setenv('ADAPT_FILE_SERVER_URL', 'https://maps.example.org/files/')
+    monkeypatch.setenv('ADAPT_FILE_SERVER_PORT', str(port))
+    (tmp_path / 'map 1.tif').write_bytes(b'raster bytes')
+
+    url = file_server.file_url(str(tmp_path / 'map 1.tif'))
+    try:
+        assert url.startswith('https://maps.example.org/files/' + file_server._token + '/files/')
+        local_url = url.replace('https://maps.example.org/files', f'http://127.0.0.1:{port}')
+        with urllib.request.urlopen(local_url) as response:
+            assert response.read() == b'raster bytes'
+    finally:
+        file_server._server.shutdown()
+        file_server._server.server_close()
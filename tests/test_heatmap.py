@@ -0,0 +1,68 @@
+import tracemalloc
+import warnings
+
+import numpy as np
+import plotly.graph_objects as go
+import pytest
+
+from raster_analysis import create_heatmap, read_geotiff
+from raster_decimation import decimate_raster, decimation_factor
+from raster_normalization import normalize_raster
+
+
+def test_create_heatmap_on_real_raster(geotiff):
+    img_data, bounds, _ = read_geotiff(geotiff)
+    normalized, _, _ = normalize_raster(img_data)
+    fig = go.Figure()
+    payload = create_heatmap(fig, normalized, bounds, 'sample.tif')
+    assert payload['display_shape'] == normalized.shape
+    assert payload['payload_bytes'] > 0
+    assert payload['full_payload_bytes'] == payload['payload_bytes']
+
+
+def test_create_heatmap_estimates_full_payload_when_decimated(geotiff, monkeypatch):
+    monkeypatch.setenv('ADAPT_HEATMAP_MAX_PIXELS', '256')
+    img_data, bounds, _ = read_geotiff(geotiff)
+    normalized, _, _ = normalize_raster(img_data)
+    payload = create_heatmap(go.Figure(), normalized, bounds, 'sample.tif', full_shape=normalized.shape)
+    assert payload['display_shape'] == (16, 16)
+    assert payload['full_payload_bytes'] > payload['payload_bytes']
+
+
+# Reference block reduction: pad the whole raster with NaN and reduce every factor x factor block at once
+def padded_reference(data, factor, method):
+    rows, cols = -data.shape[0] % factor, -data.shape[1] % factor
+    padded = np.pad(data, ((0, rows), (0, cols)), constant_values=np.nan)
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmax(blocks, axis=(1, 3)) if method == 'max' else np.nanmean(blocks, axis=(1, 3))
+
+
+@pytest.mark.parametrize('method', ['mean', 'max'])
+@pytest.mark.parametrize('shape', [(100, 100), (103, 77), (5, 300)])
+def test_decimate_raster_matches_a_padded_block_reduction(method, shape):
+    data = np.random.default_rng(0).random(shape, dtype=np.float32)
+    data[data > 0.9] = np.nan
+    data[:12, :12] = np.nan
+    max_pixels = 400
+    factor = decimation_factor(shape, max_pixels)
+
+    decimated = decimate_raster(data, max_pixels, method)
+    assert decimated.dtype == np.float32
+    np.testing.assert_allclose(decimated, padded_reference(data, factor, method), rtol=1e-6, equal_nan=True)
+
+
+def test_decimate_raster_keeps_temporaries_band_sized(tmp_path):
+    data = np.lib.format.open_memmap(str(tmp_path / 'big.npy'), mode='w+', dtype=np.float32, shape=(2000, 2001))
+    factor = decimation_factor(data.shape, 10_000)
+    data[:] = 0.5
+    # The narrower last column of blocks holds only NaN
+    data[:, -(2001 % factor):] = np.nan
+    tracemalloc.start()
+    decimated = decimate_raster(data, 10_000, 'mean')
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert decimated.shape == (-(-2000 // factor), -(-2001 // factor))
+    assert np.isnan(decimated[:, -1]).all() and np.allclose(decimated[:, :-1], 0.5)
+    assert peak < data.nbytes / 10
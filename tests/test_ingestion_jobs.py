@@ -0,0 +1,116 @@
+import os
+
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import contributions_db
+import ingestion_jobs
+from conftest import write_geotiff
+from upload_storage import save_upload
+
+
+# Function to upload a file the way the apps do: store, publish, log the contribution and queue a job
+def upload(file_path, published_path):
+    with open(file_path, 'rb') as f:
+        stored = save_upload(f, published_path)
+    contribution_id = contributions_db.insert_contribution('map', 'tester', 't@example.com', '2024-01-01T10:00:00',
+                                                           stored['path'], stored['size'])
+    return stored, contribution_id, ingestion_jobs.enqueue_job(stored, 'contribution', contribution_id)
+
+
+# Function to claim the next job and run it in this process
+def run_next_job():
+    job = ingestion_jobs.claim_job(1)
+    assert job is not None
+    ingestion_jobs.execute_job(job)
+    return job
+
+
+def job_row(job_id):
+    with contributions_db.connection() as conn:
+        return conn.execute('SELECT status, attempts, error, stored_path FROM ingest_jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def contribution_path(contribution_id):
+    with contributions_db.connection() as conn:
+        return conn.execute('SELECT file_path FROM contributions WHERE id = ?', (contribution_id,)).fetchone()[0]
+
+
+@pytest.fixture
+def mercator_geotiff(tmp_path):
+    return str(write_geotiff(tmp_path / 'mercator.tif', crs='EPSG:3857', transform=from_origin(3180000, -2270000, 10, 10)))
+
+
+def test_job_reprojects_and_points_contribution_at_final_object(workdir, mercator_geotiff):
+    os.makedirs('maps')
+    stored, contribution_id, job_id = upload(mercator_geotiff, 'maps/map.tif')
+    run_next_job()
+
+    status, _, error, stored_path = job_row(job_id)
+    assert (status, error) == ('done', None)
+    assert contribution_path(contribution_id) == stored_path != stored['path']
+    assert not os.path.exists(stored['path'])
+    with rasterio.open('maps/map.tif') as src:
+        assert src.crs.to_string() == 'EPSG:4326'
+
+
+def test_replaced_object_is_kept_while_a_duplicate_upload_uses_it(workdir, mercator_geotiff):
+    os.makedirs('maps')
+    first, _, first_job = upload(mercator_geotiff, 'maps/first.tif')
+    second, second_contribution, second_job = upload(mercator_geotiff, 'maps/second.tif')
+    assert second['duplicate'] and second['path'] == first['path']
+
+    run_next_job()
+    assert os.path.exists(first['path'])
+    run_next_job()
+
+    assert job_row(first_job)[0] == 'done'
+    assert job_row(second_job)[0] == 'done'
+    assert os.path.exists(contribution_path(second_contribution))
+    # Once nothing points at the original object any more, it is removed
+    assert not os.path.exists(first['path'])
+
+
+def test_retry_after_a_later_step_fails_starts_from_the_replacement(workdir, mercator_geotiff, monkeypatch):
+    os.makedirs('maps')
+    _, contribution_id, job_id = upload(mercator_geotiff, 'maps/map.tif')
+    optimize_upload = ingestion_jobs.optimize_upload
+
+    def failing_optimize(stored):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(ingestion_jobs, 'optimize_upload', failing_optimize)
+    run_next_job()
+    status, attempts, error, stored_path = job_row(job_id)
+    assert (status, attempts, error) == ('queued', 1, 'OSError: disk full')
+    assert contribution_path(contribution_id) == stored_path
+    assert os.path.exists(stored_path)
+
+    monkeypatch.setattr(ingestion_jobs, 'optimize_upload', optimize_upload)
+    with contributions_db.connection() as conn:
+        conn.execute('UPDATE ingest_jobs SET not_before = 0 WHERE id = ?', (job_id,))
+    run_next_job()
+    assert job_row(job_id)[:3] == ('done', 2, None)
+    assert os.path.exists(contribution_path(contribution_id))
+
+
+def test_unreadable_upload_fails_without_retrying(workdir, tmp_path):
+    os.makedirs('maps')
+    broken = tmp_path / 'broken.tif'
+    broken.write_bytes(b'not a raster')
+    _, _, job_id = upload(str(broken), 'maps/broken.tif')
+    run_next_job()
+    status, attempts, error, _ = job_row(job_id)
+    assert (status, attempts) == ('failed', 1)
+    assert error.startswith('not a readable GeoTIFF')
+
+
+def test_sweep_removes_only_unreferenced_objects(workdir, geotiff):
+    os.makedirs('maps')
+    kept, _, _ = upload(geotiff, 'maps/kept.tif')
+    with open(__file__, 'rb') as f:
+        orphan = save_upload(f, 'maps/orphan.py')
+    assert ingestion_jobs.sweep_store(min_age=0) == 1
+    assert os.path.exists(kept['path'])
+    assert not os.path.exists(orphan['path'])
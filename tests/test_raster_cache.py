@@ -0,0 +1,51 @@
+import gc
+import os
+import weakref
+
+import numpy as np
+import pytest
+
+import decoded_store
+import raster_cache
+from conftest import write_geotiff
+from raster_analysis import cached_read_normalized
+
+
+@pytest.fixture
+def cache(workdir, monkeypatch):
+    cache = raster_cache.RasterCache(1024 * 1024 * 1024)
+    monkeypatch.setattr(raster_cache, '_raster_cache', cache)
+    return cache
+
+
+def test_memory_mapped_entries_are_charged_their_mapped_size(cache, geotiff):
+    normalized = cached_read_normalized(geotiff)[0]
+    assert isinstance(normalized, np.memmap)
+    assert cache.stats()['bytes'] >= normalized.nbytes == 64 * 64 * 4
+
+    cache.resize(normalized.nbytes - 1)
+    assert cache.stats()['entries'] == 0
+
+
+def test_pruned_store_entry_is_released_from_the_cache(cache, geotiff):
+    normalized = weakref.ref(cached_read_normalized(geotiff)[0])
+    folder = decoded_store.entry_folder(decoded_store.source_sha256(geotiff))
+    assert cache.stats()['entries'] == 1
+
+    decoded_store.prune(0)
+    gc.collect()
+    assert not os.path.exists(folder)
+    assert (cache.stats()['entries'], cache.stats()['bytes']) == (0, 0)
+    assert normalized() is None
+
+
+def test_replaced_raster_releases_the_older_version(cache, geotiff):
+    old = weakref.ref(cached_read_normalized(geotiff)[0])
+    write_geotiff(geotiff, size=32)
+    stat = os.stat(geotiff)
+    os.utime(geotiff, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert cached_read_normalized(geotiff)[0].shape == (32, 32)
+    gc.collect()
+    assert old() is None
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from raster_analysis import read_geotiff
+from raster_normalization import normalize_raster
+from raster_streaming import iter_windows, normalize_geotiff, streaming_stats
+
+
+@pytest.fixture(params=[{}, {'tiled': True, 'blockxsize': 16, 'blockysize': 16}], ids=['stripped', 'tiled'])
+def raster(request, tmp_path):
+    rng = np.random.default_rng(3)
+    data = rng.normal(50.0, 20.0, (90, 70)).astype(np.float32)
+    data[:10, :] = -9999
+    data[40:45, 20:25] = -9999
+    file_path = str(tmp_path / 'raster.tif')
+    with rasterio.open(file_path, 'w', driver='GTiff', width=70, height=90, count=1, dtype='float32', nodata=-9999,
+                       crs='EPSG:4326', transform=from_origin(28.4, -20.0, 0.0001, 0.0001), **request.param) as dst:
+        dst.write(data, 1)
+    return file_path
+
+
+@pytest.mark.parametrize('max_window_pixels', [1, 500, 2000, 10 ** 6])
+def test_windows_cover_the_raster_exactly_once(raster, max_window_pixels):
+    with rasterio.open(raster) as src:
+        windows = list(iter_windows(src, max_window_pixels=max_window_pixels))
+        block_rows = src.block_shapes[0][0]
+    covered = np.zeros((90, 70), dtype=np.int32)
+    for window in windows:
+        covered[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] += 1
+        # Windows only exceed the budget when a single row of blocks is larger than it
+        assert window.height * window.width <= max(max_window_pixels, block_rows * 70)
+    assert (covered == 1).all()
+    if max_window_pixels < 90 * 70:
+        assert len(windows) > 1
+
+
+def test_streamed_statistics_match_the_in_memory_raster(raster):
+    img_data, _, _ = read_geotiff(raster)
+    stats = streaming_stats(raster, max_window_pixels=500)
+    assert stats['min'] == np.nanmin(img_data)
+    assert stats['max'] == np.nanmax(img_data)
+    assert stats['mean'] == pytest.approx(np.nanmean(img_data.astype(np.float64)), rel=1e-9)
+    assert stats['valid_pixels'] == np.isfinite(img_data).sum() == stats['histogram'].sum()
+    assert stats['nodata_fraction'] == pytest.approx(np.isnan(img_data).mean())
+
+
+def test_streamed_normalization_matches_the_in_memory_one(raster):
+    normalized, _, _, _ = normalize_geotiff(raster, max_window_pixels=500)
+    expected, _, _ = normalize_raster(read_geotiff(raster)[0])
+    np.testing.assert_allclose(normalized, expected, rtol=1e-6, atol=1e-7)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import contributions_db
+from temporal_analysis import RasterStack, frequency_geotiff_bytes, temporal_analysis
+from water_body_measurement import row_pixel_areas
+
+TRANSFORM = from_origin(28.4, -20.0, 0.001, 0.001)
+LAKE = (slice(0, 3), slice(0, 3))
+DAM = (slice(6, 9), slice(5, 9))
+
+
+def write_date(file_path, wet_areas, nodata_pixel=None):
+    data = np.zeros((10, 10), dtype=np.float32)
+    data[9, 9] = 1.0
+    for rows, cols in wet_areas:
+        data[rows, cols] = 1.0
+    if nodata_pixel is not None:
+        data[nodata_pixel] = -9999
+    with rasterio.open(file_path, 'w', driver='GTiff', width=10, height=10, count=1, dtype='float32', nodata=-9999,
+                       crs='EPSG:4326', transform=TRANSFORM) as dst:
+        dst.write(data, 1)
+    return str(file_path)
+
+
+@pytest.fixture
+def stack(workdir):
+    # The lake dries up after the second date, while the dam fills from the second date on
+    file_paths = [write_date(workdir / 'Lake_2024-01-01.tif', [LAKE]),
+                  write_date(workdir / 'Lake_2024-02-01.tif', [LAKE, DAM]),
+                  write_date(workdir / 'Lake_2024-03-01.tif', [DAM], nodata_pixel=(0, 0))]
+    return RasterStack(file_paths)
+
+
+def area(region):
+    areas = np.broadcast_to(row_pixel_areas(TRANSFORM, rasterio.crs.CRS.from_epsg(4326), 10)[:, None], (10, 10))
+    return areas[region].sum()
+
+
+def test_frequency_first_and_last_wet_dates(stack):
+    result = temporal_analysis(stack, tile_rows=4)
+    assert result['labels'] == ['2024-01-01', '2024-02-01', '2024-03-01']
+
+    expected = np.zeros((10, 10), dtype=np.float32)
+    expected[LAKE] = expected[DAM] = 2 / 3
+    expected[9, 9] = 1.0
+    # Missing on the last date, so it was wet on both dates it was seen
+    expected[0, 0] = 1.0
+    np.testing.assert_allclose(result['frequency'], expected, rtol=1e-6)
+
+    first_wet = np.full((10, 10), -1)
+    last_wet = np.full((10, 10), -1)
+    first_wet[LAKE], last_wet[LAKE] = 0, 1
+    first_wet[DAM], last_wet[DAM] = 1, 2
+    first_wet[9, 9], last_wet[9, 9] = 0, 2
+    np.testing.assert_array_equal(result['first_wet'], first_wet)
+    np.testing.assert_array_equal(result['last_wet'], last_wet)
+
+
+def test_gained_lost_and_per_water_body_areas(stack):
+    result = temporal_analysis(stack, tile_rows=4)
+    lake, dam, corner = area(LAKE), area(DAM), area((9, 9))
+    assert result['gained_area_m2'] == pytest.approx(dam)
+    # Change is only counted where the first and last dates both have data
+    assert result['lost_area_m2'] == pytest.approx(lake - area((0, 0)))
+    np.testing.assert_allclose(result['wet_area_m2'].to_numpy(), [lake + corner, lake + dam + corner, dam + corner])
+
+    bodies = result['water_bodies'].set_index('water_body_id')
+    np.testing.assert_allclose(bodies.to_numpy(), [[lake, lake, 0], [0, dam, dam], [corner, corner, corner]])
+    with rasterio.MemoryFile(frequency_geotiff_bytes(result)) as memfile, memfile.open() as src:
+        np.testing.assert_allclose(src.read(1), result['frequency'])
+        assert src.tags()['dates'] == '2024-01-01,2024-02-01,2024-03-01'
+
+
+def test_stack_reads_ranges_without_storing_statistics(stack):
+    assert stack.ranges == [(0.0, 1.0)] * 3
+    with contributions_db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM raster_stats').fetchone()[0] == 0
@@ -0,0 +1,37 @@
+import os
+
+import tile_server
+
+
+def test_rasters_are_not_registered_without_a_public_file_server(workdir, geotiff, monkeypatch):
+    monkeypatch.delenv('ADAPT_FILE_SERVER_URL', raising=False)
+    monkeypatch.delenv('ADAPT_FILE_SERVER_PORT', raising=False)
+    assert not tile_server.tiles_enabled()
+    assert tile_server.register_raster(geotiff) is None
+
+
+def test_disk_cache_keeps_the_most_recently_used_tiles_within_budget(workdir, geotiff, monkeypatch):
+    monkeypatch.setattr(tile_server, 'ensure_server', lambda: 'https://maps.example.org/files/token')
+    monkeypatch.setattr(tile_server, '_tile_cache', tile_server.RasterCache(0))
+    monkeypatch.setattr(tile_server, 'PRUNE_EVERY_TILES', 1)
+    info = tile_server.register_raster(geotiff)
+    assert info['url'].startswith('https://maps.example.org/files/token/tiles/')
+
+    tile = tile_server.get_tile(info, 0, 0, 0)
+    assert tile.startswith(b'\x89PNG')
+    tile_path = os.path.join(tile_server.TILE_FOLDER, info['version'], '0', '0', '0.png')
+    monkeypatch.setenv('ADAPT_TILE_DISK_CACHE_MB', str(len(tile) * 1.5 / 1024 / 1024))
+    os.utime(tile_path, (1, 1))
+    tile_server.get_tile(info, 1, 1, 0)
+
+    # Only the newer tile fits, so the older one was evicted
+    assert not os.path.exists(tile_path)
+    assert os.path.exists(os.path.join(tile_server.TILE_FOLDER, info['version'], '1', '1', '0.png'))
+
+
+def test_disk_cache_can_be_disabled(workdir, geotiff, monkeypatch):
+    monkeypatch.setattr(tile_server, 'ensure_server', lambda: 'https://maps.example.org/files/token')
+    monkeypatch.setenv('ADAPT_TILE_DISK_CACHE_MB', '0')
+    info = tile_server.register_raster(geotiff)
+    assert tile_server.get_tile(info, 2, 2, 2).startswith(b'\x89PNG')
+    assert not os.path.exists(tile_server.TILE_FOLDER)
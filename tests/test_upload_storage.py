@@ -0,0 +1,41 @@
+import io
+import os
+
+from upload_storage import file_sha256, replace_stored, save_upload
+
+
+def test_identical_uploads_share_one_stored_object(workdir):
+    os.makedirs('maps')
+    first = save_upload(io.BytesIO(b'raster bytes'), 'maps/a.tif')
+    second = save_upload(io.BytesIO(b'raster bytes'), 'maps/b.tif')
+
+    assert not first['duplicate'] and second['duplicate']
+    assert first['path'] == second['path']
+    assert first['sha256'] == file_sha256(first['path'])
+    assert os.path.basename(first['path']) == first['sha256'] + '.tif'
+    assert os.path.samefile('maps/a.tif', first['path'])
+    assert os.path.samefile('maps/b.tif', first['path'])
+
+
+def test_different_content_under_a_taken_name_is_kept_alongside(workdir):
+    os.makedirs('maps')
+    save_upload(io.BytesIO(b'first'), 'maps/map.tif')
+    second = save_upload(io.BytesIO(b'second'), 'maps/map.tif')
+
+    assert second['published_path'] == os.path.join('maps', 'map (2).tif')
+    assert open('maps/map.tif', 'rb').read() == b'first'
+    # Re-uploading the same bytes under the same name republishes in place
+    assert save_upload(io.BytesIO(b'first'), 'maps/map.tif')['published_path'] == 'maps/map.tif'
+
+
+def test_replace_stored_republishes_and_keeps_the_superseded_object(workdir, tmp_path):
+    os.makedirs('maps')
+    stored = save_upload(io.BytesIO(b'original'), 'maps/map.tif')
+    converted = tmp_path / 'converted.tif'
+    converted.write_bytes(b'converted')
+
+    replacement = replace_stored(stored, str(converted))
+    assert replacement['path'] != stored['path']
+    assert replacement['published_path'] == stored['published_path']
+    assert open('maps/map.tif', 'rb').read() == b'converted'
+    assert os.path.exists(stored['path'])
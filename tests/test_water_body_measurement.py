@@ -0,0 +1,33 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from raster_streaming import normalize_geotiff
+from water_body_measurement import measure_water_bodies, measure_water_bodies_tiled
+
+
+def sorted_table(table):
+    return table.sort_values(['pixel_count', 'centroid_lon']).reset_index(drop=True)
+
+
+def test_tiled_measurement_merges_components_across_band_seams(tmp_path):
+    data = np.full((40, 40), 0.1, dtype=np.float32)
+    # A U shape: its two arms are separate components in the upper bands and only join in a lower one
+    data[2:30, 5:8] = 0.9
+    data[2:30, 20:23] = 0.9
+    data[27:30, 5:23] = 0.9
+    data[33:38, 30:36] = 0.8
+    data[0, 0] = 0.0
+    file_path = str(tmp_path / 'u.tif')
+    with rasterio.open(file_path, 'w', driver='GTiff', width=40, height=40, count=1, dtype='float32',
+                       crs='EPSG:4326', transform=from_origin(28.4, -20.0, 0.0001, 0.0001)) as dst:
+        dst.write(data, 1)
+
+    normalized, _, metadata, _ = normalize_geotiff(file_path)
+    expected = sorted_table(measure_water_bodies(normalized, metadata['transform'], metadata['crs']))
+    for tile_rows in (1, 7, 10, 40):
+        tiled = sorted_table(measure_water_bodies_tiled(file_path, tile_rows=tile_rows))
+        assert len(tiled) == len(expected) == 2
+        assert list(tiled['pixel_count']) == list(expected['pixel_count'])
+        for column in ('area_m2', 'centroid_lon', 'centroid_lat'):
+            np.testing.assert_allclose(tiled[column], expected[column], rtol=1e-9)
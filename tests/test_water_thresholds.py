@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from raster_streaming import StreamingHistogram, normalize_geotiff
+from water_thresholds import (detection_settings, normalized_difference, otsu_threshold, percentile_threshold, read_index,
+                              water_threshold)
+
+
+def histogram_of(values, bins=256):
+    histogram = StreamingHistogram(bins)
+    # Fed in chunks, the way the raster passes feed it
+    for chunk in np.array_split(values, 7):
+        histogram.update(chunk)
+    return histogram.counts, histogram.edges()
+
+
+def write_bands(file_path, bands, nodata=None):
+    bands = np.asarray(bands, dtype=np.float32)
+    with rasterio.open(file_path, 'w', driver='GTiff', width=bands.shape[2], height=bands.shape[1], count=bands.shape[0],
+                       dtype='float32', nodata=nodata, crs='EPSG:4326', transform=from_origin(28.4, -20.0, 0.0001, 0.0001)) as dst:
+        dst.write(bands)
+    return str(file_path)
+
+
+def test_otsu_threshold_separates_a_bimodal_distribution():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(0.2, 0.03, 20000), rng.normal(0.8, 0.03, 5000)])
+    threshold = otsu_threshold(*histogram_of(values))
+    # Every cut inside the empty gap between the modes separates them equally well
+    assert 0.3 < threshold < 0.7
+    assert (values > threshold).sum() == pytest.approx(5000, abs=5)
+
+
+@pytest.mark.parametrize('percentile', [10.0, 50.0, 90.0, 99.0])
+def test_percentile_threshold_matches_numpy(percentile):
+    values = np.random.default_rng(1).gamma(2.0, 50.0, 50000)
+    counts, edges = histogram_of(values)
+    bin_width = edges[1] - edges[0]
+    assert percentile_threshold(counts, edges, percentile) == pytest.approx(np.percentile(values, percentile), abs=bin_width)
+
+
+def test_one_outlier_does_not_move_the_percentile_threshold(tmp_path):
+    rng = np.random.default_rng(2)
+    data = rng.uniform(100, 800, (200, 200)).astype(np.float32)
+    data[0, 0] = 60000
+    file_path = write_bands(tmp_path / 'outlier.tif', [data])
+
+    _, _, _, stats = normalize_geotiff(file_path, max_window_pixels=200 * 20)
+    detection = detection_settings(method='percentile', percentile=90.0)
+    threshold = water_threshold(stats, detection, normalized=False)
+    assert threshold == pytest.approx(np.percentile(data, 90), abs=5)
+    # The cut is still mapped onto the normalized scale, where the outlier sets the top
+    normalized = water_threshold(stats, detection)
+    assert normalized == pytest.approx((threshold - data.min()) / (60000 - data.min()), rel=1e-4)
+
+
+def test_normalized_difference_is_nan_where_undefined():
+    first = np.array([0.6, 0.2, 0.0, np.nan], dtype=np.float32)
+    second = np.array([0.2, 0.6, 0.0, 0.5], dtype=np.float32)
+    np.testing.assert_allclose(normalized_difference(first, second), [0.5, -0.5, np.nan, np.nan], rtol=1e-6)
+
+
+def test_read_index_on_a_two_band_raster(tmp_path):
+    green = np.full((50, 40), 0.3, dtype=np.float32)
+    nir = np.full((50, 40), 0.1, dtype=np.float32)
+    nir[10:20, 10:30] = 0.5
+    green[0, 0] = -9999
+    file_path = write_bands(tmp_path / 'stack.tif', [green, nir], nodata=-9999)
+
+    values, _, metadata, stats = read_index(file_path, 'ndwi', (1, 2), max_window_pixels=40 * 10)
+    expected = normalized_difference(np.where(green == -9999, np.nan, green), nir)
+    np.testing.assert_allclose(values, expected, rtol=1e-6)
+    assert (metadata['width'], metadata['height']) == (40, 50)
+    assert stats['valid_pixels'] == 50 * 40 - 1
+    assert stats['min'] == pytest.approx(-0.25) and stats['max'] == pytest.approx(0.5)
+    assert stats['histogram'].sum() == stats['valid_pixels']
+
+    threshold = water_threshold(stats, detection_settings('ndwi', method='otsu'), normalized=False)
+    assert -0.25 < threshold < 0.5
+    assert int((values > threshold).sum()) == 50 * 40 - 1 - 200
+
+    with pytest.raises(ValueError):
+        read_index(file_path, 'ndwi', (1, 3))
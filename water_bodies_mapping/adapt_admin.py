@@ -1,10 +1,17 @@
 import streamlit as st
 import os
-import sqlite3
 from datetime import datetime
 import pandas as pd
 import plotly.express as px
-import base64
+from file_server import file_url
+from excel_cache import read_excel_cached, convert_workbook, remove_cached_workbook
+from upload_storage import save_upload
+import ingestion_jobs
+import water_body_store
+import contributions_db
+import file_catalog
+import instrumentation
+from raster_stats_store import delete_raster_stats
 
 # Set the page configuration
 st.set_page_config(layout='wide', page_title="ADAPT - Advanced Data Analytics", page_icon="📊")
@@ -12,30 +19,12 @@ st.set_page_config(layout='wide', page_title="ADAPT - Advanced Data Analytics",
 # Define the folder paths
 upload_folder = 'water_bodies_mapping/TIFF images'
 excel_folder = 'water_bodies_mapping/datasets'
-database_path = os.path.join(upload_folder, 'map_contributions.db')
 map_contributions_folder = 'water_bodies_mapping/map contributions'
 
 # Function to check the username and password
 def check_credentials(username, password):
     return username == "admin" and password == "password"
 
-# Function to initialize the database and create the contributions table
-def init_database():
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS contributions (
-        id INTEGER PRIMARY KEY,
-        map_name TEXT,
-        contributor TEXT,
-        email TEXT,
-        timestamp TEXT,
-        file_path TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
 # Function to display info icon with tooltip
 def info_icon(message):
     return f'<span style="cursor: pointer; float: right; margin-left: 10px;" title="{message}">ℹ️</span>'
@@ -52,27 +41,29 @@ def admin_panel():
     # Function to handle GeoTIFF file upload
     def upload_geotiff():
         if uploaded_file is not None:
-            file_path = os.path.join(upload_folder, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            stored = save_upload(uploaded_file, os.path.join(upload_folder, uploaded_file.name))
+            file_path = stored['published_path']
+            file_name = os.path.basename(file_path)
+            file_catalog.add_file(file_path, stored['sha256'])
+            if stored['duplicate']:
+                st.info(f"ℹ️ '{uploaded_file.name}' is identical to a file that is already stored, so no extra storage was used.")
 
             timestamp = datetime.now().isoformat()
-            st.success(f"🎉 Successfully uploaded '{uploaded_file.name}' to '{upload_folder}' on {timestamp}.")
-            log_contribution(uploaded_file.name, timestamp)
+            contribution_id = log_contribution(file_name, timestamp, stored['path'], stored['size'])
+            # Validation, reprojection, optimization and analysis run in background workers
+            job_id = ingestion_jobs.enqueue_job(stored, 'admin', contribution_id)
+            st.success(f"🎉 Successfully uploaded '{file_name}' to '{upload_folder}' on {timestamp}. Processing is queued as job #{job_id}.")
 
     # Log the contribution in the database
-    def log_contribution(file_name, timestamp):
-        conn = sqlite3.connect(database_path)
-        c = conn.cursor()
-        c.execute('INSERT INTO contributions (map_name, contributor, email, timestamp, file_path) VALUES (?, ?, ?, ?, ?)',
-                  (file_name, "Admin", "admin@example.com", timestamp, os.path.join(upload_folder, file_name)))
-        conn.commit()
-        conn.close()
+    def log_contribution(file_name, timestamp, stored_path, file_size):
+        return contributions_db.insert_contribution(file_name, "Admin", "admin@example.com", timestamp, stored_path, file_size)
 
     # Create an upload button for GeoTIFF
     if st.button("📥 Upload GeoTIFF"):
         upload_geotiff()
 
+    ingestion_jobs_panel()
+
     # Header for Uploaded Files
     st.markdown("<h2 style='color: #4B0082;'>📂 View Uploaded Files" + info_icon("Supported formats: GeoTIFF files (.tif, .tiff), Shapefiles (.shp), DXF files (.dxf), Image files (.png, .jpg, .jpeg)") + "</h2>", unsafe_allow_html=True)
     
@@ -90,8 +81,9 @@ def admin_panel():
     st.divider()
     st.markdown("<h2 style='color: #4B0082;'>📊 Manage Excel Database" + info_icon("Supported format: Excel files (.xlsx)") + "</h2>", unsafe_allow_html=True)
 
-    # List existing Excel files
-    existing_excel_files = [f for f in os.listdir(excel_folder) if f.endswith('.xlsx')]
+    # List existing Excel files from the catalog
+    file_catalog.reconcile(excel_folder)
+    existing_excel_files = file_catalog.list_names(excel_folder, ['.xlsx'])
     if existing_excel_files:
         # Select box for current Excel files
         selected_file = st.selectbox("📝 Select an Excel file to delete:", existing_excel_files)
@@ -99,6 +91,9 @@ def admin_panel():
         # Delete selected file
         if st.button("🗑️ Delete Selected Excel File"):
             os.remove(os.path.join(excel_folder, selected_file))
+            remove_cached_workbook(os.path.join(excel_folder, selected_file))
+            water_body_store.remove_dataset(os.path.join(excel_folder, selected_file))
+            file_catalog.remove_file(os.path.join(excel_folder, selected_file))
             st.success(f"🎉 Successfully deleted '{selected_file}'.")
 
     # Input field for new Excel file name
@@ -109,57 +104,80 @@ def admin_panel():
     def replace_excel_database():
         if excel_file is not None and new_excel_file_name:
             new_file_path = os.path.join(excel_folder, new_excel_file_name + ".xlsx")
-            with open(new_file_path, "wb") as f:
-                f.write(excel_file.getbuffer())
+            # Replacing is intended here, so the published name is swapped atomically
+            stored = save_upload(excel_file, new_file_path, overwrite=True)
+            file_catalog.add_file(new_file_path, stored['sha256'])
+            # Convert the workbook now so the first viewer doesn't pay for parsing it
+            convert_workbook(new_file_path)
+            try:
+                water_body_store.load_dataset(new_file_path)
+            except ValueError as e:
+                st.warning(f"⚠️ The workbook was saved but cannot be queried as a water body dataset: {e}")
             st.success(f"🎉 Successfully replaced the Excel database with '{new_excel_file_name}.xlsx'.")
 
     # Create a button to replace the Excel database
     if st.button("🔄 Replace Excel Database"):
         replace_excel_database()
 
-def list_uploaded_files():
-    if 'uploaded_files' not in st.session_state:
-        st.session_state.uploaded_files = os.listdir(upload_folder)
+# Function to show a page selector and return the zero-based page index
+def page_selector(total, page_size, key):
+    num_pages = max(1, (total + page_size - 1) // page_size)
+    if num_pages == 1:
+        return 0
+    page = st.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, value=1, key=key)
+    return page - 1
 
-    files = st.session_state.uploaded_files
-    
-    # Search Bar
-    search_query = st.text_input("🔍 Search by file name:", "")
+def list_uploaded_files():
+    # Files come from the catalog; a throttled reconcile picks up changes made outside the app
+    file_catalog.reconcile(upload_folder)
+
+    # Search Bar, backed by the catalog's search index (file names and contribution details)
+    col1, col2, col3 = st.columns([4, 2, 2])
+    search_query = col1.text_input("🔍 Search by file name or contributor:", "")
+    match = col2.selectbox("Match", ["contains", "prefix"], format_func=lambda m: "Contains" if m == "contains" else "Starts with (case-sensitive)")
+    sort = col3.selectbox("Sort by", list(file_catalog.SORT_COLUMNS), format_func=str.capitalize)
     
-    # Filtered Files
-    filtered_files = files
-    if search_query:
-        filtered_files = [file for file in files if search_query.lower() in file.lower()]
+    # Filtered Files, one page at a time so only the shown results cost widgets
+    page_size = file_catalog.DEFAULT_PAGE_SIZE
+    total = file_catalog.count_files(upload_folder, search=search_query, match=match)
+    page = page_selector(total, page_size, key="uploaded_files_page")
+    filtered_files = file_catalog.list_files(upload_folder, search=search_query, page=page, page_size=page_size,
+                                             match=match, sort=sort)
+    if total:
+        st.caption(f"{total} matching files")
     
     if filtered_files:
-        for file in filtered_files:
-            file_path = os.path.join(upload_folder, file)
-            file_size = os.path.getsize(file_path)  # Get file size in bytes
-            upload_time = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+        for entry in filtered_files:
+            file, file_path = entry['name'], entry['path']
+            upload_time = datetime.fromtimestamp(entry['mtime_ns'] / 1e9).strftime('%Y-%m-%d %H:%M:%S')
 
             st.write(file)
-            st.write(f"**Size**: {file_size / 1024:.2f} KB | **Uploaded On**: {upload_time}")
+            st.write(f"**Size**: {entry['size'] / 1024:.2f} KB | **Uploaded On**: {upload_time}")
 
             delete_button = st.button(f"🗑️ Delete {file}", key=file)
             if delete_button:
                 os.remove(file_path)
-                st.session_state.uploaded_files.remove(file)  # Remove from session state
+                delete_raster_stats(file_path)
+                file_catalog.remove_file(file_path)
                 st.success(f"🎉 '{file}' has been deleted.")
                 break  # Exit the loop to refresh the display
     else:
         st.warning("⚠️ No files match your search criteria.")
 
 def view_map_contributions():
-    map_files = [f for f in os.listdir(map_contributions_folder) if f.endswith(('.tif', '.tiff', '.shp', '.dxf', '.png', '.jpg', '.jpeg'))]
+    file_catalog.reconcile(map_contributions_folder)
+    extensions = ['.tif', '.tiff', '.shp', '.dxf', '.png', '.jpg', '.jpeg']
+    page_size = file_catalog.DEFAULT_PAGE_SIZE
+    page = page_selector(file_catalog.count_files(map_contributions_folder, extensions), page_size, key="map_contributions_page")
+    map_files = file_catalog.list_files(map_contributions_folder, extensions, page=page, page_size=page_size)
     
     if map_files:
-        for map_file in map_files:
-            file_path = os.path.join(map_contributions_folder, map_file)
-            file_size = os.path.getsize(file_path)  # Get file size in bytes
-            upload_time = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+        for entry in map_files:
+            map_file, file_path = entry['name'], entry['path']
+            upload_time = datetime.fromtimestamp(entry['mtime_ns'] / 1e9).strftime('%Y-%m-%d %H:%M:%S')
 
             st.write(map_file)
-            st.write(f"**Size**: {file_size / 1024:.2f} KB | **Uploaded On**: {upload_time}")
+            st.write(f"**Size**: {entry['size'] / 1024:.2f} KB | **Uploaded On**: {upload_time}")
 
             # Display the map image if it's a supported format
             if map_file.lower().endswith(('.png', '.jpg', '.jpeg')):
@@ -169,28 +187,74 @@ def view_map_contributions():
 
             col1, col2 = st.columns([3, 1])
             with col1:
-                # Use HTML to create a styled download button
-                st.markdown(f"""
-                    <a href="data:file/octet-stream;base64,{get_file_data(file_path)}" download="{map_file}" 
-                       style="display:inline-block; background-color:#4B0082; color:white; padding:10px 20px; 
-                       border-radius:5px; text-decoration:none; transition: background-color 0.3s;">
-                       📥 Download {map_file}
-                    </a>
-                """, unsafe_allow_html=True)
+                render_download(file_path, map_file)
 
             with col2:
                 # Use a simple button for delete
                 if st.button(f"🗑️ Delete {map_file}", key=f"delete_{map_file}"):
                     os.remove(file_path)
+                    delete_raster_stats(file_path)
+                    file_catalog.remove_file(file_path)
                     st.success(f"🎉 '{map_file}' has been deleted.")
                     break  # Exit the loop to refresh the display
     else:
         st.warning("⚠️ No map contributions found.")
 
-def get_file_data(file_path):
-    with open(file_path, "rb") as f:
-        data = f.read()
-    return base64.b64encode(data).decode()
+# Function to offer a download without reading the file while the page renders
+def render_download(file_path, file_name):
+    url = file_url(file_path)
+    if url is not None:
+        # With a public file server configured, the file is streamed from disk only when the link is clicked
+        st.markdown(f"""
+            <a href="{url}" download="{file_name}" 
+               style="display:inline-block; background-color:#4B0082; color:white; padding:10px 20px; 
+               border-radius:5px; text-decoration:none; transition: background-color 0.3s;">
+               📥 Download {file_name}
+            </a>
+        """, unsafe_allow_html=True)
+    elif st.session_state.get(f"prepare_{file_name}"):
+        # By default only the file the admin asked for is read, and Streamlit serves it
+        with open(file_path, "rb") as f:
+            st.download_button(label=f"📥 Download {file_name}", data=f, file_name=file_name, key=f"download_{file_name}")
+    else:
+        st.button(f"📦 Prepare download of {file_name}", key=f"prepare_{file_name}")
+
+# Function to show the state of the background ingestion jobs
+def ingestion_jobs_panel():
+    with st.expander("⚙️ Ingestion Jobs"):
+        counts = ingestion_jobs.status_counts()
+        for column, (status, count) in zip(st.columns(len(counts)), counts.items()):
+            column.metric(status.capitalize(), count)
+        if ingestion_jobs.worker_settings() == 0:
+            st.info("ℹ️ Workers are disabled in this app (ADAPT_INGEST_WORKERS=0); jobs run in the public app or a dedicated worker.")
+
+        jobs = ingestion_jobs.list_jobs(limit=50)
+        if jobs:
+            st.dataframe(pd.DataFrame(jobs), hide_index=True)
+        if counts['failed'] and st.button("🔁 Retry failed jobs"):
+            st.success(f"Requeued {ingestion_jobs.retry_failed_jobs()} job(s).")
+        st.button("🔄 Refresh jobs")
+
+# Function to show p50/p95 latencies per pipeline stage and per file
+def stage_latency_panel():
+    st.subheader("⏱️ Stage Latencies")
+    if not instrumentation.ENABLED:
+        st.info("ℹ️ Stage timings are only recorded when the apps run with ADAPT_METRICS=1.")
+
+    periods = {"Last 24 hours": 86400, "Last 7 days": 7 * 86400, "Last 30 days": 30 * 86400}
+    period = st.selectbox("🕒 Period", list(periods), key="latency_period")
+    by_stage = instrumentation.stage_percentiles(periods[period])
+    if by_stage.empty:
+        st.warning("⚠️ No stage timings recorded in this period.")
+        return
+
+    fig = px.bar(by_stage.melt(id_vars='stage', value_vars=['p50_ms', 'p95_ms'], var_name='percentile', value_name='milliseconds'),
+                 x='stage', y='milliseconds', color='percentile', barmode='group', title='p50 / p95 Latency per Stage')
+    st.plotly_chart(fig)
+    st.dataframe(by_stage, hide_index=True)
+
+    with st.expander("📄 Latencies per File"):
+        st.dataframe(instrumentation.stage_percentiles(periods[period], by_file=True), hide_index=True)
 
 # KPI Metrics Page Function
 def kpi_metrics_page():
@@ -198,27 +262,16 @@ def kpi_metrics_page():
     st.markdown("<h2 style='text-align: center; color: #4B0082;'>📊 KPI Metrics</h2>", unsafe_allow_html=True)
     st.divider()
 
-    # Connect to the database and fetch metrics
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-
-    # Fetch total contributions
-    c.execute('SELECT COUNT(*) FROM contributions')
-    total_contributions = c.fetchone()[0]
-
-    # Fetch the latest upload timestamp
-    c.execute('SELECT MAX(timestamp) FROM contributions')
-    last_upload_timestamp = c.fetchone()[0]
+    # Fetch metrics through the shared, pooled database connection
+    total_contributions = contributions_db.count_contributions()
+    last_upload_timestamp = contributions_db.last_upload_timestamp()
 
-    # Fetch total file size over time with file names
-    c.execute('SELECT timestamp, SUM(LENGTH(file_path)), GROUP_CONCAT(map_name) FROM contributions GROUP BY timestamp ORDER BY timestamp')
-    size_over_time = c.fetchall()
-
-    # Close the database connection
-    conn.close()
+    # Fetch the size rollup, which is kept up to date by database triggers
+    granularity = st.sidebar.selectbox("🕒 Size chart interval", list(contributions_db.ROLLUP_GRANULARITIES), index=1)
+    size_over_time = contributions_db.size_over_time(granularity)
 
     # Convert the data into a DataFrame for plotting
-    df_size = pd.DataFrame(size_over_time, columns=['timestamp', 'total_size', 'file_names'])
+    df_size = pd.DataFrame(size_over_time, columns=['timestamp', 'count', 'bytes', 'total_size'])
     df_size['timestamp'] = pd.to_datetime(df_size['timestamp'])
     
     # Display the metrics in a nice format using columns
@@ -274,25 +327,31 @@ def kpi_metrics_page():
     st.subheader("📈 Total Size of Contributions Over Time")
     fig = px.line(df_size, x='timestamp', y='total_size', title='Total Size of Contributions Over Time (in bytes)', markers=True)
 
-    # Update hover data to include file names
-    fig.update_traces(hovertemplate='Date: %{x}<br>Total Size: %{y} bytes<br>Files: %{customdata}<extra></extra>', 
-                      customdata=df_size['file_names'])
+    # Update hover data to include the uploads of each period
+    fig.update_traces(hovertemplate='Date: %{x}<br>Total Size: %{y} bytes<br>Uploaded: %{customdata[0]} files, '
+                                    '%{customdata[1]} bytes<extra></extra>',
+                      customdata=df_size[['count', 'bytes']])
 
     st.plotly_chart(fig)
 
+    # Stage latencies recorded by the instrumentation hooks in the public app
+    st.divider()
+    stage_latency_panel()
+
     # Display the Excel DataFrame
     st.divider()
     st.markdown("<h2 style='color: #4B0082;'>📊 Water Body Sizes Data</h2>", unsafe_allow_html=True)
 
     # List existing Excel files and select one to display
-    existing_excel_files = [f for f in os.listdir(excel_folder) if f.endswith('.xlsx')]
+    file_catalog.reconcile(excel_folder)
+    existing_excel_files = file_catalog.list_names(excel_folder, ['.xlsx'])
     if existing_excel_files:
         selected_excel_file = st.selectbox("📝 Select an Excel file to display:", existing_excel_files)
 
         # Load and display the selected Excel data
         try:
             excel_file_path = os.path.join(excel_folder, selected_excel_file)
-            df_water_body_sizes = pd.read_excel(excel_file_path)
+            df_water_body_sizes = read_excel_cached(excel_file_path)
             st.dataframe(df_water_body_sizes)
         except Exception as e:
             st.error(f"⚠️ Error loading Excel file: {e}")
@@ -301,7 +360,8 @@ def kpi_metrics_page():
 
 # Main function
 def main():
-    init_database()  # Initialize the database
+    contributions_db.init_database()  # Initialize the database
+    ingestion_jobs.start_workers()
     st.sidebar.title("📚 ADAPT Admin Navigation")
     
     # Navigation Links
@@ -1,18 +1,29 @@
 import streamlit as st
-import rasterio
-import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
 import os
 import openpyxl
-import sqlite3
 import tempfile
 import matplotlib.pyplot as plt
 import time
 from datetime import datetime
 from PIL import Image
-from scipy.ndimage import label
+from concurrent.futures import as_completed
+from raster_cache import get_raster_cache
+from raster_analysis import process_geotiff, executor_settings, get_executor, create_heatmap
+from water_thresholds import THRESHOLD_METHODS, WATER_INDICES, DEFAULT_INDEX_BANDS, DEFAULT_DETECTION, detection_settings, describe_detection
+from tile_server import register_raster, create_tile_map, tiles_enabled
+from water_body_vectors import water_body_geojson, load_water_body_geojson
+from temporal_analysis import RasterStack, temporal_analysis, frequency_geotiff_bytes
+from water_body_measurement import compare_with_dataset
+import water_body_store
+from upload_storage import save_upload
+import ingestion_jobs
+import contributions_db
+import file_catalog
+import instrumentation
+from instrumentation import stage
 
 st.set_page_config(layout='wide')
 
@@ -22,50 +33,101 @@ with st.sidebar:
     with st.container(border=True):
         st.image(image, caption='Advanced Data Analytics and Predictive Technology', use_column_width=True)
 
-# Function to read GeoTIFF and return the data, bounds, and metadata
-def read_geotiff(file_path):
-    with rasterio.open(file_path) as src:
-        img_data = src.read(1)  # Read the first band
-        bounds = src.bounds
-        nodata = src.nodata
-        metadata = src.meta  # Get metadata
-        if nodata is not None:
-            img_data = np.where(img_data == nodata, np.nan, img_data)  # Handle no data values
-    return img_data, bounds, metadata
-
-# Function to count water bodies
-def count_water_bodies(img_data):
-    threshold = 0.5  # Adjust this threshold based on your specific data
-    binary_mask = img_data > threshold  # Create a binary mask for water bodies
-    labeled_array, num_features = label(binary_mask)
-    return num_features  # Return the number of detected water bodies
-
-# Function to create heatmap
-def create_heatmap(fig, img_data_normalized, bounds, selected_file):
-    x = np.linspace(bounds.left, bounds.right, img_data_normalized.shape[1])
-    y = np.linspace(bounds.bottom, bounds.top, img_data_normalized.shape[0])
-
-    fig.add_trace(go.Heatmap(
-        z=img_data_normalized,
-        x=x,  # Longitude
-        y=y,  # Latitude
-        colorscale='Viridis',
-        colorbar=dict(title='Normalized Value'),
-        showscale=True,
-    ))
-    fig.update_layout(
-        title=f'GeoTIFF Visualization: {selected_file}',
-        xaxis_title='Longitude',
-        yaxis_title='Latitude',
-        xaxis=dict(scaleanchor="y"),
-        yaxis=dict(constrain='domain'),
-        yaxis_autorange='reversed',  # Reverse y-axis for true north
-        mapbox=dict(
-            style='carto-positron',
-            center=dict(lon=(bounds.left + bounds.right) / 2, lat=(bounds.top + bounds.bottom) / 2),
-            zoom=10,
+# Function to describe the heatmap payload in a caption
+def payload_caption(payload):
+    full_rows, full_cols = payload['full_shape']
+    rows, cols = payload['display_shape']
+    return (f"📦 Figure payload: {payload['payload_bytes'] / 1024:.1f} KB at {cols}×{rows} px "
+            f"(full resolution {full_cols}×{full_rows} px ≈ {payload['full_payload_bytes'] / 1024:.1f} KB)")
+
+# Function to show the water detection controls and return the chosen settings
+def water_detection_controls():
+    col1, col2 = st.columns(2)
+    index = col1.selectbox("💧 Detect water on", list(WATER_INDICES), format_func=WATER_INDICES.get,
+                           help="NDWI and MNDWI are computed from two bands of multi-spectral GeoTIFFs; only those bands are read.")
+    method = col2.selectbox("✂️ Threshold", list(THRESHOLD_METHODS), format_func=THRESHOLD_METHODS.get,
+                            help="Otsu and percentile thresholds are computed from a histogram gathered while the raster is read.")
+
+    band_labels = {'band': ["Band"], 'ndwi': ["Green band", "NIR band"], 'mndwi': ["Green band", "SWIR band"]}[index]
+    band_columns = st.columns(len(band_labels))
+    bands = [column.number_input(band_label, min_value=1, value=default, step=1, key=f"{index}_band_{position}")
+             for position, (column, band_label, default) in enumerate(zip(band_columns, band_labels, DEFAULT_INDEX_BANDS[index]))]
+
+    threshold = percentile = None
+    if method == 'fixed':
+        low, default = (0.0, DEFAULT_DETECTION['threshold']) if index == 'band' else (-1.0, 0.0)
+        threshold = st.slider("Water threshold", low, 1.0, default, 0.01,
+                              help="Normalized band values (or index values) above this are treated as water.")
+    elif method == 'percentile':
+        percentile = st.slider("Percentile", 50.0, 99.9, DEFAULT_DETECTION['percentile'], 0.1,
+                               help="Pixels above this percentile of the layer are treated as water.")
+    return detection_settings(index, bands, method, threshold, percentile if percentile is not None else DEFAULT_DETECTION['percentile'])
+
+# Function to render one processed GeoTIFF: heatmap, water body count, metadata and download
+def render_geotiff_result(result, dataset, map_view=False):
+    selected_file = result['file_name']
+    # Outlines are traced on the normalized first band, so they are only offered when water was detected on it
+    traceable = result['detection']['index'] == 'band' and tuple(result['detection']['bands']) == (1,)
+    tiles = register_raster(result['file_path']) if map_view else None
+    if tiles is not None:
+        # Tiles are rendered from the GeoTIFF as the map is panned and zoomed, at full resolution when zoomed in
+        outlines = None
+        if traceable:
+            with st.spinner("Tracing water body outlines..."):
+                outlines = load_water_body_geojson(result['file_path'], result['threshold'])
+        fig = go.Figure()
+        create_tile_map(fig, tiles, selected_file, outlines)
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption("🧩 Map tiles are rendered on demand; only the tiles in view are transferred.")
+    else:
+        if map_view:
+            st.info("ℹ️ The tile server is not available, so the raster is shown as a heatmap.")
+        # Figure serialization and transfer to the browser happen inside st.plotly_chart
+        with stage('plotly_chart', selected_file) as timer:
+            st.plotly_chart(result['figure'], use_container_width=True)
+            timer.add_bytes(result['payload']['payload_bytes'])
+        st.caption(payload_caption(result['payload']))
+
+    st.write(f"👁️ Estimated Number of Water Bodies Detected: {result['num_water_bodies']}")
+    st.caption(f"💧 Water detected with a {describe_detection(result['detection'], result['threshold'])}.")
+
+    with st.expander("📐 Water Body Measurements"):
+        table = result['water_bodies']
+        st.dataframe(table, hide_index=True)
+        if not table.empty:
+            # Only the surveyed water bodies inside the detected extent are fetched from the store
+            nearby = water_body_store.water_bodies_in_bounds(dataset, table['min_lon'].min(), table['min_lat'].min(),
+                                                             table['max_lon'].max(), table['max_lat'].max())
+            comparison = compare_with_dataset(table, nearby)
+        else:
+            comparison = pd.DataFrame()
+        if not comparison.empty:
+            st.write("Measured areas compared with the water body database:")
+            st.dataframe(comparison, hide_index=True)
+
+    st.subheader("📜 Metadata")
+    st.json(result['metadata'])
+
+    with open(result['file_path'], "rb") as f:
+        st.download_button(
+            label="⬇️ Download " + selected_file,
+            data=f,
+            file_name=selected_file,
+            mime="image/tiff"
         )
-    )
+
+    # Outlines are vectorized on request and cached as GeoJSON per raster and threshold
+    if traceable and st.button("🧭 Prepare water body outlines (GeoJSON)", key=f"outlines_{selected_file}"):
+        with st.spinner("Tracing water body outlines..."):
+            geojson_path = water_body_geojson(result['file_path'], result['threshold'])
+        with open(geojson_path, "rb") as f:
+            st.download_button(
+                label=f"⬇️ Download outlines of {selected_file} ({os.path.getsize(geojson_path) / 1024:.1f} KB)",
+                data=f,
+                file_name=f"{os.path.splitext(selected_file)[0]}_water_bodies.geojson",
+                mime="application/geo+json",
+                key=f"download_outlines_{selected_file}"
+            )
 
 # Water Body Analysis Page
 def water_body_analysis():
@@ -73,76 +135,67 @@ def water_body_analysis():
         st.markdown("<h1 style='text-align: center; color: #4B0082;'>🌊 ADAPT Water Body Analysis</h1>", unsafe_allow_html=True)
 
     folder_path = 'water_bodies_mapping/TIFF images'
+    # The workbook is loaded into an indexed table once per version; filters and charts run as queries on it
+    dataset = water_body_store.load_dataset('water_bodies_mapping/datasets/2024 water body sizes.xlsx')
 
     if os.path.isdir(folder_path):
-        files = [f for f in os.listdir(folder_path) if f.endswith('.tif')]
+        file_catalog.reconcile(folder_path)
+        files = file_catalog.list_names(folder_path, ['.tif'])
 
         if files:
             with st.expander("📂 Click Here To Select GeoTIFF Files To View & Download"):
                 selected_files = st.multiselect("Select GeoTIFF files:", files)
+                full_resolution = st.toggle("🔍 Load full-resolution rasters", value=False,
+                                            help="By default maps are drawn from statistics and previews stored when the file was uploaded.")
+                # Tiles are fetched by the browser, so they need the file server's public URL (ADAPT_FILE_SERVER_URL)
+                map_view = st.toggle("🗺️ Show as zoomable map", value=False, disabled=not tiles_enabled(),
+                                     help="Draw each raster as map tiles that stay sharp when zooming in." if tiles_enabled() else
+                                     "Needs a public file server (ADAPT_FILE_SERVER_URL and ADAPT_FILE_SERVER_PORT); rasters are shown as heatmaps.")
+                detection = water_detection_controls()
 
             if selected_files:
                 num_files = len(selected_files)
                 num_rows = (num_files + 1) // 2  # Calculate number of rows needed
 
+                # Lay out one slot per file in selection order so results can be drawn as they finish
+                slots = []
                 for row in range(num_rows):
                     col1, col2 = st.columns(2)
-
-                    # First column
-                    with col1:
-                        if row * 2 < num_files:
-                            selected_file = selected_files[row * 2]
-                            file_path = os.path.join(folder_path, selected_file)
-                            img_data, bounds, metadata = read_geotiff(file_path)
-
-                            img_data_normalized = (img_data - np.nanmin(img_data)) / (np.nanmax(img_data) - np.nanmin(img_data))
-
-                            fig1 = go.Figure()
-                            create_heatmap(fig1, img_data_normalized, bounds, selected_file)
-                            st.plotly_chart(fig1, use_container_width=True)
-
-                            num_water_bodies = count_water_bodies(img_data_normalized)
-                            st.write(f"👁️ Estimated Number of Water Bodies Detected: {num_water_bodies}")
-
-                            st.subheader("📜 Metadata")
-                            st.json(metadata)
-
-                            with open(file_path, "rb") as f:
-                                st.download_button(
-                                    label="⬇️ Download " + selected_file,
-                                    data=f,
-                                    file_name=selected_file,
-                                    mime="image/tiff"
-                                )
-
-                    # Second column
-                    with col2:
-                        if row * 2 + 1 < num_files:
-                            selected_file = selected_files[row * 2 + 1]
-                            file_path = os.path.join(folder_path, selected_file)
-                            img_data, bounds, metadata = read_geotiff(file_path)
-
-                            img_data_normalized = (img_data - np.nanmin(img_data)) / (np.nanmax(img_data) - np.nanmin(img_data))
-
-                            fig2 = go.Figure()
-                            create_heatmap(fig2, img_data_normalized, bounds, selected_file)
-                            st.plotly_chart(fig2, use_container_width=True)
-
-                            num_water_bodies = count_water_bodies(img_data_normalized)
-                            st.write(f"👁️ Estimated Number of Water Bodies Detected: {num_water_bodies}")
-
-                            st.subheader("📜 Metadata")
-                            st.json(metadata)
-
-                            with open(file_path, "rb") as f:
-                                st.download_button(
-                                    label="⬇️ Download " + selected_file,
-                                    data=f,
-                                    file_name=selected_file,
-                                    mime="image/tiff"
-                                )
-                                
-                                
+                    slots.append(col1.container())
+                    if row * 2 + 1 < num_files:
+                        slots.append(col2.container())
+
+                mode, workers = executor_settings()
+                executor = get_executor(mode, workers)
+                if executor is None:
+                    for index, selected_file in enumerate(selected_files):
+                        with slots[index]:
+                            try:
+                                result = process_geotiff(os.path.join(folder_path, selected_file), selected_file, full_resolution, detection)
+                            except ValueError as e:
+                                # e.g. an index needs bands the file does not have
+                                st.error(f"⚠️ {selected_file}: {e}")
+                                continue
+                            render_geotiff_result(result, dataset, map_view)
+                else:
+                    futures = {executor.submit(process_geotiff, os.path.join(folder_path, selected_file), selected_file, full_resolution,
+                                               detection): index
+                               for index, selected_file in enumerate(selected_files)}
+                    for future in as_completed(futures):
+                        with slots[futures[future]]:
+                            try:
+                                result = future.result()
+                            except ValueError as e:
+                                st.error(f"⚠️ {selected_files[futures[future]]}: {e}")
+                                continue
+                            render_geotiff_result(result, dataset, map_view)
+                instrumentation.flush()
+
+                # Raster cache counters for this server process
+                cache_stats = get_raster_cache().stats()
+                st.caption(f"🗃️ Raster cache: {cache_stats['entries']} rasters, "
+                           f"{cache_stats['bytes'] / 1024 ** 2:.1f} / {cache_stats['max_bytes'] / 1024 ** 2:.0f} MB | "
+                           f"hits {cache_stats['hits']}, misses {cache_stats['misses']}, evictions {cache_stats['evictions']}")
 
             else:
                 st.warning("⚠️ Please select at least one file to visualize.")
@@ -157,62 +210,74 @@ def water_body_analysis():
     with st.container(border=False):
         st.markdown("<h1 style='text-align: center; color: #4B0082;'>📊 ADAPT Water Body Database</h1>", unsafe_allow_html=True)
 
-    df = pd.read_excel('water_bodies_mapping/datasets/2024 water body sizes.xlsx')
-
     with st.expander(label="📈 View Water Body Database, Graphs and Charts", expanded=False):
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
 
-        water_body_names = df['water body name'].unique()
+        water_body_names = water_body_store.distinct_values(dataset, 'name')
         with col1:
             selected_names = st.multiselect("Select Water Body Names To Start Analysis:", water_body_names)
 
         with col2:
+            # Slider bounds come from the area range stored when the workbook was loaded
             min_area, max_area = st.slider("Select Area Range (square meters):", 
-                                             float(df['area (square meters)'].min()), 
-                                             float(df['area (square meters)'].max()), 
-                                             (float(df['area (square meters)'].min()), 
-                                              float(df['area (square meters)'].max())))
+                                             float(dataset['min_area']), 
+                                             float(dataset['max_area']), 
+                                             (float(dataset['min_area']), 
+                                              float(dataset['max_area'])))
+
+        with col3:
+            selected_purposes = st.multiselect("Filter By Use/ Purpose (optional):", water_body_store.distinct_values(dataset, 'purpose'))
 
         if selected_names:
-            filtered_df = df[(df['water body name'].isin(selected_names)) & 
-                             (df['area (square meters)'] >= min_area) & 
-                             (df['area (square meters)'] <= max_area)]
+            filters = {'names': selected_names, 'min_area': min_area, 'max_area': max_area, 'purposes': selected_purposes}
+            summary = water_body_store.summarize(dataset, filters)
 
-            if filtered_df.empty:
+            if summary['count'] == 0:
                 st.warning("⚠️ No water bodies found matching your criteria. Please adjust your filters.")
             else:
+                # Only the requested page of rows is read from the store
+                page_size = water_body_store.DEFAULT_PAGE_SIZE
+                num_pages = (summary['count'] - 1) // page_size + 1
                 col1, col2, col3 = st.columns([1, 5, 1])
                 col1.empty()
-                col2.dataframe(filtered_df)
+                with col2:
+                    page = st.number_input("Page", min_value=1, max_value=num_pages, value=1, step=1) - 1 if num_pages > 1 else 0
+                    st.dataframe(water_body_store.water_bodies_page(dataset, filters, page, page_size), hide_index=True)
+                    st.caption(f"Showing {page * page_size + 1}–{min((page + 1) * page_size, summary['count'])} of "
+                               f"{summary['count']} water bodies ({summary['total_area']:,.0f} m² in total)")
                 col3.empty()
                 st.divider()
 
-                fig1 = px.bar(filtered_df,
+                # The largest water bodies are drawn individually and the rest are grouped into one 'Others' entry
+                top_bodies = water_body_store.top_water_bodies(dataset, filters)
+                fig1 = px.bar(top_bodies,
                               x='water body name',
                               y='area (square meters)',
                               hover_name='water body name',
-                              hover_data='use/ purpose',
+                              hover_data=['use/ purpose', 'count'],
                               color='area (square meters)',
-                              title='Filtered Bulawayo Water Bodies by Size and Usage Information')
+                              title='Filtered Bulawayo Water Bodies by Size and Usage Information (largest first)')
                 st.plotly_chart(fig1)
                 st.divider()
 
                 coz1, coz2 = st.columns([6, 2])
-                fig2 = px.bar(filtered_df,
-                               x='area (square meters)',
-                               y='water body name',
-                               hover_name='water body name',
-                               hover_data='use/ purpose',
-                               color='area (square meters)',
+                histogram = water_body_store.area_histogram(dataset, filters)
+                histogram['area range'] = [f"{low:,.0f} – {high:,.0f}" for low, high in zip(histogram['area from'], histogram['area to'])]
+                fig2 = px.bar(histogram,
+                               x='count',
+                               y='area range',
+                               hover_data=['total area'],
+                               color='total area',
                                orientation='h',
-                               title='Filtered Bulawayo Water Bodies Infographics Bar Chart')
+                               labels={'count': 'number of water bodies', 'area range': 'area (square meters)'},
+                               title='Filtered Bulawayo Water Bodies Infographics Bar Chart (size distribution)')
                 coz1.plotly_chart(fig2)
 
-                fig3 = px.pie(filtered_df,
+                fig3 = px.pie(top_bodies,
                                values='area (square meters)',
-                               labels='water body name',
+                               names='water body name',
                                hover_name='water body name',
-                               hover_data=['latitude', 'longitude'],
+                               hover_data=['count'],
                                title='Filtered Bulawayo Water Bodies Infographics Pie Chart')
                 coz2.plotly_chart(fig3)
 
@@ -271,31 +336,62 @@ def water_body_analysis():
             st.info("Find us on IG too")
             st.markdown("[Instagram Chat](https://www.instagram.com/mthoe_saps_construction_tech?igsh=MWZibnVpOWZkcmcyNg==)")
 
+# Temporal Analysis Page
+def temporal_analysis_page():
+    with st.container(border=False):
+        st.markdown("<h1 style='text-align: center; color: #4B0082;'>⏳ ADAPT Temporal Water Analysis</h1>", unsafe_allow_html=True)
+
+    folder_path = 'water_bodies_mapping/TIFF images'
+    if not os.path.isdir(folder_path):
+        st.warning("⚠️ The specified folder path is invalid.")
+        return
+    file_catalog.reconcile(folder_path)
+    files = file_catalog.list_names(folder_path, ['.tif'])
+
+    st.info("ℹ️ Select the rasters of one area in date order. Dates are read from the file names (e.g. 2024-03-01) or TIFF tags where available.")
+    selected_files = st.multiselect("Select GeoTIFF files in date order:", files, key="temporal_files")
+    if len(selected_files) < 2:
+        st.warning("⚠️ Please select at least two files to compare over time.")
+        return
+
+    if not st.button("▶️ Run Temporal Analysis"):
+        return
+
+    with st.spinner("Aligning and stacking rasters..."):
+        stack = RasterStack([os.path.join(folder_path, selected_file) for selected_file in selected_files])
+        result = temporal_analysis(stack)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Dates", len(result['labels']))
+    col2.metric("Gained water area (m²)", f"{result['gained_area_m2']:,.0f}")
+    col3.metric("Lost water area (m²)", f"{result['lost_area_m2']:,.0f}")
+
+    fig = go.Figure()
+    create_heatmap(fig, result['frequency'], result['grid'].bounds, f"water frequency over {len(result['labels'])} dates")
+    st.plotly_chart(fig, use_container_width=True)
+
+    wet_area = result['wet_area_m2'].rename_axis('date').reset_index(name='area (square meters)')
+    st.plotly_chart(px.line(wet_area, x='date', y='area (square meters)', markers=True, title='Total Water Area per Date'))
+
+    water_bodies = result['water_bodies']
+    if not water_bodies.empty:
+        # Chart the largest water bodies; the full table is below
+        largest = water_bodies.assign(peak=water_bodies[result['labels']].max(axis=1)).nlargest(20, 'peak').drop(columns='peak')
+        series = largest.melt(id_vars='water_body_id', var_name='date', value_name='area (square meters)')
+        series['water_body_id'] = series['water_body_id'].astype(str)
+        st.plotly_chart(px.line(series, x='date', y='area (square meters)', color='water_body_id', markers=True,
+                                title='Area of the 20 Largest Water Bodies per Date'))
+        with st.expander("📐 Water Body Areas per Date"):
+            st.dataframe(water_bodies, hide_index=True)
+
+    st.download_button(label="⬇️ Download frequency raster", data=frequency_geotiff_bytes(result),
+                       file_name="water_frequency.tif", mime="image/tiff")
+
 # Function for contributing maps
 def contribute_map():
     # Define the upload folder path
     upload_folder = "water_bodies_mapping/map contributions"
 
-    # Define the database path
-    database_path = os.path.join(upload_folder, 'map_contributions.db')
-
-    # Create or connect to the SQLite database
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-
-    # Create a table if it doesn't exist (including email)
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS contributions (
-        id INTEGER PRIMARY KEY,
-        map_name TEXT,
-        contributor TEXT,
-        email TEXT,
-        timestamp TEXT,
-        file_path TEXT
-    )
-    ''')
-    conn.commit()
-
     # Streamlit app title
     with st.container(border=False):
         st.markdown("<h1 style='text-align: center; color: #4B0082;'>🗺️ ADAPT Map Contribution Upload</h1>", unsafe_allow_html=True)
@@ -326,18 +422,31 @@ def contribute_map():
                 file_extension = os.path.splitext(uploaded_file.name)[1]
                 full_file_path = f"{file_path}{file_extension}"
 
-                with open(full_file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
+                # Stream the upload into the content-addressed store and publish it under the map name
+                with stage('upload_store', uploaded_file.name) as timer:
+                    stored = save_upload(uploaded_file, full_file_path)
+                    timer.add_bytes(stored['size'])
+                saved_name = os.path.basename(stored['published_path'])
+                with stage('catalog_update', saved_name):
+                    file_catalog.add_file(stored['published_path'], stored['sha256'])
             
                 # Insert record into the database
                 timestamp = datetime.now().isoformat()
-                c.execute('INSERT INTO contributions (map_name, contributor, email, timestamp, file_path) VALUES (?, ?, ?, ?, ?)',
-                          (map_name, contributor, email, timestamp, full_file_path))
-                conn.commit()
+                with stage('log_contribution', saved_name):
+                    contribution_id = contributions_db.insert_contribution(map_name, contributor, email, timestamp, stored['path'],
+                                                                           stored['size'])
+
+                # Validation, reprojection, optimization and analysis run in background workers
+                job_id = ingestion_jobs.enqueue_job(stored, 'contribution', contribution_id)
+                st.session_state.setdefault('ingest_jobs', []).append(job_id)
 
                 # Success message with a warm thank you note
-                st.success(f"🎉 Thank you for your contribution, {contributor}! Your file '{uploaded_file.name}' has been uploaded successfully as '{map_name}{file_extension}'.")
-                st.info("ℹ️ Please note that your uploaded map will first be processed before it is made available for others to download and reuse.")
+                st.success(f"🎉 Thank you for your contribution, {contributor}! Your file '{uploaded_file.name}' has been uploaded successfully as '{saved_name}'.")
+                if stored['duplicate']:
+                    st.info("ℹ️ An identical file had already been contributed, so no extra storage was used.")
+                if saved_name != f"{map_name}{file_extension}":
+                    st.warning(f"⚠️ A different map named '{map_name}{file_extension}' already exists, so your file was saved as '{saved_name}'.")
+                st.info(f"ℹ️ Your map has been queued for processing (job #{job_id}) before it is made available for others to download and reuse.")
             else:
                 st.warning("⚠️ Please enter all fields: Map Name, Contributor Name, and Contributor Email.")
 
@@ -348,21 +457,32 @@ def contribute_map():
         if st.button("📥 Upload Map"):
             upload_map()
 
+        # Processing state of the maps uploaded in this session
+        session_jobs = ingestion_jobs.list_jobs(st.session_state.get('ingest_jobs', []))
+        if session_jobs:
+            with st.expander("⚙️ Processing Status of Your Uploads", expanded=True):
+                st.dataframe(pd.DataFrame(session_jobs)[['id', 'file_name', 'status', 'step', 'attempts', 'error']], hide_index=True)
+                st.button("🔄 Refresh status")
+
+    # KPI Metrics
+    with stage('contribution_kpis'):
+        map_contributions_count = contributions_db.count_contributions()
+        last_upload_timestamp = contributions_db.last_upload_timestamp()
+
     with col2:
-        c.execute('SELECT * FROM contributions')
-        records = c.fetchall()
-        contribution_options = [f"{row[1]} by {row[2]} on {row[3]}" for row in records]
+        # Only one page of contributions is fetched per rerun, newest first
+        page_size = contributions_db.DEFAULT_PAGE_SIZE
+        num_pages = max(1, (map_contributions_count + page_size - 1) // page_size)
+        page = 0
+        if num_pages > 1:
+            page = st.number_input("Contributions page", min_value=1, max_value=num_pages, value=1) - 1
+        with stage('contributions_page'):
+            records = contributions_db.contributions_page(page, page_size)
+        contribution_options = [f"{row[1]} by {row[2]} on {row[4]}" for row in records]
         selected_contribution = st.selectbox("📜 Show Contributions", [""] + contribution_options)
         if selected_contribution:
             st.write(f"Selected Contribution: {selected_contribution}")
 
-    # KPI Metrics
-    c.execute('SELECT COUNT(*) FROM contributions')
-    map_contributions_count = c.fetchone()[0]
-
-    c.execute('SELECT MAX(timestamp) FROM contributions')
-    last_upload_timestamp = c.fetchone()[0]
-
     # Custom CSS for styling the metrics and header
     st.markdown("""
     <style>
@@ -390,6 +510,7 @@ def contribute_map():
     st.markdown(f'<div class="metric"><h4>Total Map Contributions</h4><h2>{map_contributions_count}</h2></div>', unsafe_allow_html=True)
     st.markdown(f'<div class="metric"><h4>Last Upload</h4><h2>{last_upload_timestamp}</h2></div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
+    instrumentation.flush()
 
     with st.sidebar:
         st.divider()
@@ -418,16 +539,16 @@ def contribute_map():
         For any questions or concerns regarding map contributions, please contact us using the contact us section on the water bodies mapping page..
         """)
 
-    # Close the database connection on app stop
-    conn.close()
-
 # Main function
 def main():
+    ingestion_jobs.start_workers()
     st.sidebar.title("📚 Navigation")
-    page = st.sidebar.radio("Select a page:", ["🌊 Water Body Analysis", "🗺️ Contribute Your Map"])
+    page = st.sidebar.radio("Select a page:", ["🌊 Water Body Analysis", "⏳ Temporal Analysis", "🗺️ Contribute Your Map"])
 
     if page == "🌊 Water Body Analysis":
         water_body_analysis()
+    elif page == "⏳ Temporal Analysis":
+        temporal_analysis_page()
     elif page == "🗺️ Contribute Your Map":
         contribute_map()
 
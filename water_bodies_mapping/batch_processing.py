@@ -0,0 +1,148 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import rasterio
+
+import file_catalog
+from raster_stats_store import compute_raster_stats, load_raster_stats, save_raster_stats
+
+TIFF_FOLDER = 'water_bodies_mapping/TIFF images'
+TIFF_EXTENSIONS = ['.tif', '.tiff']
+# Rasters with more pixels than this are labeled band by band instead of being read whole
+DEFAULT_TILED_ABOVE_PIXELS = 64 * 1024 * 1024
+# Workers are replaced after this many rasters, returning memory held by GDAL and numpy to the system
+DEFAULT_TASKS_PER_WORKER = 8
+DEFAULT_GDAL_CACHE_MB = 256
+
+REPORT_COLUMNS = ['file_name', 'status', 'width', 'height', 'crs', 'min_value', 'max_value', 'nodata_fraction',
+                  'water_body_count', 'total_water_area_m2', 'largest_water_body_m2', 'seconds', 'error', 'file_path']
+
+
+# Function to turn stored raster statistics into one report row
+def report_row(file_path, stats, status, seconds=0.0):
+    areas = stats['water_bodies']['area_m2']
+    return {
+        'file_name': os.path.basename(file_path),
+        'status': status,
+        'width': stats['width'],
+        'height': stats['height'],
+        'crs': stats['crs'],
+        'min_value': stats['min_value'],
+        'max_value': stats['max_value'],
+        'nodata_fraction': stats['nodata_fraction'],
+        'water_body_count': stats['water_body_count'],
+        'total_water_area_m2': float(areas.sum()),
+        'largest_water_body_m2': float(areas.max()) if len(areas) else 0.0,
+        'seconds': seconds,
+        'error': None,
+        'file_path': file_path,
+    }
+
+
+# Function to analyse one raster and store its statistics; runs in a worker process
+def process_file(file_path, tiled_above=DEFAULT_TILED_ABOVE_PIXELS, gdal_cache_mb=DEFAULT_GDAL_CACHE_MB):
+    start = time.perf_counter()
+    try:
+        # A bounded GDAL block cache keeps each worker's memory predictable
+        with rasterio.Env(GDAL_CACHEMAX=gdal_cache_mb):
+            with rasterio.open(file_path) as src:
+                tiled = src.width * src.height > tiled_above
+            stats = compute_raster_stats(file_path, tiled=tiled)
+        save_raster_stats(file_path, stats)
+    except Exception as e:
+        return {'file_name': os.path.basename(file_path), 'status': 'error', 'error': str(e), 'file_path': file_path,
+                'seconds': time.perf_counter() - start}, None
+    row = report_row(file_path, stats, 'processed', time.perf_counter() - start)
+    return row, stats['water_bodies'].assign(file_name=row['file_name'])
+
+
+# Function to analyse every raster in a folder, skipping those whose stored statistics are up to date
+def run_batch(folder=TIFF_FOLDER, workers=None, force=False, tiled_above=DEFAULT_TILED_ABOVE_PIXELS,
+              tasks_per_worker=DEFAULT_TASKS_PER_WORKER, gdal_cache_mb=DEFAULT_GDAL_CACHE_MB, progress=None):
+    file_catalog.reconcile(folder, force=True)
+    file_paths = [os.path.join(folder, name) for name in file_catalog.list_names(folder, TIFF_EXTENSIONS)]
+
+    rows = []
+    water_bodies = []
+    pending = []
+    for file_path in file_paths:
+        stored = None if force else load_raster_stats(file_path)
+        if stored is None:
+            pending.append(file_path)
+        else:
+            rows.append(report_row(file_path, stored, 'up to date'))
+            water_bodies.append(stored['water_bodies'].assign(file_name=os.path.basename(file_path)))
+
+    if pending:
+        workers = workers or min(len(pending), os.cpu_count() or 1)
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=tasks_per_worker)
+        except TypeError:
+            # max_tasks_per_child needs Python 3.11
+            executor = ProcessPoolExecutor(max_workers=workers)
+        with executor:
+            futures = [executor.submit(process_file, file_path, tiled_above, gdal_cache_mb) for file_path in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                row, bodies = future.result()
+                rows.append(row)
+                if bodies is not None:
+                    water_bodies.append(bodies)
+                if progress is not None:
+                    progress(done, len(pending), row)
+
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS).sort_values('file_name', ignore_index=True)
+    water_bodies = pd.concat(water_bodies, ignore_index=True) if water_bodies else pd.DataFrame()
+    return report, water_bodies
+
+
+# Function to write a report as CSV, Parquet or JSON depending on the file extension
+def write_report(report, output_path):
+    extension = os.path.splitext(output_path)[1].lower()
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if extension == '.parquet':
+        report.to_parquet(output_path, index=False)
+    elif extension == '.json':
+        report.to_json(output_path, orient='records', indent=2)
+    elif extension == '.csv':
+        report.to_csv(output_path, index=False)
+    else:
+        raise ValueError(f"Unsupported report format '{extension}', expected .csv, .parquet or .json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count and measure water bodies in every GeoTIFF of a folder.')
+    parser.add_argument('--folder', default=TIFF_FOLDER, help='folder with the GeoTIFFs (default: %(default)s)')
+    parser.add_argument('--output', default='water_bodies_report.csv', help='report path ending in .csv, .parquet or .json')
+    parser.add_argument('--water-bodies', help='optional path for the per-water-body table of every raster')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='reprocess rasters whose stored results are up to date')
+    parser.add_argument('--tiled-above', type=int, default=DEFAULT_TILED_ABOVE_PIXELS,
+                        help='pixel count above which rasters are processed band by band (default: %(default)s)')
+    parser.add_argument('--tasks-per-worker', type=int, default=DEFAULT_TASKS_PER_WORKER,
+                        help='rasters a worker processes before it is replaced (default: %(default)s)')
+    parser.add_argument('--gdal-cache-mb', type=int, default=DEFAULT_GDAL_CACHE_MB,
+                        help='GDAL block cache per worker in MB (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    def progress(done, total, row):
+        print(f"[{done}/{total}] {row['file_name']}: {row['status']} in {row['seconds']:.1f}s"
+              + (f" ({row['error']})" if row.get('error') else ''), file=sys.stderr)
+
+    report, water_bodies = run_batch(args.folder, args.workers, args.force, args.tiled_above,
+                                     args.tasks_per_worker, args.gdal_cache_mb, progress)
+    write_report(report, args.output)
+    if args.water_bodies:
+        write_report(water_bodies, args.water_bodies)
+
+    counts = report['status'].value_counts()
+    print(f"{len(report)} rasters: {counts.get('processed', 0)} processed, {counts.get('up to date', 0)} up to date, "
+          f"{counts.get('error', 0)} failed. Report written to {args.output}")
+    return 1 if counts.get('error', 0) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
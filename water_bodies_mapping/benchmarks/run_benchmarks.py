@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import plotly.graph_objects as go
+import rasterio
+from rasterio.transform import from_origin
+
+# The benchmarks import the app modules directly, like Streamlit does when running the apps
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contributions_db  # noqa: E402
+import decoded_store  # noqa: E402
+from raster_analysis import read_geotiff, count_water_bodies, create_heatmap  # noqa: E402
+from raster_normalization import normalize_raster  # noqa: E402
+from raster_streaming import normalize_geotiff  # noqa: E402
+from raster_decimation import figure_payload_bytes  # noqa: E402
+from water_body_measurement import measure_water_bodies, measure_water_bodies_tiled  # noqa: E402
+
+RASTER_SIZES = [512, 2048, 4096]
+NODATA_RATIOS = [0.0, 0.3]
+WATER_BODY_COUNTS = [10, 500]
+ROW_COUNTS = [1_000, 10_000, 100_000, 1_000_000]
+NODATA_VALUE = -9999.0
+# Upper-left corner and pixel size of the synthetic rasters, around Bulawayo
+ORIGIN = (28.4, -20.0)
+PIXEL_SIZE = 0.0001
+# A stage is reported as a regression when it is this much slower than the baseline
+DEFAULT_TOLERANCE = 1.25
+
+
+# Function to write a synthetic GeoTIFF with round water bodies on a noisy background
+def make_geotiff(file_path, size, nodata_ratio, water_bodies, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0.2, 0.05, (size, size)).astype(np.float32)
+
+    rows, cols = np.ogrid[:size, :size]
+    centres = rng.integers(0, size, (water_bodies, 2))
+    radii = rng.integers(2, max(3, size // 40), water_bodies)
+    for (row, col), radius in zip(centres, radii):
+        r0, r1 = max(0, row - radius), min(size, row + radius + 1)
+        c0, c1 = max(0, col - radius), min(size, col + radius + 1)
+        disc = (rows[r0:r1] - row) ** 2 + (cols[:, c0:c1] - col) ** 2 <= radius ** 2
+        data[r0:r1, c0:c1][disc] = rng.uniform(0.7, 1.0)
+
+    if nodata_ratio:
+        # Nodata as a solid band along the edge, like the collar of a clipped survey
+        data[:, :int(size * nodata_ratio)] = NODATA_VALUE
+
+    profile = dict(driver='GTiff', height=size, width=size, count=1, dtype='float32', crs='EPSG:4326',
+                   transform=from_origin(ORIGIN[0], ORIGIN[1], PIXEL_SIZE, PIXEL_SIZE), nodata=NODATA_VALUE)
+    with rasterio.open(file_path, 'w', **profile) as dst:
+        dst.write(data, 1)
+
+
+# Function to time a callable, returning the median duration, peak traced memory and the last result
+def measure(func, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': statistics.median(durations), 'min_seconds': min(durations), 'peak_bytes': peak}, result
+
+
+# Function to benchmark every raster stage on one synthetic GeoTIFF
+def bench_raster(file_path, repeat):
+    results = {}
+    results['read_geotiff'], (img_data, bounds, metadata) = measure(lambda: read_geotiff(file_path), repeat)
+    results['normalize_raster'], (normalized, _, _) = measure(lambda: normalize_raster(img_data), repeat)
+    results['normalize_geotiff_streaming'], _ = measure(lambda: normalize_geotiff(file_path), repeat)
+    # Cold: decode into the memory-mapped store; warm: map the stored array as a later process would
+    entry_folder = decoded_store.entry_folder(decoded_store.source_sha256(file_path))
+    results['decoded_store_cold'], _ = measure(
+        lambda: (shutil.rmtree(entry_folder, ignore_errors=True), decoded_store.open_normalized(file_path)), repeat)
+    results['decoded_store_warm'], _ = measure(lambda: decoded_store.open_normalized(file_path), repeat)
+    results['count_water_bodies'], _ = measure(lambda: count_water_bodies(normalized), repeat)
+    results['measure_water_bodies'], _ = measure(
+        lambda: measure_water_bodies(normalized, metadata['transform'], metadata['crs']), repeat)
+    results['measure_water_bodies_tiled'], _ = measure(lambda: measure_water_bodies_tiled(file_path), repeat)
+
+    def build_figure():
+        fig = go.Figure()
+        create_heatmap(fig, normalized, bounds, os.path.basename(file_path))
+        return fig
+
+    results['create_heatmap'], fig = measure(build_figure, repeat)
+    results['create_heatmap']['payload_bytes'] = figure_payload_bytes(fig)
+    results['figure_to_json'], _ = measure(fig.to_json, repeat)
+    return results
+
+
+# Function to fill a contributions table with synthetic rows
+def fill_contributions(database_path, rows):
+    start = datetime(2024, 1, 1)
+    with contributions_db.connection(database_path) as conn:
+        conn.executemany(
+            'INSERT INTO contributions (map_name, contributor, email, timestamp, file_path, file_size) VALUES (?, ?, ?, ?, ?, ?)',
+            ((f'Map {i}', f'Contributor {i % 97}', f'user{i % 97}@example.com',
+              (start + timedelta(minutes=i)).isoformat(), f'water_bodies_mapping/storage/objects/{i:064x}.tif', 1024 * (i % 4096 + 1))
+             for i in range(rows)))
+
+
+# Function to benchmark the KPI and listing queries on a table of the given size
+def bench_database(database_path, rows, repeat):
+    fill_contributions(database_path, rows)
+    last_page = max(0, rows // contributions_db.DEFAULT_PAGE_SIZE - 1)
+    results = {}
+    results['count_contributions'], _ = measure(lambda: contributions_db.count_contributions(database_path), repeat)
+    results['last_upload_timestamp'], _ = measure(lambda: contributions_db.last_upload_timestamp(database_path), repeat)
+    results['contributions_first_page'], _ = measure(lambda: contributions_db.contributions_page(0, database_path=database_path), repeat)
+    results['contributions_last_page'], _ = measure(
+        lambda: contributions_db.contributions_page(last_page, database_path=database_path), repeat)
+    for granularity in contributions_db.ROLLUP_GRANULARITIES:
+        results[f'size_over_time_{granularity}'], _ = measure(
+            lambda: contributions_db.size_over_time(granularity, database_path), repeat)
+    return results
+
+
+# Function to run the whole suite and return a flat {case/stage: metrics} mapping
+def run_suite(sizes, nodata_ratios, water_body_counts, row_counts, repeat):
+    # Synthetic databases must not pick up the real contributions
+    contributions_db.LEGACY_DATABASE_PATHS = []
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The database, file catalog and decoded store use paths relative to the repository root, so running from
+        # the work folder keeps every lookup and write away from the real data
+        os.chdir(work_dir)
+        contributions_db._pools = {}
+        try:
+            results = run_cases(work_dir, sizes, nodata_ratios, water_body_counts, row_counts, repeat)
+        finally:
+            os.chdir(previous_dir)
+            contributions_db._pools = {}
+    return results
+
+
+# Function to run the raster and database cases with files written into work_dir
+def run_cases(work_dir, sizes, nodata_ratios, water_body_counts, row_counts, repeat):
+    results = {}
+    for size in sizes:
+        for nodata_ratio in nodata_ratios:
+            for water_bodies in water_body_counts:
+                case = f'raster/{size}px/nodata{nodata_ratio:g}/bodies{water_bodies}'
+                file_path = os.path.join(work_dir, f'{size}_{nodata_ratio:g}_{water_bodies}.tif')
+                make_geotiff(file_path, size, nodata_ratio, water_bodies)
+                print(f'Running {case}', file=sys.stderr)
+                for stage, metrics in bench_raster(file_path, repeat).items():
+                    results[f'{case}/{stage}'] = metrics
+
+    for rows in row_counts:
+        case = f'database/{rows}rows'
+        print(f'Running {case}', file=sys.stderr)
+        database_path = os.path.join(work_dir, f'contributions_{rows}.db')
+        for stage, metrics in bench_database(database_path, rows, repeat).items():
+            results[f'{case}/{stage}'] = metrics
+    return results
+
+
+# Function to compare results against a baseline and list the stages that got slower
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, metrics in results.items():
+        reference = baseline.get('results', {}).get(key)
+        if reference is None or reference['seconds'] <= 0:
+            continue
+        ratio = metrics['seconds'] / reference['seconds']
+        if ratio > tolerance:
+            regressions.append((key, reference['seconds'], metrics['seconds'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ADAPT raster and database hot paths on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=RASTER_SIZES, help='raster edge lengths in pixels')
+    parser.add_argument('--nodata-ratios', type=float, nargs='+', default=NODATA_RATIOS)
+    parser.add_argument('--water-bodies', type=int, nargs='+', default=WATER_BODY_COUNTS)
+    parser.add_argument('--rows', type=int, nargs='+', default=ROW_COUNTS, help='contributions table sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the median is reported)')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='slowdown factor above which a stage counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.nodata_ratios, args.water_bodies, args.rows, args.repeat)
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'rasterio': rasterio.__version__,
+        'machine': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {len(results)} measurements to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, before, after, ratio in regressions:
+            print(f'REGRESSION {key}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms ({ratio:.2f}x)')
+        if regressions:
+            return 1
+        print(f'No regressions beyond {args.tolerance:.2f}x against {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
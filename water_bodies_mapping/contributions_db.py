@@ -0,0 +1,267 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Single database shared by the public app and the admin app
+DATABASE_PATH = os.path.join('water_bodies_mapping/map contributions', 'map_contributions.db')
+# Databases used by older versions; their contributions are merged into DATABASE_PATH once per process
+LEGACY_DATABASE_PATHS = [os.path.join('water_bodies_mapping/TIFF images', 'map_contributions.db')]
+POOL_SIZE = 8
+DEFAULT_PAGE_SIZE = 50
+# Periods the contribution rollup is kept at, as SQLite strftime formats of the contribution timestamp
+ROLLUP_GRANULARITIES = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d', 'month': '%Y-%m'}
+
+# Schema callbacks run once per database when its pool is created, e.g. by modules that add tables
+_schema_initializers = []
+
+
+# Small pool of open connections, so page reruns reuse connections and their prepared statement caches
+class ConnectionPool:
+    def __init__(self, database_path, size=POOL_SIZE):
+        self.database_path = database_path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database_path, timeout=30, check_same_thread=False, cached_statements=256)
+        # WAL lets readers (KPI pages, selectboxes) run while an upload holds the write lock
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+_pools = {}
+_pools_lock = threading.RLock()
+
+
+# Function to register a schema callback that receives a connection whenever a database is initialized
+def register_schema(initializer):
+    _schema_initializers.append(initializer)
+    # Databases that are already open get the new tables straight away
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        with pool.connection() as conn:
+            initializer(conn)
+
+
+# Function to create the contributions table and its indexes
+def _init_contributions(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS contributions (
+        id INTEGER PRIMARY KEY,
+        map_name TEXT,
+        contributor TEXT,
+        email TEXT,
+        timestamp TEXT,
+        file_path TEXT,
+        file_size INTEGER
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_contributions_timestamp ON contributions (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_contributions_map_name ON contributions (map_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_contributions_file_path ON contributions (file_path)')
+
+    # Databases from before sizes were recorded get the column and the sizes of the files still on disk
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(contributions)')]
+    if 'file_size' not in columns:
+        conn.execute('ALTER TABLE contributions ADD COLUMN file_size INTEGER')
+        _backfill_file_sizes(conn)
+    _init_rollup(conn)
+
+
+# Function to fill in missing file sizes from the files on disk
+def _backfill_file_sizes(conn):
+    rows = conn.execute('SELECT id, file_path FROM contributions WHERE file_size IS NULL').fetchall()
+    sizes = [(os.path.getsize(file_path), contribution_id) for contribution_id, file_path in rows
+             if file_path and os.path.isfile(file_path)]
+    conn.executemany('UPDATE contributions SET file_size = ? WHERE id = ?', sizes)
+
+
+# Function to get the SQL expression for a contribution timestamp's period, e.g. NEW.timestamp -> '2024-05-01 13:00'
+def _period_sql(timestamp, granularity):
+    return f"COALESCE(strftime('{ROLLUP_GRANULARITIES[granularity]}', {timestamp}), {timestamp})"
+
+
+# Function to get the trigger statements that add (sign=1) or remove (sign=-1) one contribution from the rollup
+def _rollup_statements(row, sign):
+    size = f'COALESCE({row}.file_size, 0)'
+    statements = []
+    for granularity in ROLLUP_GRANULARITIES:
+        period = _period_sql(f'{row}.timestamp', granularity)
+        if sign > 0:
+            # A new period starts from the running total of the period before it. Contributions without a
+            # timestamp belong to no period and are left out; the UPDATE and DELETE below match nothing for them
+            statements.append(f"""
+            INSERT OR IGNORE INTO contribution_rollup (granularity, period, count, bytes, cumulative_bytes)
+            SELECT '{granularity}', {period}, 0, 0,
+                   COALESCE((SELECT cumulative_bytes FROM contribution_rollup
+                             WHERE granularity = '{granularity}' AND period < {period}
+                             ORDER BY period DESC LIMIT 1), 0)
+            WHERE {row}.timestamp IS NOT NULL;""")
+        # Only the contribution's own period and the ones after it change; uploads land in the latest period
+        statements.append(f"""
+            UPDATE contribution_rollup
+            SET count = count + CASE WHEN period = {period} THEN {sign} ELSE 0 END,
+                bytes = bytes + CASE WHEN period = {period} THEN {sign} * {size} ELSE 0 END,
+                cumulative_bytes = cumulative_bytes + {sign} * {size}
+            WHERE granularity = '{granularity}' AND period >= {period};""")
+        if sign < 0:
+            statements.append(f"""
+            DELETE FROM contribution_rollup WHERE granularity = '{granularity}' AND period = {period} AND count <= 0;""")
+    return ''.join(statements)
+
+
+# Function to create the contribution rollup and the triggers that keep it up to date
+def _init_rollup(conn):
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contribution_rollup'").fetchone()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS contribution_rollup (
+        granularity TEXT,
+        period TEXT,
+        count INTEGER,
+        bytes INTEGER,
+        cumulative_bytes INTEGER,
+        PRIMARY KEY (granularity, period)
+    ) WITHOUT ROWID
+    ''')
+    triggers = {
+        'contributions_rollup_insert': f'AFTER INSERT ON contributions BEGIN{_rollup_statements("NEW", 1)} END',
+        'contributions_rollup_delete': f'AFTER DELETE ON contributions BEGIN{_rollup_statements("OLD", -1)} END',
+        'contributions_rollup_update': f'AFTER UPDATE OF timestamp, file_size ON contributions BEGIN'
+                                       f'{_rollup_statements("OLD", -1)}{_rollup_statements("NEW", 1)} END',
+    }
+    outdated = False
+    for name, body in triggers.items():
+        sql = f'CREATE TRIGGER {name} {body}'
+        current = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+        if current is not None and current[0] == sql:
+            continue
+        # Triggers from an earlier version of these statements are replaced, and the rollup is recomputed with them
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute(sql)
+        outdated = outdated or current is not None
+    if not exists or outdated:
+        rebuild_rollup(conn)
+
+
+# Function to recompute the whole rollup from the contributions table
+def rebuild_rollup(conn):
+    conn.execute('DELETE FROM contribution_rollup')
+    for granularity in ROLLUP_GRANULARITIES:
+        period = _period_sql('timestamp', granularity)
+        conn.execute(f'''
+        INSERT INTO contribution_rollup (granularity, period, count, bytes, cumulative_bytes)
+        SELECT ?, period, count, bytes, SUM(bytes) OVER (ORDER BY period)
+        FROM (SELECT {period} AS period, COUNT(*) AS count, SUM(COALESCE(file_size, 0)) AS bytes
+              FROM contributions WHERE timestamp IS NOT NULL GROUP BY 1)
+        ''', (granularity,))
+
+
+# Function to copy contributions logged in the legacy databases into the shared one
+def _merge_legacy_databases(conn, database_path):
+    for legacy_path in LEGACY_DATABASE_PATHS:
+        if not os.path.exists(legacy_path) or os.path.abspath(legacy_path) == os.path.abspath(database_path):
+            continue
+        conn.execute('ATTACH DATABASE ? AS legacy', (legacy_path,))
+        try:
+            has_table = conn.execute("SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = 'contributions'").fetchone()
+            if has_table:
+                cursor = conn.execute('''
+                INSERT INTO contributions (map_name, contributor, email, timestamp, file_path)
+                SELECT map_name, contributor, email, timestamp, file_path FROM legacy.contributions AS old
+                WHERE NOT EXISTS (SELECT 1 FROM contributions AS new
+                                  WHERE new.map_name IS old.map_name AND new.timestamp IS old.timestamp)
+                ''')
+                if cursor.rowcount:
+                    _backfill_file_sizes(conn)
+            conn.commit()
+        finally:
+            conn.execute('DETACH DATABASE legacy')
+
+
+# Function to get the connection pool for a database, creating the schema the first time
+def get_pool(database_path=DATABASE_PATH):
+    with _pools_lock:
+        pool = _pools.get(database_path)
+        if pool is not None:
+            return pool
+        os.makedirs(os.path.dirname(database_path) or '.', exist_ok=True)
+        pool = ConnectionPool(database_path)
+        with pool.connection() as conn:
+            _init_contributions(conn)
+            conn.commit()
+            _merge_legacy_databases(conn, database_path)
+            for initializer in _schema_initializers:
+                initializer(conn)
+        _pools[database_path] = pool
+        return pool
+
+
+# Function to borrow a pooled connection; commits on success and rolls back on error
+@contextmanager
+def connection(database_path=DATABASE_PATH):
+    with get_pool(database_path).connection() as conn:
+        yield conn
+
+
+# Function to initialize the database and create the contributions table
+def init_database(database_path=DATABASE_PATH):
+    get_pool(database_path)
+
+
+# Function to log one contribution
+def insert_contribution(map_name, contributor, email, timestamp, file_path, file_size=None, database_path=DATABASE_PATH):
+    with connection(database_path) as conn:
+        cursor = conn.execute('INSERT INTO contributions (map_name, contributor, email, timestamp, file_path, file_size) '
+                              'VALUES (?, ?, ?, ?, ?, ?)', (map_name, contributor, email, timestamp, file_path, file_size))
+        return cursor.lastrowid
+
+
+# Function to count all contributions
+def count_contributions(database_path=DATABASE_PATH):
+    with connection(database_path) as conn:
+        return conn.execute('SELECT COUNT(*) FROM contributions').fetchone()[0]
+
+
+# Function to get the latest upload timestamp (served from the timestamp index)
+def last_upload_timestamp(database_path=DATABASE_PATH):
+    with connection(database_path) as conn:
+        return conn.execute('SELECT MAX(timestamp) FROM contributions').fetchone()[0]
+
+
+# Function to fetch one page of contributions, newest first
+def contributions_page(page=0, page_size=DEFAULT_PAGE_SIZE, database_path=DATABASE_PATH):
+    with connection(database_path) as conn:
+        return conn.execute('SELECT id, map_name, contributor, email, timestamp, file_path FROM contributions '
+                            'ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+                            (page_size, page * page_size)).fetchall()
+
+
+# Function to fetch contributions per period (count, bytes, cumulative bytes) for the KPI chart, read from the rollup
+def size_over_time(granularity='day', database_path=DATABASE_PATH):
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {list(ROLLUP_GRANULARITIES)}")
+    with connection(database_path) as conn:
+        return conn.execute('SELECT period, count, bytes, cumulative_bytes FROM contribution_rollup '
+                            'WHERE granularity = ? ORDER BY period', (granularity,)).fetchall()
@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from scipy.ndimage import label
+
+import file_catalog
+from raster_cache import get_raster_cache
+from raster_streaming import core_histogram, iter_normalized_tiles, normalize_geotiff, streaming_stats
+from upload_storage import file_sha256
+
+DECODED_FOLDER = 'water_bodies_mapping/storage/decoded'
+# Bumped when the layout of the stored arrays changes, so older entries are never read
+FORMAT_VERSION = 2
+# Disk budget for decoded rasters (can be overridden with ADAPT_DECODED_STORE_MB; 0 disables the store)
+DEFAULT_STORE_BUDGET_MB = 4096
+
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+# Function to read the store's disk budget in bytes from the environment (0 means disabled)
+def store_budget():
+    return int(float(os.environ.get('ADAPT_DECODED_STORE_MB', DEFAULT_STORE_BUDGET_MB)) * 1024 * 1024)
+
+
+# Function to get a raster's content hash: from the file catalog when it is current, otherwise hashed once per version
+def source_sha256(file_path):
+    real_path = os.path.realpath(file_path)
+    stat = os.stat(real_path)
+    key = (real_path, stat.st_mtime_ns, stat.st_size)
+    with _hashes_lock:
+        sha256 = _hashes.get(key)
+    if sha256 is None:
+        sha256 = file_catalog.lookup_sha256(file_path) or file_sha256(real_path)
+        with _hashes_lock:
+            _hashes[key] = sha256
+    return sha256
+
+
+# Function to get the folder holding the decoded arrays of one raster version and band
+def entry_folder(sha256, band=1):
+    return os.path.join(DECODED_FOLDER, f'{sha256}-b{band}-v{FORMAT_VERSION}')
+
+
+# Function to make rasterio metadata and statistics JSON friendly
+def meta_to_json(bounds, metadata, stats):
+    metadata = dict(metadata)
+    metadata['crs'] = metadata['crs'].to_wkt() if metadata.get('crs') is not None else None
+    metadata['transform'] = list(metadata['transform'])[:6]
+    stats = {key: value.tolist() if isinstance(value, np.ndarray) else float(value) for key, value in stats.items()}
+    return json.dumps({'bounds': list(bounds), 'metadata': metadata, 'stats': stats})
+
+
+# Function to rebuild the bounds, metadata and statistics written by meta_to_json
+def meta_from_json(text):
+    meta = json.loads(text)
+    metadata = meta['metadata']
+    metadata['crs'] = CRS.from_wkt(metadata['crs']) if metadata['crs'] is not None else None
+    metadata['transform'] = Affine(*metadata['transform'])
+    stats = {key: np.asarray(value) if isinstance(value, list) else value for key, value in meta['stats'].items()}
+    stats['valid_pixels'] = int(stats['valid_pixels'])
+    return BoundingBox(*meta['bounds']), metadata, stats
+
+
+# Function to decode and normalize a raster straight into a memory-mappable .npy file, tile by tile
+def write_entry(file_path, folder, band=1):
+    temp_folder = f'{folder}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    os.makedirs(temp_folder)
+    try:
+        stats = streaming_stats(file_path, band)
+        with rasterio.open(file_path) as src:
+            bounds = src.bounds
+            metadata = src.meta
+        # The array lives in the file, so even rasters larger than memory are decoded without holding them
+        normalized = np.lib.format.open_memmap(os.path.join(temp_folder, 'normalized.npy'), mode='w+', dtype=np.float32,
+                                               shape=(metadata['height'], metadata['width']))
+        histogram = core_histogram(stats)
+        for window, tile in iter_normalized_tiles(file_path, stats['min'], stats['max'], band, histogram=histogram):
+            normalized[window.row_off:window.row_off + window.height,
+                       window.col_off:window.col_off + window.width] = tile
+        normalized.flush()
+        # Thresholds are cut on the finer histogram of the normalization pass
+        stats.update(histogram=histogram.counts, bin_edges=histogram.edges())
+        del normalized
+        with open(os.path.join(temp_folder, 'meta.json'), 'w') as f:
+            f.write(meta_to_json(bounds, metadata, stats))
+        try:
+            os.rename(temp_folder, folder)
+        except OSError:
+            # Another process published the same version first; its arrays are identical
+            pass
+    finally:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+
+# Function to map a raster's normalized band read-only, decoding it into the store on first use
+def open_normalized(file_path, band=1):
+    folder = entry_folder(source_sha256(file_path), band)
+    meta_path = os.path.join(folder, 'meta.json')
+    for attempt in range(2):
+        if not os.path.exists(meta_path):
+            write_entry(file_path, folder, band)
+            prune(store_budget(), keep=folder)
+        try:
+            # The modification time marks recent use for pruning
+            os.utime(meta_path)
+            with open(meta_path) as f:
+                bounds, metadata, stats = meta_from_json(f.read())
+            normalized = np.load(os.path.join(folder, 'normalized.npy'), mmap_mode='r')
+            return normalized, bounds, metadata, stats
+        except FileNotFoundError:
+            # Another process pruned the entry in between; decode it again once
+            if attempt:
+                raise
+
+
+# Function to map a raster's water body labels for a threshold read-only, labeling the stored band on first use
+def open_labels(file_path, threshold, band=1):
+    normalized, _, _, _ = open_normalized(file_path, band)
+    folder = entry_folder(source_sha256(file_path), band)
+    labels_path = os.path.join(folder, f'labels-{threshold:g}.npy')
+    count_path = os.path.join(folder, f'labels-{threshold:g}.json')
+    if not (os.path.exists(labels_path) and os.path.exists(count_path)):
+        temp_path = f'{labels_path}.{os.getpid()}.{threading.get_ident()}.tmp.npy'
+        labeled_array = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.int32, shape=normalized.shape)
+        num_features = label(normalized > threshold, output=labeled_array)
+        labeled_array.flush()
+        del labeled_array
+        os.replace(temp_path, labels_path)
+        with open(count_path + '.tmp', 'w') as f:
+            json.dump({'num_features': int(num_features)}, f)
+        os.replace(count_path + '.tmp', count_path)
+    with open(count_path) as f:
+        num_features = json.load(f)['num_features']
+    return np.load(labels_path, mmap_mode='r'), num_features
+
+
+# Function to get the bytes used by one store entry
+def entry_bytes(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+
+# Function to delete the least recently used entries until the store fits its budget
+def prune(max_bytes, keep=None):
+    if not os.path.isdir(DECODED_FOLDER):
+        return
+    entries = []
+    for entry in os.scandir(DECODED_FOLDER):
+        meta_path = os.path.join(entry.path, 'meta.json')
+        if entry.is_dir() and not entry.name.endswith('.tmp') and os.path.exists(meta_path):
+            entries.append((os.path.getmtime(meta_path), entry.path, entry_bytes(entry.path)))
+    total = sum(nbytes for _, _, nbytes in entries)
+    for _, folder, nbytes in sorted(entries):
+        if total <= max_bytes:
+            break
+        if folder == keep:
+            continue
+        # This process lets go of its mappings; other processes keep reading theirs until their caches drop them
+        get_raster_cache().discard_mapped(folder)
+        shutil.rmtree(folder, ignore_errors=True)
+        total -= nbytes
+
+
+# Function to read a normalized raster and its statistics, through the store unless it is disabled
+def load_normalized(file_path, band=1):
+    if store_budget() <= 0:
+        return normalize_geotiff(file_path, band)
+    return open_normalized(file_path, band)
+
+
+# Function to get a raster's water body labels and count through the store, or None when it is disabled
+def load_labels(file_path, threshold, band=1):
+    if store_budget() <= 0:
+        return None
+    return open_labels(file_path, threshold, band)
@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+from upload_storage import file_sha256
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Converted workbooks are kept in a hidden folder beside the source workbooks
+CACHE_FOLDER_NAME = '.cache'
+
+
+# Function to get the cache file paths for a workbook
+def cache_paths(excel_path):
+    folder = os.path.join(os.path.dirname(excel_path), CACHE_FOLDER_NAME)
+    base = os.path.join(folder, os.path.basename(excel_path))
+    return folder, base + '.json', base + ('.parquet' if PARQUET_AVAILABLE else '.sqlite')
+
+
+# Function to write a DataFrame in a fast columnar format (Parquet, or a typed SQLite table without pyarrow)
+def write_frame(df, data_path):
+    if data_path.endswith('.parquet'):
+        df.to_parquet(data_path, index=False)
+    else:
+        conn = sqlite3.connect(data_path)
+        df.to_sql('workbook', conn, if_exists='replace', index=False)
+        conn.close()
+
+
+# Function to read a DataFrame written by write_frame, restoring the original column types
+def read_frame(data_path, dtypes):
+    if data_path.endswith('.parquet'):
+        return pd.read_parquet(data_path)
+    conn = sqlite3.connect(data_path)
+    df = pd.read_sql('SELECT * FROM workbook', conn)
+    conn.close()
+    for column, dtype in dtypes.items():
+        if dtype.startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column])
+    return df
+
+
+# Function to convert a workbook into the cache, e.g. right after an admin uploads it
+def convert_workbook(excel_path):
+    folder, meta_path, data_path = cache_paths(excel_path)
+    os.makedirs(folder, exist_ok=True)
+    stat = os.stat(excel_path)
+    df = pd.read_excel(excel_path)
+
+    # Write to a temporary name first so readers never see a half-written cache file; the extension is kept last
+    # because write_frame picks the format from it
+    base, extension = os.path.splitext(data_path)
+    temp_path = base + '.tmp' + extension
+    write_frame(df, temp_path)
+    os.replace(temp_path, data_path)
+
+    meta = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(excel_path),
+        'dtypes': {column: str(dtype) for column, dtype in df.dtypes.items()},
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return df
+
+
+# Function to read a workbook through the cache, converting it again only when the source has changed
+def read_excel_cached(excel_path):
+    _, meta_path, data_path = cache_paths(excel_path)
+    if not (os.path.exists(meta_path) and os.path.exists(data_path)):
+        return convert_workbook(excel_path)
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = os.stat(excel_path)
+    if (meta['size'], meta['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+        # The mtime can change without the content changing (copies, checkouts), so confirm with the hash
+        if meta['size'] != stat.st_size or meta['sha256'] != file_sha256(excel_path):
+            return convert_workbook(excel_path)
+        meta['mtime_ns'] = stat.st_mtime_ns
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    return read_frame(data_path, meta['dtypes'])
+
+
+# Function to drop a workbook's cache files, e.g. when the workbook is deleted
+def remove_cached_workbook(excel_path):
+    _, meta_path, data_path = cache_paths(excel_path)
+    for path in (meta_path, data_path):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,240 @@
+import os
+import sqlite3
+import threading
+import time
+
+from contributions_db import connection, register_schema
+from upload_storage import file_sha256
+
+# Minimum seconds between full reconcile scans of one folder; directory mtime changes trigger a scan sooner
+RECONCILE_INTERVAL = 30.0
+DEFAULT_PAGE_SIZE = 25
+SORT_COLUMNS = {'name': 'c.name', 'newest': 'c.mtime_ns DESC, c.name', 'largest': 'c.size DESC, c.name'}
+# File types the apps upload and list; anything else in a folder (the database and its -wal/-shm files,
+# GDAL .aux.xml sidecars, temporary files) is never catalogued or hashed
+CATALOG_EXTENSIONS = ('.tif', '.tiff', '.xlsx', '.geojson', '.shp', '.dxf', '.csv', '.png', '.jpg', '.jpeg')
+
+_last_reconcile = {}
+_reconcile_lock = threading.Lock()
+
+
+# Function to create the file catalog table and its indexes
+def init_catalog_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS file_catalog (
+        folder TEXT NOT NULL,
+        name TEXT NOT NULL,
+        size INTEGER,
+        mtime_ns INTEGER,
+        file_type TEXT,
+        sha256 TEXT,
+        PRIMARY KEY (folder, name)
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_file_catalog_type ON file_catalog (folder, file_type, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_file_catalog_mtime ON file_catalog (folder, mtime_ns)')
+    # Prefix search compares lowercased names, like the case-insensitive trigram index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_file_catalog_name_lower ON file_catalog (folder, lower(name))')
+
+
+# Function to create the trigram full-text index over file names and contribution metadata
+def init_search_index(conn):
+    global SEARCH_INDEX_AVAILABLE
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5(name, metadata, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        # SQLite without FTS5 or the trigram tokenizer (older than 3.34) falls back to scanning names
+        SEARCH_INDEX_AVAILABLE = False
+        return
+    SEARCH_INDEX_AVAILABLE = True
+
+    # Contributors, map names and emails of the contributions whose stored object is this file
+    metadata_sql = ("(SELECT group_concat(ifnull(map_name, '') || ' ' || ifnull(contributor, '') || ' ' || ifnull(email, ''), ' ') "
+                    "FROM contributions WHERE new.sha256 IS NOT NULL AND instr(file_path, new.sha256) > 0)")
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS file_catalog_search_insert AFTER INSERT ON file_catalog BEGIN
+        INSERT INTO file_search (rowid, name, metadata) VALUES (new.rowid, new.name, {metadata_sql});
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS file_catalog_search_update AFTER UPDATE OF name, sha256 ON file_catalog BEGIN
+        DELETE FROM file_search WHERE rowid = old.rowid;
+        INSERT INTO file_search (rowid, name, metadata) VALUES (new.rowid, new.name, {metadata_sql});
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS file_catalog_search_delete AFTER DELETE ON file_catalog BEGIN
+        DELETE FROM file_search WHERE rowid = old.rowid;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS contributions_search_insert AFTER INSERT ON contributions BEGIN
+        UPDATE file_search
+        SET metadata = ifnull(metadata, '') || ' ' || ifnull(new.map_name, '') || ' ' || ifnull(new.contributor, '') || ' ' || ifnull(new.email, '')
+        WHERE rowid IN (SELECT rowid FROM file_catalog WHERE sha256 IS NOT NULL AND instr(new.file_path, sha256) > 0);
+    END
+    ''')
+    # Edited or deleted contributions rebuild the metadata of the files they pointed at
+    refresh_sql = '''
+        UPDATE file_search
+        SET metadata = (SELECT group_concat(ifnull(m.map_name, '') || ' ' || ifnull(m.contributor, '') || ' ' || ifnull(m.email, ''), ' ')
+                        FROM contributions AS m JOIN file_catalog AS f ON f.rowid = file_search.rowid
+                        WHERE f.sha256 IS NOT NULL AND instr(m.file_path, f.sha256) > 0)
+        WHERE rowid IN (SELECT rowid FROM file_catalog WHERE sha256 IS NOT NULL AND ({changed}));'''
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS contributions_search_update AFTER UPDATE OF map_name, contributor, email, file_path ON contributions BEGIN
+        {refresh_sql.format(changed='instr(old.file_path, sha256) > 0 OR instr(new.file_path, sha256) > 0')}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS contributions_search_delete AFTER DELETE ON contributions BEGIN
+        {refresh_sql.format(changed='instr(old.file_path, sha256) > 0')}
+    END
+    ''')
+
+    # Index files catalogued before the search index existed
+    if conn.execute('SELECT COUNT(*) FROM file_search').fetchone()[0] == 0:
+        conn.execute(f'''
+        INSERT INTO file_search (rowid, name, metadata)
+        SELECT c.rowid, c.name, {metadata_sql.replace('new.', 'c.')} FROM file_catalog AS c
+        ''')
+
+
+SEARCH_INDEX_AVAILABLE = False
+register_schema(init_catalog_table)
+register_schema(init_search_index)
+
+
+# Upserts keep each file's rowid stable, which the search index is keyed on
+UPSERT_SQL = '''
+INSERT INTO file_catalog (folder, name, size, mtime_ns, file_type, sha256) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (folder, name) DO UPDATE SET
+    size = excluded.size, mtime_ns = excluded.mtime_ns, file_type = excluded.file_type, sha256 = excluded.sha256
+'''
+
+
+# Function to get the lowercase extension used as the file type
+def file_type(name):
+    return os.path.splitext(name)[1].lower()
+
+
+# Function to record a new or changed file in the catalog
+def add_file(file_path, sha256=None):
+    stat = os.stat(file_path)
+    folder, name = os.path.split(os.path.normpath(file_path))
+    if sha256 is None:
+        sha256 = file_sha256(file_path)
+    with connection() as conn:
+        conn.execute(UPSERT_SQL, (folder, name, stat.st_size, stat.st_mtime_ns, file_type(name), sha256))
+
+
+# Function to get a file's content hash from the catalog, or None when the entry is missing or out of date
+def lookup_sha256(file_path):
+    stat = os.stat(file_path)
+    folder, name = os.path.split(os.path.normpath(file_path))
+    with connection() as conn:
+        row = conn.execute('SELECT size, mtime_ns, sha256 FROM file_catalog WHERE folder = ? AND name = ?', (folder, name)).fetchone()
+    if row is None or (row[0], row[1]) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return row[2]
+
+
+# Function to drop a deleted file from the catalog
+def remove_file(file_path):
+    folder, name = os.path.split(os.path.normpath(file_path))
+    with connection() as conn:
+        conn.execute('DELETE FROM file_catalog WHERE folder = ? AND name = ?', (folder, name))
+
+
+# Function to bring the catalog in line with files added, changed or removed outside the app
+def reconcile(folder, force=False):
+    folder = os.path.normpath(folder)
+    if not os.path.isdir(folder):
+        return
+    folder_mtime = os.stat(folder).st_mtime_ns
+    with _reconcile_lock:
+        last = _last_reconcile.get(folder)
+        if not force and last is not None and last[1] == folder_mtime and time.monotonic() - last[0] < RECONCILE_INTERVAL:
+            return
+        _last_reconcile[folder] = (time.monotonic(), folder_mtime)
+
+    with connection() as conn:
+        known = {name: (size, mtime_ns) for name, size, mtime_ns in
+                 conn.execute('SELECT name, size, mtime_ns FROM file_catalog WHERE folder = ?', (folder,))}
+
+    changed = []
+    seen = set()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or file_type(entry.name) not in CATALOG_EXTENSIONS:
+                continue
+            seen.add(entry.name)
+            stat = entry.stat()
+            if known.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                changed.append((entry.name, stat))
+    removed = [name for name in known if name not in seen]
+
+    if not changed and not removed:
+        return
+    # Only new or modified files are hashed
+    rows = [(folder, name, stat.st_size, stat.st_mtime_ns, file_type(name), file_sha256(os.path.join(folder, name)))
+            for name, stat in changed]
+    with connection() as conn:
+        conn.executemany(UPSERT_SQL, rows)
+        conn.executemany('DELETE FROM file_catalog WHERE folder = ? AND name = ?', [(folder, name) for name in removed])
+
+
+# Function to quote user input as a single FTS5 phrase
+def fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+# Function to build the FROM/WHERE clause shared by the listing queries
+def _filters(folder, extensions, search, match='contains'):
+    source = 'file_catalog AS c'
+    clauses = ['c.folder = ?']
+    params = [os.path.normpath(folder)]
+    if extensions:
+        clauses.append(f"c.file_type IN ({', '.join('?' for _ in extensions)})")
+        params.extend(extension.lower() for extension in extensions)
+    if search:
+        if match == 'prefix':
+            # Served by the (folder, lower(name)) index
+            clauses.append("lower(c.name) >= ? AND lower(c.name) < ? || char(1114111)")
+            params.extend([search.lower(), search.lower()])
+        elif SEARCH_INDEX_AVAILABLE and len(search) >= 3:
+            # Trigram index: substring matches on names and contribution metadata without scanning the catalog
+            source = 'file_search AS s JOIN file_catalog AS c ON c.rowid = s.rowid'
+            clauses.append('file_search MATCH ?')
+            params.append(fts_phrase(search))
+        else:
+            # Queries shorter than a trigram fall back to scanning names
+            clauses.append('instr(lower(c.name), ?) > 0')
+            params.append(search.lower())
+    return source, ' AND '.join(clauses), params
+
+
+# Function to count catalogued files in a folder
+def count_files(folder, extensions=None, search=None, match='contains'):
+    with connection() as conn:
+        # Built after connecting, once the schema (and search index availability) is known
+        source, where, params = _filters(folder, extensions, search, match)
+        return conn.execute(f'SELECT COUNT(*) FROM {source} WHERE {where}', params).fetchone()[0]
+
+
+# Function to fetch one page of catalogued files as dicts
+def list_files(folder, extensions=None, search=None, page=0, page_size=DEFAULT_PAGE_SIZE, match='contains', sort='name'):
+    with connection() as conn:
+        # Built after connecting, once the schema (and search index availability) is known
+        source, where, params = _filters(folder, extensions, search, match)
+        rows = conn.execute(f'SELECT c.name, c.size, c.mtime_ns, c.file_type, c.sha256 FROM {source} WHERE {where} '
+                            f'ORDER BY {SORT_COLUMNS[sort]} LIMIT ? OFFSET ?', params + [page_size, page * page_size]).fetchall()
+    return [{'name': name, 'path': os.path.join(folder, name), 'size': size, 'mtime_ns': mtime_ns,
+             'file_type': file_type_, 'sha256': sha256} for name, size, mtime_ns, file_type_, sha256 in rows]
+
+
+# Function to list all catalogued file names in a folder, e.g. for a multiselect
+def list_names(folder, extensions=None):
+    with connection() as conn:
+        source, where, params = _filters(folder, extensions, None)
+        return [row[0] for row in conn.execute(f'SELECT c.name FROM {source} WHERE {where} ORDER BY c.name', params)]
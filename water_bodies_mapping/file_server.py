@@ -0,0 +1,134 @@
+import hashlib
+import mimetypes
+import os
+import secrets
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+# HTTP endpoint that streams files (and later other resources) straight from disk. It is off unless both
+# ADAPT_FILE_SERVER_URL (the public address browsers reach it on, e.g. through a proxy) and a fixed
+# ADAPT_FILE_SERVER_PORT are set, because a link to this machine's loopback only works for local visitors.
+# ADAPT_FILE_SERVER_HOST is the interface it binds.
+DEFAULT_HOST = '127.0.0.1'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_routes = {}
+_folders = {}
+_server = None
+_base_url = None
+_lock = threading.Lock()
+# Unguessable per-process prefix so links cannot be forged without first seeing one
+_token = secrets.token_urlsafe(16)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        segments = parts.path.lstrip('/').split('/', 2)
+        if len(segments) < 3 or segments[0] != _token or segments[1] not in _routes:
+            self.send_error(404)
+            return
+        try:
+            _routes[segments[1]](self, unquote(segments[2]), parse_qs(parts.query))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # Keep the Streamlit console free of one line per request
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to stream a file to the client without reading it into memory
+def send_file(handler, file_path, download_name=None):
+    if not os.path.isfile(file_path):
+        handler.send_error(404)
+        return
+    content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    handler.send_response(200)
+    handler.send_header('Content-Type', content_type)
+    handler.send_header('Content-Length', str(os.path.getsize(file_path)))
+    if download_name:
+        handler.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(download_name)}")
+    handler.end_headers()
+    with open(file_path, 'rb') as f:
+        shutil.copyfileobj(f, handler.wfile, STREAM_CHUNK_SIZE)
+
+
+# Function to send an in-memory body such as a rendered tile
+def send_bytes(handler, body, content_type, max_age=0):
+    handler.send_response(200)
+    handler.send_header('Content-Type', content_type)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    if max_age:
+        handler.send_header('Cache-Control', f'public, max-age={max_age}')
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+# Function to serve files from the registered folders, refusing paths that escape them
+def _serve_folder_file(handler, subpath, query):
+    folder_key, _, relative_path = subpath.partition('/')
+    folder = _folders.get(folder_key)
+    if folder is None:
+        handler.send_error(404)
+        return
+    file_path = os.path.realpath(os.path.join(folder, relative_path))
+    if os.path.commonpath([folder, file_path]) != folder:
+        handler.send_error(403)
+        return
+    send_file(handler, file_path, os.path.basename(file_path))
+
+
+# Function to register a handler for URLs under /<token>/<name>/
+def register_route(name, handler):
+    _routes[name] = handler
+
+
+# Function to read the server settings from the environment, or None when no public URL and fixed port are configured
+def server_settings():
+    public_url = os.environ.get('ADAPT_FILE_SERVER_URL', '').strip()
+    port = int(os.environ.get('ADAPT_FILE_SERVER_PORT', 0) or 0)
+    if not public_url or port <= 0:
+        return None
+    return {'host': os.environ.get('ADAPT_FILE_SERVER_HOST', DEFAULT_HOST), 'port': port, 'public_url': public_url.rstrip('/')}
+
+
+# Function to start the server once per process and return its public base URL, or None when it is not configured
+def ensure_server():
+    global _server, _base_url
+    settings = server_settings()
+    if settings is None:
+        return None
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((settings['host'], settings['port']), _RequestHandler)
+            except OSError:
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='adapt-file-server', daemon=True).start()
+            _base_url = settings['public_url'] + '/' + _token
+        return _base_url
+
+
+# Function to allow downloads from a folder
+def serve_folder(folder):
+    folder = os.path.realpath(folder)
+    key = hashlib.sha1(folder.encode()).hexdigest()[:12]
+    _folders[key] = folder
+    return key
+
+
+# Function to build a streaming download link for a file, or None when the server is unavailable
+def file_url(file_path):
+    base_url = ensure_server()
+    if base_url is None:
+        return None
+    folder_key = serve_folder(os.path.dirname(file_path))
+    return f"{base_url}/files/{folder_key}/{quote(os.path.basename(file_path))}"
+
+
+register_route('files', _serve_folder_file)
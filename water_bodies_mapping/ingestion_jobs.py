@@ -0,0 +1,378 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import rasterio
+import rasterio.shutil
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.errors import RasterioIOError
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
+
+import file_catalog
+from contributions_db import connection, register_schema
+from raster_optimize import GEOTIFF_EXTENSIONS, optimize_upload
+from raster_stats_store import ensure_raster_stats
+from upload_storage import STORE_FOLDER, replace_stored
+
+# Rasters are reprojected to longitude/latitude, the coordinates the analysis page plots
+TARGET_CRS = 'EPSG:4326'
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds before a failed job is retried, doubled after every attempt
+RETRY_DELAY = 30
+# A running job whose worker has not finished within this many seconds is assumed lost and requeued
+JOB_LEASE = 30 * 60
+POLL_INTERVAL = 2.0
+# Ingestion runs at a lower CPU priority than the Streamlit server
+WORKER_NICENESS = 10
+# Seconds between sweeps for unreferenced store objects, and the age an object needs before a sweep may remove it
+SWEEP_INTERVAL = 6 * 60 * 60
+SWEEP_MIN_AGE = 60 * 60
+JOB_STATUSES = ['queued', 'running', 'done', 'failed']
+
+
+# Upload that can never be ingested, so retrying it is pointless
+class IngestValidationError(ValueError):
+    pass
+
+
+# Function to create the ingestion job table
+def init_jobs_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        id INTEGER PRIMARY KEY,
+        file_name TEXT,
+        published_path TEXT NOT NULL,
+        stored_path TEXT NOT NULL,
+        sha256 TEXT,
+        size INTEGER,
+        duplicate INTEGER,
+        source TEXT,
+        contribution_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'queued',
+        step TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        not_before REAL NOT NULL DEFAULT 0,
+        lease_expires REAL,
+        error TEXT,
+        result TEXT,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, not_before, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_stored_path ON ingest_jobs (stored_path)')
+
+
+register_schema(init_jobs_table)
+
+
+# Function to read the worker settings from the environment
+def worker_settings():
+    # ADAPT_INGEST_WORKERS=0 disables the workers in this process, e.g. when a dedicated worker runs
+    return max(0, int(os.environ.get('ADAPT_INGEST_WORKERS', 1)))
+
+
+logger = logging.getLogger(__name__)
+_wake = threading.Event()
+
+
+# Function to queue an upload for ingestion and return the job id
+def enqueue_job(stored, source, contribution_id=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    with connection() as conn:
+        cursor = conn.execute(
+            'INSERT INTO ingest_jobs (file_name, published_path, stored_path, sha256, size, duplicate, source, contribution_id, '
+            'max_attempts, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (os.path.basename(stored['published_path']), stored['published_path'], stored['path'], stored['sha256'],
+             stored['size'], int(stored['duplicate']), source, contribution_id, max_attempts, datetime.now().isoformat()))
+        job_id = cursor.lastrowid
+    _wake.set()
+    return job_id
+
+
+# Function to claim the next due job, unless the shared concurrency limit is reached
+def claim_job(concurrency):
+    now = time.time()
+    with connection() as conn:
+        # BEGIN IMMEDIATE takes the write lock, so workers in other processes cannot claim the same job
+        conn.execute('BEGIN IMMEDIATE')
+        # Jobs whose worker died are put back in the queue, or failed once they are out of attempts
+        conn.execute("UPDATE ingest_jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                     "step = NULL, error = 'the worker stopped before finishing', lease_expires = NULL "
+                     "WHERE status = 'running' AND lease_expires < ?", (now,))
+        running = conn.execute("SELECT COUNT(*) FROM ingest_jobs WHERE status = 'running'").fetchone()[0]
+        if running >= concurrency:
+            return None
+        row = conn.execute("SELECT id, published_path, stored_path, sha256, size, duplicate, contribution_id, attempts, max_attempts "
+                           "FROM ingest_jobs WHERE status = 'queued' AND not_before <= ? ORDER BY id LIMIT 1", (now,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE ingest_jobs SET status = 'running', attempts = attempts + 1, lease_expires = ?, started_at = ?, error = NULL "
+                     "WHERE id = ?", (now + JOB_LEASE, datetime.now().isoformat(), row[0]))
+    keys = ['id', 'published_path', 'path', 'sha256', 'size', 'duplicate', 'contribution_id', 'attempts', 'max_attempts']
+    job = dict(zip(keys, row))
+    job['duplicate'] = bool(job['duplicate'])
+    job['attempts'] += 1
+    return job
+
+
+# Function to record a job's progress so the apps can show which step it is on
+def set_step(job_id, step):
+    with connection() as conn:
+        conn.execute('UPDATE ingest_jobs SET step = ? WHERE id = ?', (step, job_id))
+
+
+# Function to mark a job as done with its result
+def complete_job(job_id, result):
+    with connection() as conn:
+        conn.execute("UPDATE ingest_jobs SET status = 'done', step = NULL, result = ?, finished_at = ?, lease_expires = NULL WHERE id = ?",
+                     (json.dumps(result), datetime.now().isoformat(), job_id))
+
+
+# Function to requeue a failed job with a growing delay, or mark it failed when out of attempts
+def fail_job(job, error, retry=True):
+    if retry and job['attempts'] < job['max_attempts']:
+        with connection() as conn:
+            conn.execute("UPDATE ingest_jobs SET status = 'queued', error = ?, not_before = ?, lease_expires = NULL WHERE id = ?",
+                         (error, time.time() + RETRY_DELAY * 2 ** (job['attempts'] - 1), job['id']))
+    else:
+        with connection() as conn:
+            conn.execute("UPDATE ingest_jobs SET status = 'failed', error = ?, finished_at = ?, lease_expires = NULL WHERE id = ?",
+                         (error, datetime.now().isoformat(), job['id']))
+
+
+# Function to check whether any contribution or job still points at a stored object
+def object_referenced(conn, stored_path):
+    return bool(conn.execute('SELECT EXISTS (SELECT 1 FROM contributions WHERE file_path = ?) '
+                             'OR EXISTS (SELECT 1 FROM ingest_jobs WHERE stored_path = ?)', (stored_path, stored_path)).fetchone()[0])
+
+
+# Function to point a job and its contribution at a replacement object, then drop the old object unless it is still used
+def record_replacement(job, previous, stored):
+    with connection() as conn:
+        # Written in one transaction, so a retry after a later failure starts from the replacement
+        conn.execute('UPDATE ingest_jobs SET stored_path = ?, sha256 = ?, size = ? WHERE id = ?',
+                     (stored['path'], stored['sha256'], stored['size'], job['id']))
+        if job['contribution_id'] is not None:
+            conn.execute('UPDATE contributions SET file_path = ?, file_size = ? WHERE id = ?',
+                         (stored['path'], stored['size'], job['contribution_id']))
+        referenced = previous['path'] == stored['path'] or object_referenced(conn, previous['path'])
+        if not referenced and os.path.exists(previous['path']):
+            os.remove(previous['path'])
+
+
+# Function to delete store objects that no contribution, job or catalogued file uses anymore; returns how many were removed
+def sweep_store(store_folder=STORE_FOLDER, min_age=SWEEP_MIN_AGE):
+    objects_folder = os.path.join(store_folder, 'objects')
+    if not os.path.isdir(objects_folder):
+        return 0
+    removed = 0
+    cutoff = time.time() - min_age
+    with connection() as conn:
+        catalogued = {row[0] for row in conn.execute('SELECT DISTINCT sha256 FROM file_catalog WHERE sha256 IS NOT NULL')}
+        for prefix in os.scandir(objects_folder):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                # Young objects may belong to an upload whose contribution is not logged yet
+                if not entry.is_file() or entry.stat().st_mtime > cutoff:
+                    continue
+                if os.path.splitext(entry.name)[0] in catalogued or object_referenced(conn, entry.path):
+                    continue
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+# Function to check that an upload is a readable, georeferenced raster
+def validate_geotiff(file_path):
+    try:
+        with rasterio.open(file_path) as src:
+            if src.count < 1 or src.width < 1 or src.height < 1:
+                raise IngestValidationError('the raster has no pixels')
+            if src.crs is None:
+                raise IngestValidationError('the raster has no coordinate reference system')
+            return src.crs.to_string(), src.width, src.height
+    except RasterioIOError as e:
+        raise IngestValidationError(f'not a readable GeoTIFF: {e}')
+
+
+# Function to warp a raster onto the target CRS, returning False when it already uses it
+def reproject_geotiff(file_path, output_path, crs=TARGET_CRS):
+    with rasterio.open(file_path) as src:
+        if src.crs == CRS.from_user_input(crs):
+            return False
+        transform, width, height = calculate_default_transform(src.crs, crs, src.width, src.height, *src.bounds)
+        with WarpedVRT(src, crs=crs, transform=transform, width=width, height=height, resampling=Resampling.nearest) as vrt:
+            rasterio.shutil.copy(vrt, output_path, driver='GTiff', TILED='YES', COMPRESS='DEFLATE', BIGTIFF='IF_SAFER')
+    return True
+
+
+# Function to run the ingestion steps of one job; runs in a worker process
+def run_job(job):
+    stored = {key: job[key] for key in ('published_path', 'path', 'sha256', 'size', 'duplicate')}
+    if not os.path.exists(stored['published_path']):
+        raise IngestValidationError('the uploaded file no longer exists')
+    if os.path.splitext(stored['published_path'])[1].lower() not in GEOTIFF_EXTENSIONS:
+        # Vector and tabular contributions are kept as received
+        return {'steps': [], 'published_path': stored['published_path']}
+
+    steps = []
+    set_step(job['id'], 'validate')
+    crs, width, height = validate_geotiff(stored['path'])
+    steps.append('validate')
+
+    set_step(job['id'], 'reproject')
+    temp_path = os.path.join(STORE_FOLDER, 'tmp', f"{stored['sha256']}.reprojecting.tif")
+    os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+    try:
+        if reproject_geotiff(stored['path'], temp_path):
+            previous, stored = stored, replace_stored(stored, temp_path)
+            record_replacement(job, previous, stored)
+            steps.append('reproject')
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    set_step(job['id'], 'optimize')
+    previous = stored
+    stored, optimized = optimize_upload(stored)
+    if optimized['optimized']:
+        record_replacement(job, previous, stored)
+        steps.append('optimize')
+
+    set_step(job['id'], 'analyze')
+    stats = ensure_raster_stats(stored['published_path'])
+    steps.append('analyze')
+
+    # The contribution already points at the final object; the catalog gets its hash
+    file_catalog.add_file(stored['published_path'], stored['sha256'])
+
+    return {
+        'steps': steps,
+        'source_crs': crs,
+        'width': width,
+        'height': height,
+        'published_path': stored['published_path'],
+        'stored_path': stored['path'],
+        'water_body_count': stats['water_body_count'],
+    }
+
+
+# Function to run one claimed job in a worker process and record the outcome
+def execute_job(job):
+    try:
+        result = run_job(job)
+    except IngestValidationError as e:
+        fail_job(job, str(e), retry=False)
+    except Exception as e:
+        fail_job(job, f'{type(e).__name__}: {e}')
+    else:
+        complete_job(job['id'], result)
+
+
+# Function to lower the CPU priority of a worker process
+def init_worker():
+    try:
+        os.nice(WORKER_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+# Function to create the worker pool
+def create_executor(workers):
+    # Spawned workers do not inherit the Streamlit server's threads and locks
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker)
+
+
+# Function to claim queued jobs and hand them to the worker pool, forever
+def dispatch(workers):
+    executor = create_executor(workers)
+    running = set()
+    next_sweep = time.time() + SWEEP_INTERVAL
+    while True:
+        try:
+            if time.time() >= next_sweep:
+                next_sweep = time.time() + SWEEP_INTERVAL
+                sweep_store()
+            finished = {future for future in running if future.done()}
+            running -= finished
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                # A worker was killed (e.g. out of memory); its job is requeued when the lease expires
+                executor.shutdown(wait=False)
+                executor = create_executor(workers)
+            job = claim_job(workers) if len(running) < workers else None
+            if job is not None:
+                running.add(executor.submit(execute_job, job))
+                continue
+        except Exception:
+            # The dispatcher keeps polling; failed jobs record their own errors on the job row
+            logger.exception('Ingestion dispatcher error')
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+
+
+# Function to start the background ingestion workers once per process
+def start_workers():
+    global _dispatcher
+    workers = worker_settings()
+    if workers == 0:
+        return
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = threading.Thread(target=dispatch, args=(workers,), name='adapt-ingest', daemon=True)
+            _dispatcher.start()
+
+
+# Function to fetch jobs by id, or the most recent ones, as dicts for display
+def list_jobs(job_ids=None, limit=50):
+    query = 'SELECT id, file_name, source, status, step, attempts, max_attempts, error, created_at, finished_at FROM ingest_jobs'
+    params = []
+    if job_ids is not None:
+        if not job_ids:
+            return []
+        query += f" WHERE id IN ({', '.join('?' for _ in job_ids)})"
+        params.extend(job_ids)
+    query += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+    keys = ['id', 'file_name', 'source', 'status', 'step', 'attempts', 'max_attempts', 'error', 'created_at', 'finished_at']
+    with connection() as conn:
+        return [dict(zip(keys, row)) for row in conn.execute(query, params)]
+
+
+# Function to count jobs in every status
+def status_counts():
+    with connection() as conn:
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status').fetchall())
+    return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+
+# Function to give failed jobs a fresh set of attempts
+def retry_failed_jobs():
+    with connection() as conn:
+        count = conn.execute("UPDATE ingest_jobs SET status = 'queued', attempts = 0, not_before = 0, error = NULL "
+                             "WHERE status = 'failed'").rowcount
+    _wake.set()
+    return count
+
+
+if __name__ == '__main__':
+    # Dedicated worker: python water_bodies_mapping/ingestion_jobs.py [workers], run from the repository root
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(1, worker_settings())
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    print(f'Processing ingestion jobs with {workers} worker(s)')
+    dispatch(workers)
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+from contributions_db import connection, register_schema
+
+# Stage timings are only collected when ADAPT_METRICS is set; otherwise every hook is a shared no-op
+ENABLED = os.environ.get('ADAPT_METRICS', '0').lower() not in ('', '0', 'false', 'no')
+# Samples are written in batches, at the end of a page run or once this many are waiting
+FLUSH_SIZE = 200
+RETENTION_DAYS = 30
+
+_pending = []
+_pending_lock = threading.Lock()
+
+
+# Function to create the stage metrics table
+def init_metrics_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stage_metrics (
+        id INTEGER PRIMARY KEY,
+        recorded_at REAL NOT NULL,
+        stage TEXT NOT NULL,
+        file_name TEXT,
+        seconds REAL NOT NULL,
+        bytes INTEGER
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stage_metrics_recorded_at ON stage_metrics (recorded_at)')
+
+
+register_schema(init_metrics_table)
+
+
+# Timer that adds up the time spent in one or more with-blocks, e.g. once per raster window
+class StageTimer:
+    __slots__ = ('stage', 'file_name', 'seconds', 'bytes', '_start')
+
+    def __init__(self, stage, file_name=None):
+        self.stage = stage
+        self.file_name = file_name
+        self.seconds = 0.0
+        self.bytes = 0
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._start
+        return False
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+    def record(self):
+        record(self.stage, self.file_name, self.seconds, self.bytes)
+
+
+# Timer for a single with-block that records its sample on exit
+class Stage(StageTimer):
+    __slots__ = ()
+
+    def __exit__(self, *exc_info):
+        StageTimer.__exit__(self, *exc_info)
+        self.record()
+        return False
+
+
+# Stand-in returned by the hooks when metrics are disabled
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_bytes(self, count):
+        pass
+
+    def record(self):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+# Function to time one stage: `with stage('labeling', file_name) as s: ...`
+def stage(name, file_name=None):
+    if not ENABLED:
+        return NULL_STAGE
+    return Stage(name, file_name)
+
+
+# Function to get a timer that accumulates over several with-blocks and is recorded explicitly
+def stage_timer(name, file_name=None):
+    if not ENABLED:
+        return NULL_STAGE
+    return StageTimer(name, file_name)
+
+
+# Function to queue one stage sample for the metrics store
+def record(stage_name, file_name, seconds, byte_count=None):
+    if not ENABLED:
+        return
+    with _pending_lock:
+        _pending.append((time.time(), stage_name, file_name, seconds, byte_count or None))
+        full = len(_pending) >= FLUSH_SIZE
+    if full:
+        flush()
+
+
+# Function to write queued samples in one transaction and drop samples past the retention period
+def flush():
+    if not ENABLED:
+        return
+    with _pending_lock:
+        rows = _pending[:]
+        del _pending[:]
+    if not rows:
+        return
+    with connection() as conn:
+        conn.executemany('INSERT INTO stage_metrics (recorded_at, stage, file_name, seconds, bytes) VALUES (?, ?, ?, ?, ?)', rows)
+        conn.execute('DELETE FROM stage_metrics WHERE recorded_at < ?', (time.time() - RETENTION_DAYS * 86400,))
+
+
+# Function to summarize recorded samples as p50/p95 latencies per stage, or per stage and file
+def stage_percentiles(since_seconds, by_file=False):
+    with connection() as conn:
+        samples = pd.read_sql_query('SELECT stage, file_name, seconds, bytes FROM stage_metrics WHERE recorded_at >= ?',
+                                    conn, params=(time.time() - since_seconds,))
+    keys = ['stage', 'file_name'] if by_file else ['stage']
+    if samples.empty:
+        return pd.DataFrame(columns=keys + ['samples', 'p50_ms', 'p95_ms', 'mean_bytes'])
+    samples['bytes'] = pd.to_numeric(samples['bytes'])
+    if by_file:
+        samples = samples.dropna(subset=['file_name'])
+    grouped = samples.groupby(keys)
+    summary = pd.DataFrame({
+        'samples': grouped['seconds'].size(),
+        'p50_ms': grouped['seconds'].quantile(0.5) * 1000,
+        'p95_ms': grouped['seconds'].quantile(0.95) * 1000,
+        'mean_bytes': grouped['bytes'].mean(),
+    }).reset_index()
+    return summary.sort_values('p95_ms', ascending=False)
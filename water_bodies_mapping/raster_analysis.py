@@ -0,0 +1,177 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import plotly.graph_objects as go
+import rasterio
+from scipy.ndimage import label
+
+import instrumentation
+from instrumentation import stage
+from raster_cache import get_raster_cache
+from decoded_store import load_normalized, load_labels
+from raster_normalization import mask_nodata
+from raster_decimation import decimate_raster, display_settings, figure_payload_bytes, estimate_full_payload_bytes
+from water_body_measurement import measure_water_bodies
+from raster_stats_store import load_raster_stats, save_raster_stats, summarize_raster
+from water_thresholds import WATER_THRESHOLD, DEFAULT_DETECTION, read_index, water_threshold
+
+# How selected files are processed: 'thread', 'process' or 'serial' (ADAPT_ANALYSIS_EXECUTOR)
+DEFAULT_EXECUTOR = 'thread'
+
+
+# Function to read GeoTIFF and return the data, bounds, and metadata
+def read_geotiff(file_path, band=1):
+    with rasterio.open(file_path) as src:
+        bounds = src.bounds
+        metadata = src.meta  # Get metadata
+        # Read the band (the first by default) as float32 with no data values as NaN
+        img_data = mask_nodata(src.read(band), src.nodata, inplace=True)
+    return img_data, bounds, metadata
+
+
+# Function to read a normalized GeoTIFF and its statistics through the process-wide raster cache and the decoded store
+def cached_read_normalized(file_path, band=1):
+    return get_raster_cache().get_or_load(file_path, lambda path: load_normalized(path, band), 'normalized', band)
+
+
+# Function to read a water index (NDWI/MNDWI) and its statistics through the process-wide raster cache
+def cached_read_index(file_path, index, bands):
+    return get_raster_cache().get_or_load(file_path, lambda path: read_index(path, index, bands), 'index', index, tuple(bands))
+
+
+# Function to mark water pixels in a normalized raster (NaN never counts as water)
+def water_mask(img_data, threshold=WATER_THRESHOLD):
+    return img_data > threshold
+
+
+# Function to count water bodies
+def count_water_bodies(img_data, threshold=WATER_THRESHOLD):
+    binary_mask = water_mask(img_data, threshold)  # Create a binary mask for water bodies
+    labeled_array, num_features = label(binary_mask)
+    return num_features  # Return the number of detected water bodies
+
+
+# Function to create heatmap
+def create_heatmap(fig, img_data_normalized, bounds, selected_file, full_shape=None):
+    # Only a screen-sized, downsampled view is sent to the browser; counting still uses the full raster
+    max_pixels, method = display_settings()
+    display_data = decimate_raster(img_data_normalized, max_pixels, method)
+    full_shape = full_shape or img_data_normalized.shape
+
+    x = np.linspace(bounds.left, bounds.right, display_data.shape[1])
+    y = np.linspace(bounds.bottom, bounds.top, display_data.shape[0])
+
+    fig.add_trace(go.Heatmap(
+        z=display_data,
+        x=x,  # Longitude
+        y=y,  # Latitude
+        colorscale='Viridis',
+        colorbar=dict(title='Normalized Value'),
+        showscale=True,
+    ))
+    fig.update_layout(
+        title=f'GeoTIFF Visualization: {selected_file}',
+        xaxis_title='Longitude',
+        yaxis_title='Latitude',
+        xaxis=dict(scaleanchor="y"),
+        yaxis=dict(constrain='domain'),
+        yaxis_autorange='reversed',  # Reverse y-axis for true north
+    )
+
+    # Report the figure payload before (estimated) and after decimation
+    return {
+        'full_shape': full_shape,
+        'display_shape': display_data.shape,
+        'payload_bytes': figure_payload_bytes(fig),
+        'full_payload_bytes': estimate_full_payload_bytes(fig, display_data, full_shape),
+    }
+
+
+# Function to run the whole per-file pipeline: read, normalize, build the heatmap and measure water bodies
+def process_geotiff(file_path, selected_file, full_resolution=False, detection=None):
+    detection = detection or DEFAULT_DETECTION
+    # Stored statistics were measured with the default detection settings only
+    default_detection = detection == DEFAULT_DETECTION
+    threshold = WATER_THRESHOLD
+    with stage('stats_lookup', selected_file):
+        stored = load_raster_stats(file_path)
+    fig = go.Figure()
+
+    if stored is not None and not full_resolution and default_detection:
+        # Statistics computed at upload time are enough; the raster itself is not opened
+        with stage('figure', selected_file) as timer:
+            payload = create_heatmap(fig, stored['preview'], stored['bounds'], selected_file,
+                                     full_shape=(stored['height'], stored['width']))
+            timer.add_bytes(payload['payload_bytes'])
+        water_bodies = stored['water_bodies']
+        metadata = stored['metadata']
+    elif detection['index'] != 'band':
+        # Only the bands the index needs are read, window by window
+        with stage('load_raster', selected_file):
+            index_data, bounds, metadata, stats = cached_read_index(file_path, detection['index'], detection['bands'])
+        threshold = water_threshold(stats, detection, normalized=False)
+        with stage('figure', selected_file) as timer:
+            payload = create_heatmap(fig, index_data, bounds, selected_file)
+            timer.add_bytes(payload['payload_bytes'])
+        with stage('labeling', selected_file):
+            water_bodies = measure_water_bodies(index_data, metadata['transform'], metadata['crs'], threshold)
+    else:
+        band = detection['bands'][0]
+        # Cache misses also record the read, nodata masking and normalization stages underneath
+        with stage('load_raster', selected_file):
+            img_data_normalized, bounds, metadata, stats = cached_read_normalized(file_path, band)
+        # Otsu and percentile cuts come from the histogram streamed with the band, so outliers do not move them
+        threshold = water_threshold(stats, detection)
+        with stage('figure', selected_file) as timer:
+            payload = create_heatmap(fig, img_data_normalized, bounds, selected_file)
+            timer.add_bytes(payload['payload_bytes'])
+        # One labeling pass gives both the count and the per-water-body measurements
+        with stage('labeling', selected_file):
+            labels = load_labels(file_path, threshold, band)
+            water_bodies = measure_water_bodies(img_data_normalized, metadata['transform'], metadata['crs'], threshold, labels)
+        if stored is None and default_detection:
+            with stage('save_stats', selected_file):
+                save_raster_stats(file_path, summarize_raster(img_data_normalized, bounds, metadata, stats, water_bodies))
+
+    # Worker processes have their own sample queue, so write it before returning
+    instrumentation.flush()
+    return {
+        'file_name': selected_file,
+        'file_path': file_path,
+        'figure': fig,
+        'payload': payload,
+        'num_water_bodies': len(water_bodies),
+        'water_bodies': water_bodies,
+        'metadata': metadata,
+        'detection': detection,
+        'threshold': threshold,
+    }
+
+
+# Function to read the executor settings from the environment
+def executor_settings():
+    mode = os.environ.get('ADAPT_ANALYSIS_EXECUTOR', DEFAULT_EXECUTOR)
+    workers = int(os.environ.get('ADAPT_ANALYSIS_WORKERS', min(4, os.cpu_count() or 1)))
+    return mode, max(1, workers)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+# Function to get a worker pool that is reused across reruns and sessions of this server process
+def get_executor(mode, workers):
+    if mode == 'serial':
+        return None
+    if mode not in ('thread', 'process'):
+        raise ValueError(f"Unknown executor '{mode}', expected 'thread', 'process' or 'serial'")
+    with _executors_lock:
+        key = (mode, workers)
+        if key not in _executors:
+            if mode == 'process':
+                _executors[key] = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executors[key] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='adapt-analysis')
+        return _executors[key]
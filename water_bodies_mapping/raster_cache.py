@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Default memory budget for decoded rasters (can be overridden with ADAPT_RASTER_CACHE_MB)
+DEFAULT_CACHE_BUDGET_MB = 512
+
+
+# Function to estimate how many bytes a cached value occupies
+def estimate_nbytes(value):
+    # Memory-mapped arrays are charged their mapped size too: a cached entry keeps its file mapped (and its disk
+    # space in use after the decoded store deletes it), so the budget must bound how many stay mapped
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    return 0
+
+
+# Function to list the files a cached value keeps memory-mapped
+def mapped_files(value):
+    if isinstance(value, np.memmap):
+        return [value.filename] if value.filename else []
+    if isinstance(value, (tuple, list)):
+        return [file_name for item in value for file_name in mapped_files(item)]
+    if isinstance(value, dict):
+        return [file_name for item in value.values() for file_name in mapped_files(item)]
+    return []
+
+
+# Function to mark cached arrays read-only so one session cannot modify another session's data
+def freeze(value):
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            freeze(item)
+    return value
+
+
+# Process-wide LRU cache for decoded rasters (and rendered tiles), bounded by a byte budget
+class RasterCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+
+    # Key a file on its path, modification time and size so edited files are re-decoded
+    @staticmethod
+    def make_key(file_path, *extra):
+        stat = os.stat(file_path)
+        return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size) + extra
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            # Values larger than the whole budget are returned but never stored
+            if nbytes > self.max_bytes:
+                return value
+            self._entries[key] = (freeze(value), nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+        return value
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+    # Function to return a cached result for the file, or load it with the loader and cache it
+    def get_or_load(self, file_path, loader, *extra):
+        key = self.make_key(file_path, *extra)
+        value = self.get(key)
+        if value is None:
+            # Results for an older version of the file are never read again
+            self._discard(lambda other, _: other[0] == key[0] and other[1:3] != key[1:3])
+            value = self.put(key, loader(file_path))
+        return value
+
+    # Function to drop the entries that map files inside a folder, e.g. before the folder is deleted
+    def discard_mapped(self, folder):
+        folder = os.path.realpath(folder)
+        self._discard(lambda _, value: any(os.path.commonpath([folder, os.path.realpath(file_name)]) == folder
+                                           for file_name in mapped_files(value)))
+
+    def _discard(self, matches):
+        with self._lock:
+            for key in [key for key, (value, _) in self._entries.items() if matches(key, value)]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_raster_cache = None
+_raster_cache_lock = threading.Lock()
+
+
+# Function to get the single cache shared by every session in this server process
+def get_raster_cache():
+    global _raster_cache
+    with _raster_cache_lock:
+        if _raster_cache is None:
+            budget_mb = float(os.environ.get('ADAPT_RASTER_CACHE_MB', DEFAULT_CACHE_BUDGET_MB))
+            _raster_cache = RasterCache(int(budget_mb * 1024 * 1024))
+        return _raster_cache
@@ -0,0 +1,86 @@
+import json
+import math
+import os
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+import rasterio
+from rasterio.enums import Resampling
+
+# Largest number of pixels sent to the browser for one heatmap (ADAPT_HEATMAP_MAX_PIXELS)
+DEFAULT_MAX_PIXELS = 250_000
+# Block reduction used when shrinking a raster for display: 'mean' or 'max' (ADAPT_HEATMAP_DECIMATION)
+DEFAULT_METHOD = 'mean'
+
+
+# Function to read the display settings from the environment
+def display_settings():
+    max_pixels = int(os.environ.get('ADAPT_HEATMAP_MAX_PIXELS', DEFAULT_MAX_PIXELS))
+    method = os.environ.get('ADAPT_HEATMAP_DECIMATION', DEFAULT_METHOD)
+    return max_pixels, method
+
+
+# Function to work out the block size needed to fit a raster into max_pixels
+def decimation_factor(shape, max_pixels):
+    height, width = shape
+    if max_pixels <= 0 or height * width <= max_pixels:
+        return 1
+    return math.ceil(math.sqrt(height * width / max_pixels))
+
+
+# Function to reduce blocks shaped (rows, blocks, columns per block) to one value per block, ignoring NaN
+def reduce_blocks(blocks, method):
+    if method == 'max':
+        # fmax ignores NaN, so a block is only NaN when every pixel in it is NaN
+        return np.fmax.reduce(np.fmax.reduce(blocks, axis=2), axis=0)
+    counts = (~np.isnan(blocks)).sum(axis=(0, 2))
+    sums = np.nansum(blocks, axis=(0, 2), dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+# Function to build a downsampled, NaN-aware view of a raster using block mean or block max
+def decimate_raster(img_data, max_pixels=DEFAULT_MAX_PIXELS, method=DEFAULT_METHOD):
+    factor = decimation_factor(img_data.shape, max_pixels)
+    if factor == 1:
+        return img_data
+    if method not in ('mean', 'max'):
+        raise ValueError(f"Unknown decimation method '{method}', expected 'mean' or 'max'")
+
+    dtype = img_data.dtype if np.issubdtype(img_data.dtype, np.floating) else np.float32
+    height, width = img_data.shape
+    full_cols = width - width % factor
+    decimated = np.empty((math.ceil(height / factor), math.ceil(width / factor)), dtype=dtype)
+    # Reduced one band of factor rows at a time, so temporaries stay band-sized and memory-mapped rasters are
+    # paged in band by band; the last band and column of blocks are simply narrower instead of padded
+    for out_row, row_off in enumerate(range(0, height, factor)):
+        band = img_data[row_off:row_off + factor].astype(dtype, copy=False)
+        decimated[out_row, :full_cols // factor] = reduce_blocks(band[:, :full_cols].reshape(band.shape[0], -1, factor), method)
+        if full_cols < width:
+            decimated[out_row, -1] = reduce_blocks(band[:, full_cols:].reshape(band.shape[0], 1, -1), method)[0]
+    return decimated
+
+
+# Function to read a decimated band straight from disk, using the file's overviews when it has them
+def read_decimated(file_path, max_pixels=DEFAULT_MAX_PIXELS, band=1):
+    with rasterio.open(file_path) as src:
+        factor = decimation_factor((src.height, src.width), max_pixels)
+        out_shape = (math.ceil(src.height / factor), math.ceil(src.width / factor))
+        data = src.read(band, out_shape=out_shape, resampling=Resampling.average, masked=True)
+    return data.astype(np.float32).filled(np.nan)
+
+
+# Function to measure how many bytes a figure costs to send to the browser
+def figure_payload_bytes(fig):
+    return len(fig.to_json())
+
+
+# Function to estimate the payload of the same figure if the full raster had been sent
+def estimate_full_payload_bytes(fig, shown_data, full_shape):
+    shown_bytes = figure_payload_bytes(fig)
+    if shown_data.size == 0:
+        return shown_bytes
+    # Encoded the way the figure encodes its z values (NaN becomes null)
+    z_bytes = len(json.dumps(shown_data, cls=PlotlyJSONEncoder))
+    full_pixels = full_shape[0] * full_shape[1]
+    return int(shown_bytes - z_bytes + z_bytes * full_pixels / shown_data.size)
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Elements reduced at a time by nan_minmax, small enough that min and max read the chunk from CPU cache
+MINMAX_CHUNK_ELEMENTS = 256 * 1024
+
+
+# Function to convert a band to float32 with nodata replaced by NaN, without a float64 detour
+def mask_nodata(img_data, nodata, inplace=False):
+    # With inplace=True a writeable float32 band is reused instead of copied
+    if inplace and not img_data.flags.writeable:
+        inplace = False
+    mask = None
+    if nodata is not None and not np.isnan(nodata):
+        mask = img_data == nodata  # one byte per pixel, computed on the original dtype
+    img_data = img_data.astype(np.float32, copy=not inplace)
+    if mask is not None and mask.any():
+        img_data[mask] = np.nan
+    return img_data
+
+
+# Function to compute the NaN-ignoring min and max together, chunk by chunk
+def nan_minmax(img_data):
+    flat = img_data.reshape(-1)
+    vmin, vmax = np.inf, -np.inf
+    for start in range(0, flat.size, MINMAX_CHUNK_ELEMENTS):
+        chunk = flat[start:start + MINMAX_CHUNK_ELEMENTS]
+        # fmin/fmax skip NaN, and both reductions hit the chunk while it is still cached
+        vmin = np.fmin(vmin, np.fmin.reduce(chunk))
+        vmax = np.fmax(vmax, np.fmax.reduce(chunk))
+    if not np.isfinite(vmin) or not np.isfinite(vmax):
+        return np.nan, np.nan
+    return float(vmin), float(vmax)
+
+
+# Function to min-max normalize a float array in place
+def normalize_inplace(img_data, vmin, vmax):
+    if np.isnan(vmin) or np.isnan(vmax):
+        # Nothing but nodata: leave the NaNs as they are
+        return img_data
+    if vmax <= vmin:
+        # Constant raster: every valid pixel maps to 0 (NaN * 0 stays NaN)
+        np.multiply(img_data, 0, out=img_data)
+        return img_data
+    np.subtract(img_data, vmin, out=img_data)
+    np.multiply(img_data, 1.0 / (vmax - vmin), out=img_data)
+    return img_data
+
+
+# Function to mask nodata and normalize a band, returning the array and its original range
+def normalize_raster(img_data, nodata=None, inplace=False):
+    img_data = mask_nodata(img_data, nodata, inplace)
+    vmin, vmax = nan_minmax(img_data)
+    return normalize_inplace(img_data, vmin, vmax), vmin, vmax
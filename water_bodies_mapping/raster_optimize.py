@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+from raster_streaming import iter_windows
+from upload_storage import STORE_FOLDER, replace_stored
+
+BLOCK_SIZE = 512
+# Rasters whose sides are all at most this many pixels are drawn in full and get no overviews
+OVERVIEW_MIN_SIZE = 512
+GEOTIFF_EXTENSIONS = ('.tif', '.tiff')
+
+
+# Function to check whether a raster already has the tiled, compressed, overview-carrying layout
+def is_optimized(src):
+    small = max(src.width, src.height) <= OVERVIEW_MIN_SIZE
+    tiled = small or bool(src.profile.get('tiled'))
+    has_overviews = small or bool(src.overviews(1))
+    return tiled and has_overviews and src.compression is not None
+
+
+# Function to get the halving factors that take a raster down to about one block
+def overview_factors(width, height):
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= BLOCK_SIZE / 2 and max(width, height) > OVERVIEW_MIN_SIZE:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+# Function to pick the TIFF predictor for a data type: horizontal differencing for integers, floating point otherwise
+def predictor(dtype):
+    return 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2
+
+
+# Function to write a cloud-optimized copy: tiled, deflate compressed, with averaged overviews
+def write_optimized(file_path, output_path):
+    with rasterio.open(file_path) as src:
+        dtype = src.dtypes[0]
+        width, height = src.width, src.height
+    try:
+        # GDAL 3.1+ writes the overviews ahead of the full-resolution tiles, so readers fetch them first
+        rasterio.shutil.copy(file_path, output_path, driver='COG', COMPRESS='DEFLATE', PREDICTOR='YES',
+                             BLOCKSIZE=BLOCK_SIZE, RESAMPLING='AVERAGE', BIGTIFF='IF_SAFER')
+        return
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    # Older GDAL: tiled GeoTIFF with internal overviews added afterwards
+    rasterio.shutil.copy(file_path, output_path, driver='GTiff', TILED='YES', BLOCKXSIZE=BLOCK_SIZE, BLOCKYSIZE=BLOCK_SIZE,
+                         COMPRESS='DEFLATE', PREDICTOR=predictor(dtype), BIGTIFF='IF_SAFER')
+    factors = overview_factors(width, height)
+    if factors:
+        with rasterio.open(output_path, 'r+') as dst:
+            dst.build_overviews(factors, Resampling.average)
+            dst.update_tags(ns='rio_overview', resampling='average')
+
+
+# Function to compare nodata values, treating two NaNs as equal
+def same_nodata(nodata, other_nodata):
+    if nodata is None or other_nodata is None:
+        return nodata is other_nodata
+    return nodata == other_nodata or np.isnan(nodata) and np.isnan(other_nodata)
+
+
+# Function to check that two rasters hold the same pixels and georeferencing, block by block
+def same_pixels(file_path, other_path):
+    with rasterio.open(file_path) as src, rasterio.open(other_path) as dst:
+        if (src.count, src.width, src.height, src.dtypes) != (dst.count, dst.width, dst.height, dst.dtypes):
+            return False
+        if src.crs != dst.crs or src.transform != dst.transform or not same_nodata(src.nodata, dst.nodata):
+            return False
+        floating = np.issubdtype(np.dtype(src.dtypes[0]), np.floating)
+        for window in iter_windows(src):
+            if not np.array_equal(src.read(window=window), dst.read(window=window), equal_nan=floating):
+                return False
+    return True
+
+
+# Function to write a verified cloud-optimized copy of a GeoTIFF to output_path
+def optimize_geotiff(file_path, output_path):
+    with rasterio.open(file_path) as src:
+        if is_optimized(src):
+            return {'optimized': False, 'reason': 'already tiled, compressed and with overviews'}
+
+    write_optimized(file_path, output_path)
+    if not same_pixels(file_path, output_path):
+        os.remove(output_path)
+        return {'optimized': False, 'reason': 'optimized copy did not match the original pixels'}
+    with rasterio.open(output_path) as dst:
+        overviews = dst.overviews(1)
+    return {'optimized': True, 'reason': None, 'original_bytes': os.path.getsize(file_path),
+            'optimized_bytes': os.path.getsize(output_path), 'overviews': overviews}
+
+
+# Function to replace a freshly stored GeoTIFF upload with its cloud-optimized copy
+def optimize_upload(stored, store_folder=STORE_FOLDER):
+    extension = os.path.splitext(stored['published_path'])[1].lower()
+    if extension not in GEOTIFF_EXTENSIONS:
+        return stored, {'optimized': False, 'reason': 'not a GeoTIFF'}
+
+    temp_folder = os.path.join(store_folder, 'tmp')
+    os.makedirs(temp_folder, exist_ok=True)
+    temp_path = os.path.join(temp_folder, f"{stored['sha256']}.optimizing{extension}")
+    try:
+        report = optimize_geotiff(stored['path'], temp_path)
+        if not report['optimized']:
+            return stored, report
+        return replace_stored(stored, temp_path, store_folder), report
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
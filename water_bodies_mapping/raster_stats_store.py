@@ -0,0 +1,180 @@
+import io
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.coords import BoundingBox
+
+from raster_streaming import streaming_stats
+from decoded_store import load_normalized, load_labels
+from raster_normalization import normalize_inplace
+from raster_decimation import decimate_raster, read_decimated
+from water_body_measurement import measure_water_bodies, measure_water_bodies_tiled
+from contributions_db import DATABASE_PATH, connection, register_schema
+from water_thresholds import WATER_THRESHOLD
+
+# Size of the preview stored with each raster's statistics
+PREVIEW_MAX_PIXELS = 65_536
+
+
+# Function to create the raster statistics table and its indexes
+def init_stats_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS raster_stats (
+        file_path TEXT PRIMARY KEY,
+        file_name TEXT,
+        file_size INTEGER,
+        file_mtime_ns INTEGER,
+        width INTEGER,
+        height INTEGER,
+        crs TEXT,
+        bounds_left REAL,
+        bounds_bottom REAL,
+        bounds_right REAL,
+        bounds_top REAL,
+        min_value REAL,
+        max_value REAL,
+        nodata_fraction REAL,
+        water_body_count INTEGER,
+        water_bodies TEXT,
+        metadata TEXT,
+        preview BLOB,
+        computed_at TEXT
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_raster_stats_file_name ON raster_stats (file_name)')
+
+
+register_schema(init_stats_table)
+
+
+# Function to make rasterio metadata JSON friendly
+def metadata_to_json(metadata):
+    metadata = dict(metadata)
+    if metadata.get('crs') is not None:
+        metadata['crs'] = metadata['crs'].to_string()
+    if metadata.get('transform') is not None:
+        metadata['transform'] = list(metadata['transform'])[:6]
+    if isinstance(metadata.get('nodata'), float) and np.isnan(metadata['nodata']):
+        metadata['nodata'] = 'nan'
+    return json.dumps(metadata)
+
+
+# Function to serialize a preview array to bytes
+def array_to_blob(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array, dtype=np.float32))
+    return buffer.getvalue()
+
+
+# Function to compute everything viewers need from a GeoTIFF in one read
+def compute_raster_stats(file_path, tiled=False):
+    if tiled:
+        return compute_raster_stats_tiled(file_path)
+    # Decoded once into the memory-mapped store, where later readers in any process find it
+    normalized, bounds, metadata, stats = load_normalized(file_path)
+    water_bodies = measure_water_bodies(normalized, metadata['transform'], metadata['crs'], labels=load_labels(file_path, WATER_THRESHOLD))
+    return summarize_raster(normalized, bounds, metadata, stats, water_bodies)
+
+
+# Function to compute the same statistics band by band, for rasters too large to hold in memory
+def compute_raster_stats_tiled(file_path):
+    stats = streaming_stats(file_path)
+    water_bodies = measure_water_bodies_tiled(file_path)
+    with rasterio.open(file_path) as src:
+        bounds = src.bounds
+        metadata = src.meta
+    preview = normalize_inplace(read_decimated(file_path, PREVIEW_MAX_PIXELS), stats['min'], stats['max'])
+    return {
+        'width': metadata['width'],
+        'height': metadata['height'],
+        'crs': metadata['crs'].to_string() if metadata['crs'] is not None else None,
+        'bounds': bounds,
+        'min_value': stats['min'],
+        'max_value': stats['max'],
+        'nodata_fraction': stats['nodata_fraction'],
+        'water_body_count': len(water_bodies),
+        'water_bodies': water_bodies,
+        'metadata': metadata,
+        'preview': preview,
+    }
+
+
+# Function to collect the stored statistics from an already normalized and measured raster
+def summarize_raster(normalized, bounds, metadata, stats, water_bodies):
+    preview = decimate_raster(normalized, PREVIEW_MAX_PIXELS)
+    return {
+        'width': metadata['width'],
+        'height': metadata['height'],
+        'crs': metadata['crs'].to_string() if metadata['crs'] is not None else None,
+        'bounds': bounds,
+        'min_value': stats['min'],
+        'max_value': stats['max'],
+        'nodata_fraction': stats['nodata_fraction'],
+        'water_body_count': len(water_bodies),
+        'water_bodies': water_bodies,
+        'metadata': metadata,
+        'preview': preview,
+    }
+
+
+# Function to store a raster's statistics, stamped with the file's size and mtime
+def save_raster_stats(file_path, stats, database_path=DATABASE_PATH):
+    stat = os.stat(file_path)
+    with connection(database_path) as conn:
+        conn.execute('INSERT OR REPLACE INTO raster_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (os.path.normpath(file_path), os.path.basename(file_path), stat.st_size, stat.st_mtime_ns,
+                      stats['width'], stats['height'], stats['crs'], *stats['bounds'],
+                      float(stats['min_value']), float(stats['max_value']), float(stats['nodata_fraction']),
+                      stats['water_body_count'], stats['water_bodies'].to_json(orient='split', index=False),
+                      metadata_to_json(stats['metadata']), array_to_blob(stats['preview']),
+                      datetime.now().isoformat()))
+
+
+# Function to load stored statistics, or None when they are missing or the file has changed since
+def load_raster_stats(file_path, database_path=DATABASE_PATH):
+    if not os.path.exists(file_path):
+        return None
+    with connection(database_path) as conn:
+        row = conn.execute('SELECT file_size, file_mtime_ns, width, height, crs, bounds_left, bounds_bottom, bounds_right, bounds_top, '
+                           'min_value, max_value, nodata_fraction, water_body_count, water_bodies, metadata, preview '
+                           'FROM raster_stats WHERE file_path = ?', (os.path.normpath(file_path),)).fetchone()
+    if row is None:
+        return None
+
+    stat = os.stat(file_path)
+    if (row[0], row[1]) != (stat.st_size, stat.st_mtime_ns):
+        delete_raster_stats(file_path, database_path)
+        return None
+
+    return {
+        'width': row[2],
+        'height': row[3],
+        'crs': row[4],
+        'bounds': BoundingBox(*row[5:9]),
+        'min_value': row[9],
+        'max_value': row[10],
+        'nodata_fraction': row[11],
+        'water_body_count': row[12],
+        'water_bodies': pd.read_json(io.StringIO(row[13]), orient='split'),
+        'metadata': json.loads(row[14]),
+        'preview': np.load(io.BytesIO(row[15])),
+    }
+
+
+# Function to forget a raster's statistics, e.g. when the file is deleted
+def delete_raster_stats(file_path, database_path=DATABASE_PATH):
+    with connection(database_path) as conn:
+        conn.execute('DELETE FROM raster_stats WHERE file_path = ?', (os.path.normpath(file_path),))
+
+
+# Function to return up-to-date statistics for a raster, computing and storing them if needed
+def ensure_raster_stats(file_path, database_path=DATABASE_PATH):
+    stats = load_raster_stats(file_path, database_path)
+    if stats is None:
+        stats = compute_raster_stats(file_path)
+        save_raster_stats(file_path, stats, database_path)
+    return stats
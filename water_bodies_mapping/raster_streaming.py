@@ -0,0 +1,183 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from instrumentation import stage_timer
+from raster_normalization import mask_nodata, nan_minmax, normalize_inplace
+
+# Largest number of pixels decoded at once while streaming through a raster
+DEFAULT_WINDOW_PIXELS = 4 * 1024 * 1024
+DEFAULT_HISTOGRAM_BINS = 256
+# Share of the values on each side left out of the core range a second pass bins finely
+OUTLIER_FRACTION = 0.001
+
+
+# Function to iterate over a band in windows aligned to the dataset's internal blocks
+def iter_windows(src, band=1, max_window_pixels=DEFAULT_WINDOW_PIXELS):
+    block_rows, block_cols = src.block_shapes[band - 1]
+    block_rows = min(block_rows, src.height)
+    block_cols = min(block_cols, src.width)
+
+    if block_rows * src.width <= max_window_pixels:
+        # Stripped or narrow rasters: read full-width bands made of several strips
+        window_rows = block_rows * max(1, max_window_pixels // (block_rows * src.width))
+        window_cols = src.width
+    else:
+        # Tiled rasters: read runs of tiles along a row of blocks
+        window_rows = block_rows
+        window_cols = block_cols * max(1, max_window_pixels // (block_rows * block_cols))
+
+    for row_off in range(0, src.height, window_rows):
+        height = min(window_rows, src.height - row_off)
+        for col_off in range(0, src.width, window_cols):
+            width = min(window_cols, src.width - col_off)
+            yield Window(col_off, row_off, width, height)
+
+
+# Function to read one window as float32 with nodata replaced by NaN
+def read_window(src, window, band=1):
+    return mask_nodata(src.read(band, window=window), src.nodata, inplace=True)
+
+
+# Histogram that grows its range as new data arrives, so it can be built in a single pass. With a fixed
+# value_range, values outside it are counted in the first or last bin instead
+class StreamingHistogram:
+    def __init__(self, bins=DEFAULT_HISTOGRAM_BINS, value_range=None):
+        # An even number of bins lets neighbouring bins be merged when the range doubles
+        self.bins = bins + bins % 2
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.fixed = value_range is not None
+        self.low, self.high = value_range if self.fixed else (None, None)
+
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        if self.fixed:
+            counts, _ = np.histogram(np.clip(values, self.low, self.high), bins=self.bins, range=(self.low, self.high))
+            self.counts += counts
+            return
+        vmin = float(values.min())
+        vmax = float(values.max())
+        if self.low is None:
+            self.low = vmin
+            self.high = vmax if vmax > vmin else vmin + 1.0
+        while vmin < self.low or vmax > self.high:
+            self._double(extend_low=vmin < self.low)
+        counts, _ = np.histogram(values, bins=self.bins, range=(self.low, self.high))
+        self.counts += counts
+
+    # Function to double the histogram range, merging pairs of bins to keep the bin count fixed
+    def _double(self, extend_low):
+        width = self.high - self.low
+        merged = self.counts.reshape(-1, 2).sum(axis=1)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        if extend_low:
+            self.counts[self.bins // 2:] = merged
+            self.low -= width
+        else:
+            self.counts[:self.bins // 2] = merged
+            self.high += width
+
+    def edges(self):
+        if self.low is None:
+            return np.zeros(self.bins + 1)
+        return np.linspace(self.low, self.high, self.bins + 1)
+
+
+# Function to find the range holding all but the outermost OUTLIER_FRACTION of values on each side, to the bin
+def core_range(counts, edges, outlier_fraction=OUTLIER_FRACTION):
+    cumulative = np.cumsum(counts)
+    first = int(np.searchsorted(cumulative, cumulative[-1] * outlier_fraction))
+    last = min(int(np.searchsorted(cumulative, cumulative[-1] * (1 - outlier_fraction))), len(counts) - 1)
+    return float(edges[first]), float(edges[last + 1])
+
+
+# Function to start the histogram of a second pass over the core range found by the first. A doubling histogram
+# sized by one far outlier squeezes the rest of the values into a few bins, which thresholds cannot resolve
+def core_histogram(stats, bins=DEFAULT_HISTOGRAM_BINS):
+    if stats['valid_pixels'] == 0:
+        return StreamingHistogram(bins)
+    return StreamingHistogram(bins, core_range(stats['histogram'], stats['bin_edges']))
+
+
+# Function to compute min, max, mean, nodata fraction and a histogram in one pass over the raster's blocks
+def streaming_stats(file_path, band=1, bins=DEFAULT_HISTOGRAM_BINS, max_window_pixels=DEFAULT_WINDOW_PIXELS):
+    histogram = StreamingHistogram(bins)
+    vmin, vmax = np.inf, -np.inf
+    total = 0.0
+    valid_pixels = 0
+    file_name = os.path.basename(file_path)
+    timers = [stage_timer('stats_read', file_name), stage_timer('stats_nodata_mask', file_name), stage_timer('statistics', file_name)]
+    read_timer, mask_timer, stats_timer = timers
+    with rasterio.open(file_path) as src:
+        total_pixels = src.width * src.height
+        for window in iter_windows(src, band, max_window_pixels):
+            with read_timer:
+                data = src.read(band, window=window)
+            read_timer.add_bytes(data.nbytes)
+            with mask_timer:
+                data = mask_nodata(data, src.nodata, inplace=True)
+            with stats_timer:
+                valid = data[~np.isnan(data)]
+                if valid.size:
+                    window_min, window_max = nan_minmax(valid)
+                    vmin = min(vmin, window_min)
+                    vmax = max(vmax, window_max)
+                    valid_pixels += valid.size
+                    total += float(valid.sum(dtype=np.float64))
+                    histogram.update(valid)
+    for timer in timers:
+        timer.record()
+
+    return {
+        'min': vmin if valid_pixels else np.nan,
+        'max': vmax if valid_pixels else np.nan,
+        'mean': total / valid_pixels if valid_pixels else np.nan,
+        'valid_pixels': valid_pixels,
+        'nodata_fraction': 1 - valid_pixels / total_pixels if total_pixels else 0.0,
+        'histogram': histogram.counts,
+        'bin_edges': histogram.edges(),
+    }
+
+
+# Function to yield min-max normalized float32 tiles of a raster, adding the raw values to a histogram if given
+def iter_normalized_tiles(file_path, vmin, vmax, band=1, max_window_pixels=DEFAULT_WINDOW_PIXELS, histogram=None):
+    file_name = os.path.basename(file_path)
+    timers = [stage_timer('read', file_name), stage_timer('nodata_mask', file_name), stage_timer('normalize', file_name)]
+    read_timer, mask_timer, normalize_timer = timers
+    with rasterio.open(file_path) as src:
+        for window in iter_windows(src, band, max_window_pixels):
+            with read_timer:
+                tile = src.read(band, window=window)
+            read_timer.add_bytes(tile.nbytes)
+            with mask_timer:
+                tile = mask_nodata(tile, src.nodata, inplace=True)
+            if histogram is not None:
+                histogram.update(tile)
+            with normalize_timer:
+                tile = normalize_inplace(tile, vmin, vmax)
+            normalize_timer.add_bytes(tile.nbytes)
+            yield window, tile
+    # Recorded once the caller has consumed every tile
+    for timer in timers:
+        timer.record()
+
+
+# Function to read a normalized float32 raster together with the statistics gathered on the way
+def normalize_geotiff(file_path, band=1, max_window_pixels=DEFAULT_WINDOW_PIXELS):
+    stats = streaming_stats(file_path, band, max_window_pixels=max_window_pixels)
+    with rasterio.open(file_path) as src:
+        bounds = src.bounds
+        metadata = src.meta
+        normalized = np.empty((src.height, src.width), dtype=np.float32)
+
+    histogram = core_histogram(stats)
+    for window, tile in iter_normalized_tiles(file_path, stats['min'], stats['max'], band, max_window_pixels, histogram):
+        normalized[window.row_off:window.row_off + window.height,
+                   window.col_off:window.col_off + window.width] = tile
+    # Thresholds are cut on the finer histogram of the normalization pass
+    stats.update(histogram=histogram.counts, bin_edges=histogram.edges())
+    return normalized, bounds, metadata, stats
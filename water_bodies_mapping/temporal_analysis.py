@@ -0,0 +1,199 @@
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.coords import BoundingBox
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from scipy.ndimage import label
+
+from raster_analysis import water_mask
+from raster_normalization import normalize_inplace
+from raster_stats_store import load_raster_stats
+from raster_streaming import streaming_stats
+from water_body_measurement import row_pixel_areas, DEFAULT_TILE_ROWS
+
+# Date stamps recognised in file names, e.g. Lake_2024-03-01.tif or Lake_20240301.tif
+DATE_PATTERN = re.compile(r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})')
+
+
+# Common grid the stacked rasters are warped onto
+class Grid:
+    def __init__(self, crs, transform, width, height):
+        self.crs = crs
+        self.transform = transform
+        self.width = width
+        self.height = height
+
+    @property
+    def bounds(self):
+        left, top = self.transform * (0, 0)
+        right, bottom = self.transform * (self.width, self.height)
+        return BoundingBox(left, bottom, right, top)
+
+
+# Function to label a raster with the acquisition date in its name or TIFF tags, or its file name
+def acquisition_label(file_path):
+    match = DATE_PATTERN.search(os.path.basename(file_path))
+    if match:
+        try:
+            return datetime(*map(int, match.groups())).date().isoformat()
+        except ValueError:
+            pass
+    with rasterio.open(file_path) as src:
+        stamp = src.tags().get('TIFFTAG_DATETIME')
+    if stamp:
+        try:
+            return datetime.strptime(stamp, '%Y:%m:%d %H:%M:%S').date().isoformat()
+        except ValueError:
+            pass
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+# Function to build a grid covering every raster, in the first raster's CRS at the finest resolution
+def common_grid(file_paths):
+    with rasterio.open(file_paths[0]) as src:
+        crs = src.crs
+    left, bottom, right, top = np.inf, np.inf, -np.inf, -np.inf
+    res_x, res_y = np.inf, np.inf
+    for file_path in file_paths:
+        with rasterio.open(file_path) as src:
+            bounds = src.bounds
+            if src.crs != crs:
+                bounds = transform_bounds(src.crs, crs, *bounds)
+            left, bottom = min(left, bounds[0]), min(bottom, bounds[1])
+            right, top = max(right, bounds[2]), max(top, bounds[3])
+            # Pixel size in the grid's CRS, from the extent of this raster after reprojection
+            res_x = min(res_x, (bounds[2] - bounds[0]) / src.width)
+            res_y = min(res_y, (bounds[3] - bounds[1]) / src.height)
+
+    width = max(1, int(round((right - left) / res_x)))
+    height = max(1, int(round((top - bottom) / res_y)))
+    return Grid(crs, from_origin(left, top, res_x, res_y), width, height)
+
+
+# Function to get a raster's value range from its stored statistics, or from one streaming pass when it has none
+def value_range(file_path):
+    stats = load_raster_stats(file_path)
+    if stats is not None:
+        return stats['min_value'], stats['max_value']
+    # Only the range is needed, so the full analysis and its database write are skipped
+    stats = streaming_stats(file_path)
+    return stats['min'], stats['max']
+
+
+# Lazily aligned stack of dated rasters: only the requested window of one date is ever decoded
+class RasterStack:
+    def __init__(self, file_paths, labels=None, grid=None):
+        self.file_paths = list(file_paths)
+        self.labels = labels or [acquisition_label(file_path) for file_path in self.file_paths]
+        self.grid = grid or common_grid(self.file_paths)
+        # Each date is normalized with its own range, like the single-raster view
+        self.ranges = [value_range(file_path) for file_path in self.file_paths]
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    # Function to iterate over full-width row bands of the grid
+    def windows(self, tile_rows=DEFAULT_TILE_ROWS):
+        for row_off in range(0, self.grid.height, tile_rows):
+            yield Window(0, row_off, self.grid.width, min(tile_rows, self.grid.height - row_off))
+
+    # Function to read one date's normalized window on the common grid, NaN outside the raster and at nodata
+    def read(self, index, window):
+        with rasterio.open(self.file_paths[index]) as src:
+            with WarpedVRT(src, crs=self.grid.crs, transform=self.grid.transform, width=self.grid.width,
+                           height=self.grid.height, resampling=Resampling.nearest, dtype='float32', nodata=np.nan) as vrt:
+                tile = vrt.read(1, window=window)
+        vmin, vmax = self.ranges[index]
+        return normalize_inplace(tile, vmin, vmax)
+
+
+# Function to compute water frequency, first/last wet date, gained/lost area and per-water-body area series
+def temporal_analysis(stack, tile_rows=DEFAULT_TILE_ROWS):
+    grid = stack.grid
+    dates = len(stack)
+    row_areas = row_pixel_areas(grid.transform, grid.crs, grid.height)
+
+    wet_count = np.zeros((grid.height, grid.width), dtype=np.uint16)
+    valid_count = np.zeros((grid.height, grid.width), dtype=np.uint16)
+    first_wet = np.full((grid.height, grid.width), -1, dtype=np.int16)
+    last_wet = np.full((grid.height, grid.width), -1, dtype=np.int16)
+    # One bit per pixel and date, so the per-water-body pass does not warp every raster again
+    wet_bits = np.zeros((dates, grid.height, (grid.width + 7) // 8), dtype=np.uint8)
+    wet_area = np.zeros(dates)
+    valid_first = np.zeros((grid.height, grid.width), dtype=bool)
+    wet_first = np.zeros((grid.height, grid.width), dtype=bool)
+    gained_area = lost_area = 0.0
+
+    for window in stack.windows(tile_rows):
+        rows = slice(window.row_off, window.row_off + window.height)
+        areas = row_areas[rows, None]
+        for index in range(dates):
+            tile = stack.read(index, window)
+            valid = ~np.isnan(tile)
+            wet = water_mask(tile)
+            wet_count[rows] += wet
+            valid_count[rows] += valid
+            first_wet[rows][wet & (first_wet[rows] < 0)] = index
+            last_wet[rows][wet] = index
+            wet_bits[index, rows] = np.packbits(wet, axis=1)
+            wet_area[index] = wet_area[index] + (wet * areas).sum()
+            if index == 0:
+                valid_first[rows], wet_first[rows] = valid, wet
+            if index == dates - 1:
+                # Change between the first and the last date, where both dates have data
+                both = valid_first[rows] & valid
+                gained_area += ((wet & ~wet_first[rows] & both) * areas).sum()
+                lost_area += ((wet_first[rows] & ~wet & both) * areas).sum()
+
+    frequency = np.full((grid.height, grid.width), np.nan, dtype=np.float32)
+    np.divide(wet_count, valid_count, out=frequency, where=valid_count > 0)
+
+    # Water bodies are the connected areas that were wet on at least one date
+    labeled_array, num_bodies = label(wet_count > 0)
+    body_areas = np.zeros((num_bodies, dates))
+    for window in stack.windows(tile_rows):
+        rows = slice(window.row_off, window.row_off + window.height)
+        labels = labeled_array[rows]
+        pixel_areas = np.broadcast_to(row_areas[rows, None], labels.shape)
+        for index in range(dates):
+            wet = np.unpackbits(wet_bits[index, rows], axis=1, count=grid.width).astype(bool)
+            body_areas[:, index] += np.bincount(labels[wet] - 1, weights=pixel_areas[wet], minlength=num_bodies)
+
+    body_series = pd.DataFrame(body_areas, columns=stack.labels)
+    body_series.insert(0, 'water_body_id', np.arange(1, num_bodies + 1))
+
+    return {
+        'labels': stack.labels,
+        'grid': grid,
+        'frequency': frequency,
+        'first_wet': first_wet,
+        'last_wet': last_wet,
+        'wet_area_m2': pd.Series(wet_area, index=stack.labels),
+        'gained_area_m2': float(gained_area),
+        'lost_area_m2': float(lost_area),
+        'water_bodies': body_series,
+    }
+
+
+# Function to get the GeoTIFF profile of the frequency raster
+def frequency_profile(grid):
+    return dict(driver='GTiff', width=grid.width, height=grid.height, count=1, dtype='float32', crs=grid.crs,
+                transform=grid.transform, nodata=np.nan, tiled=True, blockxsize=256, blockysize=256, compress='deflate')
+
+
+# Function to encode the frequency raster as GeoTIFF bytes, e.g. for a download button
+def frequency_geotiff_bytes(result):
+    with MemoryFile() as memfile:
+        with memfile.open(**frequency_profile(result['grid'])) as dst:
+            dst.write(result['frequency'], 1)
+            dst.update_tags(dates=','.join(result['labels']))
+        return memfile.read()
@@ -0,0 +1,260 @@
+import hashlib
+import io
+import math
+import os
+import shutil
+import threading
+
+import numpy as np
+import plotly.graph_objects as go
+import rasterio
+from matplotlib import pyplot as plt
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+from file_server import ensure_server, register_route, send_bytes, server_settings
+from raster_cache import RasterCache
+from raster_normalization import normalize_inplace
+from raster_stats_store import ensure_raster_stats
+
+TILE_SIZE = 256
+# Half the width of the web mercator world in metres
+MERCATOR_HALF_WORLD = 20037508.342789244
+TILE_FOLDER = 'water_bodies_mapping/storage/tiles'
+# Memory budget for rendered PNG tiles (can be overridden with ADAPT_TILE_CACHE_MB)
+DEFAULT_TILE_CACHE_MB = 64
+# Disk budget for rendered PNG tiles (can be overridden with ADAPT_TILE_DISK_CACHE_MB; 0 keeps tiles in memory only)
+DEFAULT_TILE_DISK_CACHE_MB = 512
+# The disk cache is checked against its budget after this many tiles were written
+PRUNE_EVERY_TILES = 500
+COLORMAP = 'viridis'
+TILE_MAX_AGE = 3600
+MAX_ZOOM = 22
+
+_rasters = {}
+_rasters_lock = threading.Lock()
+_tile_cache = RasterCache(int(float(os.environ.get('ADAPT_TILE_CACHE_MB', DEFAULT_TILE_CACHE_MB)) * 1024 * 1024))
+_colormap = plt.get_cmap(COLORMAP)
+_tiles_written = 0
+_prune_lock = threading.Lock()
+
+
+# Function to read the disk cache budget in bytes from the environment (0 means tiles are not kept on disk)
+def disk_cache_budget():
+    return int(float(os.environ.get('ADAPT_TILE_DISK_CACHE_MB', DEFAULT_TILE_DISK_CACHE_MB)) * 1024 * 1024)
+
+
+# Function to check whether map tiles can be served: browsers need the file server's public URL to fetch them
+def tiles_enabled():
+    return server_settings() is not None
+
+
+# Function to encode an RGBA array as PNG bytes
+def encode_png(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+# Function to get the web mercator bounds (left, bottom, right, top) of an XYZ tile
+def tile_bounds(z, x, y):
+    size = 2 * MERCATOR_HALF_WORLD / 2 ** z
+    left = -MERCATOR_HALF_WORLD + x * size
+    top = MERCATOR_HALF_WORLD - y * size
+    return left, top - size, left + size, top
+
+
+# Function to make a GeoTIFF available as map tiles and return its URL template, or None without a public file server
+def register_raster(file_path):
+    base_url = ensure_server()
+    if base_url is None:
+        return None
+    real_path = os.path.realpath(file_path)
+    key = hashlib.sha1(real_path.encode()).hexdigest()[:12]
+    stat = os.stat(real_path)
+
+    stats = ensure_raster_stats(file_path)
+    with rasterio.open(real_path) as src:
+        mercator_bounds = transform_bounds(src.crs, 'EPSG:3857', *src.bounds)
+        lonlat_bounds = transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+        overview_factors = src.overviews(1)
+        resolution = (mercator_bounds[2] - mercator_bounds[0]) / src.width
+
+    # Tiles rendered for an older version of the file or its value range are never reused
+    version = hashlib.sha1(f"{real_path}:{stat.st_mtime_ns}:{stat.st_size}:{stats['min_value']}:{stats['max_value']}:{COLORMAP}"
+                           .encode()).hexdigest()[:16]
+    info = {
+        'path': real_path,
+        'version': version,
+        'min_value': stats['min_value'],
+        'max_value': stats['max_value'],
+        'mercator_bounds': mercator_bounds,
+        'bounds': lonlat_bounds,
+        'resolution': resolution,
+        'overview_factors': overview_factors,
+    }
+    with _rasters_lock:
+        previous = _rasters.get(key)
+        _rasters[key] = info
+    if previous is not None and previous['version'] != version:
+        shutil.rmtree(os.path.join(TILE_FOLDER, previous['version']), ignore_errors=True)
+
+    return dict(info, url=f"{base_url}/tiles/{key}/{{z}}/{{x}}/{{y}}.png")
+
+
+# Function to pick the coarsest overview that is still at least as detailed as the tile
+def overview_level(info, z):
+    tile_resolution = 2 * MERCATOR_HALF_WORLD / TILE_SIZE / 2 ** z
+    level = None
+    for index, factor in enumerate(info['overview_factors']):
+        if info['resolution'] * factor <= tile_resolution:
+            level = index
+    return level
+
+
+# Function to render one tile: warp the needed window to web mercator and colour it
+def render_tile(info, z, x, y):
+    bounds = tile_bounds(z, x, y)
+    left, bottom, right, top = info['mercator_bounds']
+    if bounds[0] >= right or bounds[2] <= left or bounds[1] >= top or bounds[3] <= bottom:
+        return EMPTY_TILE
+
+    level = overview_level(info, z)
+    open_options = {} if level is None else {'OVERVIEW_LEVEL': level}
+    with rasterio.open(info['path'], **open_options) as src:
+        with WarpedVRT(src, crs='EPSG:3857', transform=from_bounds(*bounds, TILE_SIZE, TILE_SIZE), width=TILE_SIZE,
+                       height=TILE_SIZE, resampling=Resampling.nearest, dtype='float32', nodata=np.nan) as vrt:
+            data = vrt.read(1)
+
+    missing = np.isnan(data)
+    if missing.all():
+        return EMPTY_TILE
+    normalized = normalize_inplace(data, info['min_value'], info['max_value'])
+    np.clip(normalized, 0, 1, out=normalized)
+    normalized[missing] = 0
+    rgba = _colormap(normalized, bytes=True)
+    rgba[missing, 3] = 0
+    return encode_png(rgba)
+
+
+# Function to return a tile from the memory cache, the disk cache or a fresh render
+def get_tile(info, z, x, y):
+    cache_key = (info['version'], z, x, y)
+    tile = _tile_cache.get(cache_key)
+    if tile is not None:
+        return tile
+
+    max_bytes = disk_cache_budget()
+    if max_bytes <= 0:
+        return _tile_cache.put(cache_key, render_tile(info, z, x, y))
+    tile_path = os.path.join(TILE_FOLDER, info['version'], str(z), str(x), f'{y}.png')
+    try:
+        with open(tile_path, 'rb') as f:
+            tile = f.read()
+        # The modification time marks recent use for pruning
+        os.utime(tile_path)
+    except FileNotFoundError:
+        tile = render_tile(info, z, x, y)
+        write_tile(tile_path, tile, max_bytes)
+    return _tile_cache.put(cache_key, tile)
+
+
+# Function to write a rendered tile to the disk cache, pruning the cache every PRUNE_EVERY_TILES writes
+def write_tile(tile_path, tile, max_bytes):
+    global _tiles_written
+    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+    temp_path = f'{tile_path}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(tile)
+    os.replace(temp_path, tile_path)
+    with _prune_lock:
+        _tiles_written += 1
+        due = _tiles_written >= PRUNE_EVERY_TILES
+        if due:
+            _tiles_written = 0
+    if due:
+        prune_disk_cache(max_bytes)
+
+
+# Function to delete the least recently used tiles until the disk cache fits its budget
+def prune_disk_cache(max_bytes):
+    tiles = []
+    for folder, _, file_names in os.walk(TILE_FOLDER):
+        for file_name in file_names:
+            if not file_name.endswith('.png'):
+                continue
+            tile_path = os.path.join(folder, file_name)
+            try:
+                stat = os.stat(tile_path)
+            except FileNotFoundError:
+                continue
+            tiles.append((stat.st_mtime, tile_path, stat.st_size))
+    total = sum(nbytes for _, _, nbytes in tiles)
+    for _, tile_path, nbytes in sorted(tiles):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(tile_path)
+        except FileNotFoundError:
+            pass
+        total -= nbytes
+
+
+# Function to answer /<token>/tiles/<raster key>/<z>/<x>/<y>.png
+def _serve_tile(handler, subpath, query):
+    try:
+        key, z, x, y = subpath.split('/')
+        z, x, y = int(z), int(x), int(y.removesuffix('.png'))
+    except ValueError:
+        handler.send_error(400)
+        return
+    with _rasters_lock:
+        info = _rasters.get(key)
+    if info is None or not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        handler.send_error(404)
+        return
+    send_bytes(handler, get_tile(info, z, x, y), 'image/png', max_age=TILE_MAX_AGE)
+
+
+register_route('tiles', _serve_tile)
+
+
+# Function to estimate a map zoom level that fits longitude/latitude bounds
+def zoom_for_bounds(bounds):
+    span = max(bounds[2] - bounds[0], (bounds[3] - bounds[1]) * 2, 1e-9)
+    return max(0, min(MAX_ZOOM, math.log2(360 / span)))
+
+
+# Function to draw a registered raster as map tiles under an outline of its extent, optionally with water body outlines
+def create_tile_map(fig, tiles, selected_file, outlines=None):
+    west, south, east, north = tiles['bounds']
+    layers = [dict(sourcetype='raster', source=[tiles['url']], below='traces')]
+    if outlines is not None:
+        # Water body polygons are drawn as a vector layer on top of the tiles
+        layers.append(dict(sourcetype='geojson', source=outlines, type='line', color='#FF4B4B', line=dict(width=1.5)))
+    fig.add_trace(go.Scattermapbox(
+        lon=[west, east, east, west, west],
+        lat=[south, south, north, north, south],
+        mode='lines',
+        line=dict(width=1, color='#4B0082'),
+        name=selected_file,
+        hoverinfo='name',
+    ))
+    fig.update_layout(
+        title=f'GeoTIFF Map: {selected_file}',
+        height=600,
+        margin=dict(l=0, r=0, t=40, b=0),
+        mapbox=dict(
+            style='carto-positron',
+            center=dict(lon=(west + east) / 2, lat=(south + north) / 2),
+            zoom=zoom_for_bounds(tiles['bounds']),
+            # Only the tiles in view are fetched, at the resolution of the current zoom
+            layers=layers,
+        ),
+    )
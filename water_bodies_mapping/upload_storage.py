@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Content-addressed store shared by both apps: objects/<first two hex digits>/<sha256><extension>
+STORE_FOLDER = 'water_bodies_mapping/storage'
+CHUNK_SIZE = 1024 * 1024
+
+
+# Function to get the store path for a content hash
+def object_path(sha256, extension, store_folder=STORE_FOLDER):
+    return os.path.join(store_folder, 'objects', sha256[:2], sha256 + extension.lower())
+
+
+# Function to stream an uploaded file into the store in fixed-size chunks while hashing it
+def store_upload(uploaded_file, extension, store_folder=STORE_FOLDER, chunk_size=CHUNK_SIZE):
+    temp_folder = os.path.join(store_folder, 'tmp')
+    os.makedirs(temp_folder, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=temp_folder, delete=False) as temp:
+        try:
+            for chunk in iter(lambda: uploaded_file.read(chunk_size), b''):
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+            temp.flush()
+            os.fsync(temp.fileno())
+        except BaseException:
+            temp.close()
+            os.remove(temp.name)
+            raise
+
+    sha256 = digest.hexdigest()
+    stored_path = object_path(sha256, extension, store_folder)
+    duplicate = os.path.exists(stored_path)
+    if duplicate:
+        # Identical content is already stored, so the new copy is dropped
+        os.remove(temp.name)
+    else:
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        os.replace(temp.name, stored_path)
+    return {'sha256': sha256, 'path': stored_path, 'size': size, 'duplicate': duplicate}
+
+
+# Function to check whether two paths are the same stored file
+def same_file(path, other_path):
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
+
+
+# Function to check whether two files hold the same bytes
+def same_content(path, other_path):
+    if os.path.getsize(path) != os.path.getsize(other_path):
+        return False
+    return file_sha256(path) == file_sha256(other_path)
+
+
+# Function to hash a file in chunks
+def file_sha256(file_path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to pick a free file name by appending a counter, e.g. 'Map3 (2).tif'
+def unique_path(file_path):
+    base, extension = os.path.splitext(file_path)
+    counter = 2
+    while os.path.exists(file_path):
+        file_path = f"{base} ({counter}){extension}"
+        counter += 1
+    return file_path
+
+
+# Function to make a stored object visible under a readable name in a folder
+def publish(stored_path, file_path, overwrite=False):
+    if same_file(stored_path, file_path):
+        return file_path
+    if os.path.exists(file_path) and not overwrite and not same_content(stored_path, file_path):
+        # A different file already uses this name, so keep both instead of silently overwriting it
+        file_path = unique_path(file_path)
+
+    # Hard links cost no extra disk; fall back to a copy where links are not supported
+    temp_path = file_path + '.publishing'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(stored_path, temp_path)
+    except OSError:
+        shutil.copyfile(stored_path, temp_path)
+    os.replace(temp_path, file_path)
+    return file_path
+
+
+# Function to store an upload and publish it under its readable name in one step
+def save_upload(uploaded_file, file_path, overwrite=False):
+    stored = store_upload(uploaded_file, os.path.splitext(file_path)[1])
+    stored['published_path'] = publish(stored['path'], file_path, overwrite)
+    return stored
+
+
+# Function to store converted content for a published upload and republish it under the same name
+def replace_stored(stored, new_file_path, store_folder=STORE_FOLDER):
+    extension = os.path.splitext(stored['published_path'])[1]
+    with open(new_file_path, 'rb') as f:
+        replacement = store_upload(f, extension, store_folder)
+    replacement['published_path'] = publish(replacement['path'], stored['published_path'], overwrite=True)
+    # The superseded object is kept: other uploads of the same content may still point at it
+    replacement['duplicate'] = stored['duplicate']
+    return replacement
@@ -0,0 +1,186 @@
+import math
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import Window
+from scipy.ndimage import label
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from raster_streaming import read_window, streaming_stats
+from raster_normalization import normalize_inplace
+
+EARTH_RADIUS_M = 6371008.8
+# Number of raster rows labeled at once in tiled mode
+DEFAULT_TILE_ROWS = 1024
+
+TABLE_COLUMNS = ['water_body_id', 'pixel_count', 'area_m2', 'centroid_lon', 'centroid_lat',
+                 'min_lon', 'min_lat', 'max_lon', 'max_lat', 'mean_value']
+
+
+# Function to decide whether raster coordinates are degrees
+def is_geographic(crs, transform):
+    if crs is not None:
+        return crs.is_geographic
+    # Without a CRS assume degrees when the origin looks like a longitude/latitude pair
+    return abs(transform.c) <= 180 and abs(transform.f) <= 90
+
+
+# Function to compute the ground area in m² of one pixel in every raster row
+def row_pixel_areas(transform, crs, height):
+    pixel_area = abs(transform.a * transform.e - transform.b * transform.d)
+    if is_geographic(crs, transform):
+        # A degree of longitude shrinks with the cosine of the latitude
+        latitudes = transform.f + transform.e * (np.arange(height) + 0.5)
+        return pixel_area * (math.pi / 180 * EARTH_RADIUS_M) ** 2 * np.cos(np.radians(latitudes))
+    unit_factor = 1.0
+    if crs is not None:
+        try:
+            unit_factor = crs.linear_units_factor[1]
+        except Exception:
+            pass
+    return np.full(height, pixel_area * unit_factor ** 2)
+
+
+# Function to reduce a labeled block into per-component sums with bincount-style reductions
+def component_sums(labeled_array, num_features, values, row_areas, row_offset=0):
+    rows, cols = np.nonzero(labeled_array)
+    labels = labeled_array[rows, cols] - 1
+    rows = rows + row_offset
+
+    sums = {
+        'pixel_count': np.bincount(labels, minlength=num_features).astype(np.int64),
+        'sum_row': np.bincount(labels, weights=rows + 0.5, minlength=num_features),
+        'sum_col': np.bincount(labels, weights=cols + 0.5, minlength=num_features),
+        'sum_value': np.bincount(labels, weights=values[rows - row_offset, cols], minlength=num_features),
+        'area_m2': np.bincount(labels, weights=row_areas[rows], minlength=num_features),
+        'min_row': np.full(num_features, np.iinfo(np.int64).max),
+        'max_row': np.full(num_features, -1, dtype=np.int64),
+        'min_col': np.full(num_features, np.iinfo(np.int64).max),
+        'max_col': np.full(num_features, -1, dtype=np.int64),
+    }
+    np.minimum.at(sums['min_row'], labels, rows)
+    np.maximum.at(sums['max_row'], labels, rows)
+    np.minimum.at(sums['min_col'], labels, cols)
+    np.maximum.at(sums['max_col'], labels, cols)
+    return sums
+
+
+# Function to turn per-component sums into the measurement table in longitude/latitude
+def component_table(sums, transform, crs):
+    count = sums['pixel_count']
+    if count.size == 0:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    centroid_x, centroid_y = transform * (sums['sum_col'] / count, sums['sum_row'] / count)
+    # Pixel edges of each bounding box: top-left corner of the first pixel, bottom-right of the last
+    left, top = transform * (sums['min_col'].astype(float), sums['min_row'].astype(float))
+    right, bottom = transform * (sums['max_col'] + 1.0, sums['max_row'] + 1.0)
+
+    if crs is not None and not crs.is_geographic:
+        xs = np.concatenate([centroid_x, left, right])
+        ys = np.concatenate([centroid_y, top, bottom])
+        xs, ys = warp_transform(crs, 'EPSG:4326', xs, ys)
+        centroid_x, left, right = np.split(np.asarray(xs), 3)
+        centroid_y, top, bottom = np.split(np.asarray(ys), 3)
+
+    return pd.DataFrame({
+        'water_body_id': np.arange(1, count.size + 1),
+        'pixel_count': count,
+        'area_m2': sums['area_m2'],
+        'centroid_lon': centroid_x,
+        'centroid_lat': centroid_y,
+        'min_lon': np.minimum(left, right),
+        'min_lat': np.minimum(top, bottom),
+        'max_lon': np.maximum(left, right),
+        'max_lat': np.maximum(top, bottom),
+        'mean_value': sums['sum_value'] / count,
+    })
+
+
+# Function to measure every water body in an in-memory normalized raster, optionally from precomputed (labels, count)
+def measure_water_bodies(img_data, transform, crs, threshold=0.5, labels=None):
+    labeled_array, num_features = labels if labels is not None else label(img_data > threshold)
+    sums = component_sums(labeled_array, num_features, img_data, row_pixel_areas(transform, crs, img_data.shape[0]))
+    return component_table(sums, transform, crs)
+
+
+# Function to measure water bodies band by band, merging components that touch across band seams
+def measure_water_bodies_tiled(file_path, threshold=0.5, band=1, tile_rows=DEFAULT_TILE_ROWS):
+    stats = streaming_stats(file_path, band)
+    vmin, vmax = stats['min'], stats['max']
+
+    partial_sums = []
+    seam_pairs = []
+    num_labels = 0
+    previous_last_row = None
+
+    with rasterio.open(file_path) as src:
+        transform, crs = src.transform, src.crs
+        row_areas = row_pixel_areas(transform, crs, src.height)
+
+        for row_off in range(0, src.height, tile_rows):
+            window = Window(0, row_off, src.width, min(tile_rows, src.height - row_off))
+            tile = normalize_inplace(read_window(src, window, band), vmin, vmax)
+
+            labeled_tile, num_features = label(tile > threshold)
+            partial_sums.append(component_sums(labeled_tile, num_features, tile, row_areas, row_off))
+
+            # Give this band's labels global ids and record which ones continue a component from the band above
+            first_row = np.where(labeled_tile[0] > 0, labeled_tile[0] + num_labels, 0)
+            if previous_last_row is not None:
+                touching = (previous_last_row > 0) & (first_row > 0)
+                seam_pairs.append(np.stack([previous_last_row[touching], first_row[touching]]))
+            previous_last_row = np.where(labeled_tile[-1] > 0, labeled_tile[-1] + num_labels, 0)
+            num_labels += num_features
+
+    if num_labels == 0:
+        return component_table({'pixel_count': np.zeros(0, dtype=np.int64)}, transform, crs)
+
+    # Connected components over the seam graph map every band-local label to its merged water body
+    pairs = np.concatenate(seam_pairs, axis=1) - 1 if seam_pairs else np.zeros((2, 0), dtype=np.int64)
+    graph = coo_matrix((np.ones(pairs.shape[1]), (pairs[0], pairs[1])), shape=(num_labels, num_labels))
+    num_bodies, merged = connected_components(graph, directed=False)
+
+    # Renumber merged bodies in order of first appearance, as scipy.ndimage.label would
+    _, first_seen = np.unique(merged, return_index=True)
+    order = np.empty(num_bodies, dtype=np.int64)
+    order[np.argsort(first_seen)] = np.arange(num_bodies)
+    merged = order[merged]
+
+    sums = {key: np.concatenate([part[key] for part in partial_sums]) for key in partial_sums[0]}
+    merged_sums = {key: np.bincount(merged, weights=sums[key], minlength=num_bodies)
+                   for key in ('sum_row', 'sum_col', 'sum_value', 'area_m2')}
+    merged_sums['pixel_count'] = np.bincount(merged, weights=sums['pixel_count'], minlength=num_bodies).astype(np.int64)
+    for key, reduce, start in (('min_row', np.minimum, np.iinfo(np.int64).max), ('max_row', np.maximum, -1),
+                               ('min_col', np.minimum, np.iinfo(np.int64).max), ('max_col', np.maximum, -1)):
+        merged_sums[key] = np.full(num_bodies, start, dtype=np.int64)
+        reduce.at(merged_sums[key], merged, sums[key])
+    return component_table(merged_sums, transform, crs)
+
+
+# Function to compare measured areas with the surveyed areas in the Excel dataset
+def compare_with_dataset(table, dataset):
+    if table.empty or dataset.empty:
+        return pd.DataFrame()
+    inside = dataset[(dataset['longitude'] >= table['min_lon'].min()) & (dataset['longitude'] <= table['max_lon'].max()) &
+                     (dataset['latitude'] >= table['min_lat'].min()) & (dataset['latitude'] <= table['max_lat'].max())]
+    if inside.empty:
+        return pd.DataFrame()
+
+    # Match each surveyed water body to the detected body with the nearest centroid
+    dlon = inside['longitude'].to_numpy()[:, None] - table['centroid_lon'].to_numpy()[None, :]
+    dlat = inside['latitude'].to_numpy()[:, None] - table['centroid_lat'].to_numpy()[None, :]
+    nearest = np.argmin(dlon ** 2 + dlat ** 2, axis=1)
+    measured = table['area_m2'].to_numpy()[nearest]
+    surveyed = inside['area (square meters)'].to_numpy(dtype=float)
+
+    return pd.DataFrame({
+        'water body name': inside['water body name'].to_numpy(),
+        'water_body_id': table['water_body_id'].to_numpy()[nearest],
+        'area (square meters)': surveyed,
+        'measured area (square meters)': measured,
+        'difference (%)': (measured - surveyed) / surveyed * 100,
+    })
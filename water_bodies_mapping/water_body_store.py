@@ -0,0 +1,212 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from contributions_db import DATABASE_PATH, connection, register_schema
+from excel_cache import file_sha256, read_excel_cached
+
+# Workbook columns and the store columns they are loaded into
+COLUMNS = {
+    'water body name': 'name',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'use/ purpose': 'purpose',
+    'area (square meters)': 'area_m2',
+}
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_TOP_N = 15
+DEFAULT_BINS = 20
+OTHERS_LABEL = 'Others'
+
+
+# Function to create the water body tables and the indexes the filters run on
+def init_water_body_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS water_body_datasets (
+        source_path TEXT PRIMARY KEY,
+        sha256 TEXT,
+        file_size INTEGER,
+        file_mtime_ns INTEGER,
+        row_count INTEGER,
+        min_area REAL,
+        max_area REAL,
+        loaded_at TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS water_bodies (
+        id INTEGER PRIMARY KEY,
+        source_path TEXT,
+        name TEXT,
+        latitude REAL,
+        longitude REAL,
+        purpose TEXT,
+        area_m2 REAL
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_water_bodies_name ON water_bodies (source_path, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_water_bodies_area ON water_bodies (source_path, area_m2)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_water_bodies_purpose ON water_bodies (source_path, purpose)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_water_bodies_location ON water_bodies (source_path, longitude, latitude)')
+
+
+register_schema(init_water_body_tables)
+
+
+# Function to turn a workbook cell into a value the database driver accepts (NaN becomes NULL)
+def to_sql_value(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# Function to (re)load a workbook into the store and record its area range
+def load_workbook(excel_path, stat, sha256, database_path=DATABASE_PATH):
+    df = read_excel_cached(excel_path)
+    missing = [column for column in COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"'{os.path.basename(excel_path)}' is missing the columns {missing}")
+    source_path = os.path.abspath(excel_path)
+    df = df[list(COLUMNS)]
+    areas = pd.to_numeric(df['area (square meters)'], errors='coerce')
+
+    with connection(database_path) as conn:
+        # Replace the rows in one transaction so readers see either the old or the new workbook
+        conn.execute('DELETE FROM water_bodies WHERE source_path = ?', (source_path,))
+        conn.executemany('INSERT INTO water_bodies (source_path, name, latitude, longitude, purpose, area_m2) VALUES (?, ?, ?, ?, ?, ?)',
+                         ((source_path,) + tuple(to_sql_value(value) for value in row) for row in df.itertuples(index=False)))
+        meta = {
+            'source_path': source_path,
+            'sha256': sha256,
+            'file_size': stat.st_size,
+            'file_mtime_ns': stat.st_mtime_ns,
+            'row_count': len(df),
+            'min_area': float(areas.min()) if areas.notna().any() else 0.0,
+            'max_area': float(areas.max()) if areas.notna().any() else 0.0,
+            'loaded_at': datetime.now().isoformat(),
+        }
+        conn.execute('INSERT OR REPLACE INTO water_body_datasets (source_path, sha256, file_size, file_mtime_ns, row_count, '
+                     'min_area, max_area, loaded_at) VALUES (:source_path, :sha256, :file_size, :file_mtime_ns, :row_count, '
+                     ':min_area, :max_area, :loaded_at)', meta)
+    return meta
+
+
+# Function to get a workbook's dataset record (row count, cached area range), loading it into the store when it changed
+def load_dataset(excel_path, database_path=DATABASE_PATH):
+    source_path = os.path.abspath(excel_path)
+    stat = os.stat(excel_path)
+    with connection(database_path) as conn:
+        row = conn.execute('SELECT source_path, sha256, file_size, file_mtime_ns, row_count, min_area, max_area, loaded_at '
+                           'FROM water_body_datasets WHERE source_path = ?', (source_path,)).fetchone()
+    if row is not None:
+        meta = dict(zip(['source_path', 'sha256', 'file_size', 'file_mtime_ns', 'row_count', 'min_area', 'max_area', 'loaded_at'], row))
+        if (meta['file_size'], meta['file_mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return meta
+        # The mtime can change without the content changing (copies, checkouts), so confirm with the hash
+        sha256 = file_sha256(excel_path)
+        if meta['file_size'] == stat.st_size and meta['sha256'] == sha256:
+            with connection(database_path) as conn:
+                conn.execute('UPDATE water_body_datasets SET file_mtime_ns = ? WHERE source_path = ?', (stat.st_mtime_ns, source_path))
+            meta['file_mtime_ns'] = stat.st_mtime_ns
+            return meta
+        return load_workbook(excel_path, stat, sha256, database_path)
+    return load_workbook(excel_path, stat, file_sha256(excel_path), database_path)
+
+
+# Function to build the WHERE clause for the name, area range and use/purpose filters
+def filter_clause(source_path, names=None, min_area=None, max_area=None, purposes=None):
+    conditions = ['source_path = ?']
+    params = [source_path]
+    if names:
+        conditions.append(f"name IN ({', '.join('?' * len(names))})")
+        params.extend(names)
+    if purposes:
+        conditions.append(f"purpose IN ({', '.join('?' * len(purposes))})")
+        params.extend(purposes)
+    if min_area is not None:
+        conditions.append('area_m2 >= ?')
+        params.append(min_area)
+    if max_area is not None:
+        conditions.append('area_m2 <= ?')
+        params.append(max_area)
+    return ' AND '.join(conditions), params
+
+
+# Function to list the distinct values of the name or purpose column (read from its index)
+def distinct_values(dataset, column, database_path=DATABASE_PATH):
+    if column not in ('name', 'purpose'):
+        raise ValueError(f"Unknown filter column '{column}'")
+    with connection(database_path) as conn:
+        rows = conn.execute(f'SELECT DISTINCT {column} FROM water_bodies WHERE source_path = ? AND {column} IS NOT NULL '
+                            f'ORDER BY {column}', (dataset['source_path'],)).fetchall()
+    return [row[0] for row in rows]
+
+
+# Function to count and total the water bodies matching the filters
+def summarize(dataset, filters, database_path=DATABASE_PATH):
+    where, params = filter_clause(dataset['source_path'], **filters)
+    with connection(database_path) as conn:
+        count, total_area = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(area_m2), 0) FROM water_bodies WHERE {where}',
+                                         params).fetchone()
+    return {'count': count, 'total_area': total_area}
+
+
+# Function to fetch one page of matching water bodies, largest first, with the workbook column names
+def water_bodies_page(dataset, filters, page=0, page_size=DEFAULT_PAGE_SIZE, database_path=DATABASE_PATH):
+    where, params = filter_clause(dataset['source_path'], **filters)
+    with connection(database_path) as conn:
+        rows = conn.execute(f'SELECT name, latitude, longitude, purpose, area_m2 FROM water_bodies WHERE {where} '
+                            f'ORDER BY area_m2 DESC, id LIMIT ? OFFSET ?', params + [page_size, page * page_size]).fetchall()
+    return pd.DataFrame(rows, columns=list(COLUMNS))
+
+
+# Function to get the N largest matching water bodies plus one 'Others' row holding the rest
+def top_water_bodies(dataset, filters, n=DEFAULT_TOP_N, database_path=DATABASE_PATH):
+    top = water_bodies_page(dataset, filters, 0, n, database_path)
+    summary = summarize(dataset, filters, database_path)
+    top['count'] = 1
+    others_count = summary['count'] - len(top)
+    if others_count > 0:
+        others = {'water body name': f'{OTHERS_LABEL} ({others_count})', 'use/ purpose': 'various',
+                  'area (square meters)': summary['total_area'] - top['area (square meters)'].sum(), 'count': others_count}
+        top = pd.concat([top, pd.DataFrame([others])], ignore_index=True)
+    return top
+
+
+# Function to bin the matching areas into equal-width bins, counted and totalled in the database
+def area_histogram(dataset, filters, bins=DEFAULT_BINS, database_path=DATABASE_PATH):
+    where, params = filter_clause(dataset['source_path'], **filters)
+    with connection(database_path) as conn:
+        low, high = conn.execute(f'SELECT MIN(area_m2), MAX(area_m2) FROM water_bodies WHERE {where}', params).fetchone()
+        if low is None:
+            return pd.DataFrame(columns=['area from', 'area to', 'count', 'total area'])
+        width = (high - low) / bins or 1.0
+        # The largest area falls exactly on the upper edge, so it is clamped into the last bin
+        rows = conn.execute(f'SELECT MIN(CAST((area_m2 - ?) / ? AS INTEGER), ?) AS bin, COUNT(*), SUM(area_m2) '
+                            f'FROM water_bodies WHERE {where} AND area_m2 IS NOT NULL GROUP BY bin ORDER BY bin',
+                            [low, width, bins - 1] + params).fetchall()
+    histogram = pd.DataFrame(rows, columns=['bin', 'count', 'total area'])
+    histogram['area from'] = low + histogram['bin'] * width
+    histogram['area to'] = histogram['area from'] + width
+    return histogram[['area from', 'area to', 'count', 'total area']]
+
+
+# Function to fetch the water bodies inside longitude/latitude bounds, e.g. to compare with a raster's measurements
+def water_bodies_in_bounds(dataset, west, south, east, north, database_path=DATABASE_PATH):
+    with connection(database_path) as conn:
+        rows = conn.execute('SELECT name, latitude, longitude, purpose, area_m2 FROM water_bodies WHERE source_path = ? '
+                            'AND longitude BETWEEN ? AND ? AND latitude BETWEEN ? AND ?',
+                            (dataset['source_path'], west, east, south, north)).fetchall()
+    return pd.DataFrame(rows, columns=list(COLUMNS))
+
+
+# Function to drop a workbook's rows from the store, e.g. when the workbook is deleted
+def remove_dataset(excel_path, database_path=DATABASE_PATH):
+    source_path = os.path.abspath(excel_path)
+    with connection(database_path) as conn:
+        conn.execute('DELETE FROM water_bodies WHERE source_path = ?', (source_path,))
+        conn.execute('DELETE FROM water_body_datasets WHERE source_path = ?', (source_path,))
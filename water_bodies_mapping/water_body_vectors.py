@@ -0,0 +1,180 @@
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+from rasterio.features import shapes
+from rasterio.warp import transform as warp_transform
+from scipy.ndimage import label
+
+from raster_analysis import WATER_THRESHOLD, water_mask, cached_read_normalized
+from decoded_store import load_labels
+from water_body_measurement import EARTH_RADIUS_M, is_geographic
+
+VECTOR_FOLDER = 'water_bodies_mapping/storage/vectors'
+# Outlines are simplified to within this many pixels of the pixel edges
+DEFAULT_TOLERANCE_PIXELS = 0.5
+# Decimal places kept in GeoJSON coordinates (about 1 cm in degrees)
+COORDINATE_DECIMALS = 7
+
+
+# Function to simplify a polyline with the Douglas-Peucker algorithm, iteratively and with vectorized distances
+def douglas_peucker(points, tolerance):
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = math.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            # Perpendicular distance of every intermediate point to the chord
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return points[keep]
+
+
+# Function to simplify a closed ring, keeping it a valid ring of at least four points
+def simplify_ring(ring, tolerance):
+    ring = np.asarray(ring, dtype=float)
+    if len(ring) <= 4 or tolerance <= 0:
+        return ring
+    # Split at the point farthest from the start so both halves have well-defined chords
+    split = int(np.argmax(np.hypot(*(ring[:-1] - ring[0]).T)))
+    if split == 0:
+        return ring
+    simplified = np.concatenate([douglas_peucker(ring[:split + 1], tolerance)[:-1], douglas_peucker(ring[split:], tolerance)])
+    return simplified if len(simplified) >= 4 else ring
+
+
+# Function to get a ring's signed area and area-weighted centroid with the shoelace formula
+def ring_area_centroid(ring):
+    x, y = ring[:-1, 0], ring[:-1, 1]
+    x_next, y_next = ring[1:, 0], ring[1:, 1]
+    cross = x * y_next - x_next * y
+    area = cross.sum() / 2
+    if area == 0:
+        return 0.0, ring[:-1].mean(axis=0)
+    centroid = np.array([((x + x_next) * cross).sum(), ((y + y_next) * cross).sum()]) / (6 * area)
+    return area, centroid
+
+
+# Function to scale raster CRS coordinates to metres around a latitude
+def metre_scale(transform, crs, latitude):
+    if is_geographic(crs, transform):
+        metres_per_degree = math.pi / 180 * EARTH_RADIUS_M
+        return metres_per_degree * math.cos(math.radians(latitude)), metres_per_degree
+    unit_factor = 1.0
+    if crs is not None:
+        try:
+            unit_factor = crs.linear_units_factor[1]
+        except Exception:
+            pass
+    return unit_factor, unit_factor
+
+
+# Function to compute area (m²), perimeter (m) and centroid of a polygon given as rings in raster CRS coordinates
+def polygon_metrics(polygons, transform, crs):
+    # Work relative to the first vertex so the shoelace products stay small
+    origin = polygons[0][0][0]
+    scale = np.array(metre_scale(transform, crs, polygons[0][0][:, 1].mean()))
+    total_area = perimeter = 0.0
+    weighted_centroid = np.zeros(2)
+    for rings in polygons:
+        for ring in rings:
+            metres = (ring - origin) * scale
+            # Exterior rings and holes have opposite orientations, so signed areas subtract the holes
+            area, centroid = ring_area_centroid(metres)
+            total_area += area
+            weighted_centroid += area * centroid
+            perimeter += np.hypot(*np.diff(metres, axis=0).T).sum()
+    centroid = origin + weighted_centroid / total_area / scale if total_area else polygons[0][0].mean(axis=0)
+    return abs(total_area), perimeter, centroid
+
+
+# Function to turn the labeled water mask into simplified polygons with attributes, as a GeoJSON FeatureCollection
+def vectorize_water_bodies(img_data, transform, crs, threshold=WATER_THRESHOLD, tolerance_pixels=DEFAULT_TOLERANCE_PIXELS, labels=None):
+    labeled_array, num_features = labels if labels is not None else label(water_mask(img_data, threshold))
+    tolerance = tolerance_pixels * math.hypot(transform.a, transform.e) / math.sqrt(2)
+
+    # Same 4-connectivity as scipy.ndimage.label, so each water body traces to one polygon (holes included)
+    bodies = {}
+    for geometry, value in shapes(labeled_array.astype(np.int32), mask=labeled_array > 0, connectivity=4, transform=transform):
+        rings = [simplify_ring(ring, tolerance) for ring in geometry['coordinates']]
+        bodies.setdefault(int(value), []).append(rings)
+
+    features = []
+    for water_body_id in sorted(bodies):
+        polygons = bodies[water_body_id]
+        area, perimeter, centroid = polygon_metrics(polygons, transform, crs)
+        if crs is not None and not crs.is_geographic:
+            # GeoJSON coordinates are longitude/latitude; project every vertex (and the centroid) in one call
+            flat = np.concatenate([ring for rings in polygons for ring in rings] + [centroid[None, :]])
+            xs, ys = warp_transform(crs, 'EPSG:4326', flat[:, 0], flat[:, 1])
+            flat = np.column_stack([xs, ys])
+            centroid = flat[-1]
+            offset = 0
+            for rings in polygons:
+                for index, ring in enumerate(rings):
+                    rings[index] = flat[offset:offset + len(ring)]
+                    offset += len(ring)
+
+        coordinates = [[np.round(ring, COORDINATE_DECIMALS).tolist() for ring in rings] for rings in polygons]
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': coordinates[0]} if len(coordinates) == 1
+            else {'type': 'MultiPolygon', 'coordinates': coordinates},
+            'properties': {
+                'water_body_id': water_body_id,
+                'area_m2': round(area, 2),
+                'perimeter_m': round(perimeter, 2),
+                'centroid_lon': round(float(centroid[0]), COORDINATE_DECIMALS),
+                'centroid_lat': round(float(centroid[1]), COORDINATE_DECIMALS),
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+# Function to get the cache file of a raster's outlines for one threshold and tolerance
+def vector_cache_path(file_path, threshold=WATER_THRESHOLD, tolerance_pixels=DEFAULT_TOLERANCE_PIXELS):
+    real_path = os.path.realpath(file_path)
+    stat = os.stat(real_path)
+    version = hashlib.sha1(f"{real_path}:{stat.st_mtime_ns}:{stat.st_size}:{threshold}:{tolerance_pixels}".encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(VECTOR_FOLDER, f'{name}-{version}.geojson')
+
+
+# Function to return the path of a raster's water body outlines as GeoJSON, vectorizing them on first use
+def water_body_geojson(file_path, threshold=WATER_THRESHOLD, tolerance_pixels=DEFAULT_TOLERANCE_PIXELS):
+    geojson_path = vector_cache_path(file_path, threshold, tolerance_pixels)
+    if os.path.exists(geojson_path):
+        return geojson_path
+
+    img_data_normalized, _, metadata, _ = cached_read_normalized(file_path)
+    collection = vectorize_water_bodies(img_data_normalized, metadata['transform'], metadata['crs'], threshold, tolerance_pixels,
+                                        load_labels(file_path, threshold))
+    os.makedirs(VECTOR_FOLDER, exist_ok=True)
+    temp_path = geojson_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(collection, f, separators=(',', ':'))
+    os.replace(temp_path, geojson_path)
+    return geojson_path
+
+
+# Function to load a raster's cached water body outlines as a GeoJSON dict
+def load_water_body_geojson(file_path, threshold=WATER_THRESHOLD, tolerance_pixels=DEFAULT_TOLERANCE_PIXELS):
+    with open(water_body_geojson(file_path, threshold, tolerance_pixels)) as f:
+        return json.load(f)
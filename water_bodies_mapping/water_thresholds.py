@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+import rasterio
+
+from instrumentation import stage_timer
+from raster_normalization import mask_nodata
+from raster_streaming import DEFAULT_HISTOGRAM_BINS, DEFAULT_WINDOW_PIXELS, StreamingHistogram, core_histogram, iter_windows
+
+# Normalized values above this are treated as water
+WATER_THRESHOLD = 0.5
+DEFAULT_PERCENTILE = 90.0
+THRESHOLD_METHODS = {'fixed': 'Fixed value', 'otsu': 'Otsu (automatic)', 'percentile': 'Percentile'}
+# Layers water is detected on: a single band, or a normalized difference of two bands (first - second) / (first + second)
+WATER_INDICES = {'band': 'Single band', 'ndwi': 'NDWI (green, NIR)', 'mndwi': 'MNDWI (green, SWIR)'}
+# Band numbers of a common 4/5-band stack (blue, green, red, NIR, SWIR); sensors differ, so the UI lets users change them
+DEFAULT_INDEX_BANDS = {'band': (1,), 'ndwi': (2, 4), 'mndwi': (2, 5)}
+DEFAULT_DETECTION = {'index': 'band', 'bands': (1,), 'method': 'fixed', 'threshold': WATER_THRESHOLD, 'percentile': DEFAULT_PERCENTILE}
+
+
+# Function to build water detection settings, filling in the defaults
+def detection_settings(index='band', bands=None, method='fixed', threshold=None, percentile=DEFAULT_PERCENTILE):
+    if index not in WATER_INDICES:
+        raise ValueError(f"Unknown water index '{index}', expected one of {list(WATER_INDICES)}")
+    if method not in THRESHOLD_METHODS:
+        raise ValueError(f"Unknown threshold method '{method}', expected one of {list(THRESHOLD_METHODS)}")
+    if threshold is None:
+        # Water has positive NDWI/MNDWI, while normalized bands use the historical 0.5
+        threshold = WATER_THRESHOLD if index == 'band' else 0.0
+    return {'index': index, 'bands': tuple(bands or DEFAULT_INDEX_BANDS[index]), 'method': method,
+            'threshold': float(threshold), 'percentile': float(percentile)}
+
+
+# Function to describe detection settings in a short caption
+def describe_detection(detection, threshold):
+    layer = f"band {detection['bands'][0]}" if detection['index'] == 'band' else \
+        f"{detection['index'].upper()} of bands {detection['bands'][0]} and {detection['bands'][1]}"
+    method = {'fixed': 'fixed', 'otsu': 'Otsu', 'percentile': f"{detection['percentile']:g}th percentile"}[detection['method']]
+    return f"{method} threshold {threshold:.3f} on {layer}"
+
+
+# Function to find the Otsu threshold of a histogram: the cut that maximizes the variance between the two classes
+def otsu_threshold(counts, edges):
+    counts = np.asarray(counts, dtype=np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight_low = np.cumsum(counts)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(counts * centers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_low = sum_low / weight_low
+        mean_high = (sum_low[-1] - sum_low) / weight_high
+        between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    between[~np.isfinite(between)] = -1
+    # The cut lies on the upper edge of the last bin of the low class
+    return float(edges[int(np.argmax(between)) + 1])
+
+
+# Function to find the value below which the given percentage of pixels lie, interpolating inside the bin
+def percentile_threshold(counts, edges, percentile):
+    cumulative = np.cumsum(counts)
+    if cumulative[-1] == 0:
+        return float(edges[0])
+    target = cumulative[-1] * percentile / 100
+    index = min(int(np.searchsorted(cumulative, target)), len(counts) - 1)
+    below = cumulative[index - 1] if index else 0
+    fraction = (target - below) / counts[index] if counts[index] else 0.0
+    return float(edges[index] + fraction * (edges[index + 1] - edges[index]))
+
+
+# Function to pick the water threshold for a layer from its streamed statistics
+def water_threshold(stats, detection, normalized=True):
+    if detection['method'] == 'fixed' or stats['valid_pixels'] == 0:
+        return detection['threshold']
+    counts, edges = np.asarray(stats['histogram']), np.asarray(stats['bin_edges'])
+    if detection['method'] == 'otsu':
+        threshold = otsu_threshold(counts, edges)
+    else:
+        threshold = percentile_threshold(counts, edges, detection['percentile'])
+    if normalized:
+        # The histogram is of the raw band, so the cut is mapped onto the min-max normalized scale
+        vmin, vmax = stats['min'], stats['max']
+        threshold = (threshold - vmin) / (vmax - vmin) if vmax > vmin else 0.0
+    # Rounded so the same raster and settings always map to the same stored labels
+    return float(f'{threshold:.6g}')
+
+
+# Function to compute (first - second) / (first + second), with NaN where the sum is zero or a band has no data
+def normalized_difference(first, second):
+    total = first + second
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = (first - second) / total
+    index[total == 0] = np.nan
+    return index
+
+
+# Function to yield a water index tile by tile, reading only the bands the index needs
+def iter_index_tiles(src, index, bands, max_window_pixels=DEFAULT_WINDOW_PIXELS):
+    needed = len(DEFAULT_INDEX_BANDS[index])
+    if len(bands) != needed or not all(1 <= band <= src.count for band in bands):
+        raise ValueError(f"{WATER_INDICES[index]} needs {needed} band number(s) between 1 and {src.count}, got {list(bands)}")
+    for window in iter_windows(src, bands[0], max_window_pixels // needed):
+        data = mask_nodata(src.read(list(bands), window=window), src.nodata, inplace=True)
+        yield window, data[0] if needed == 1 else normalized_difference(data[0], data[1])
+
+
+# Function to read a water index into one float32 array, gathering its range and histogram in the same pass
+def read_index(file_path, index, bands, bins=DEFAULT_HISTOGRAM_BINS, max_window_pixels=DEFAULT_WINDOW_PIXELS):
+    histogram = StreamingHistogram(bins)
+    vmin, vmax = np.inf, -np.inf
+    valid_pixels = 0
+    timer = stage_timer(f'{index}_index', os.path.basename(file_path))
+    with rasterio.open(file_path) as src:
+        bounds = src.bounds
+        metadata = src.meta
+        # Only the index is held in memory; the source bands are read window by window
+        values = np.empty((src.height, src.width), dtype=np.float32)
+        windows = []
+        for window, tile in iter_index_tiles(src, index, bands, max_window_pixels):
+            windows.append(window)
+            with timer:
+                values[window.row_off:window.row_off + window.height,
+                       window.col_off:window.col_off + window.width] = tile
+                valid = tile[np.isfinite(tile)]
+                if valid.size:
+                    vmin = min(vmin, float(valid.min()))
+                    vmax = max(vmax, float(valid.max()))
+                    valid_pixels += valid.size
+                    histogram.update(valid)
+            timer.add_bytes(tile.nbytes)
+    timer.record()
+
+    stats = {
+        'min': vmin if valid_pixels else np.nan,
+        'max': vmax if valid_pixels else np.nan,
+        'valid_pixels': valid_pixels,
+        'nodata_fraction': 1 - valid_pixels / values.size if values.size else 0.0,
+        'histogram': histogram.counts,
+        'bin_edges': histogram.edges(),
+    }
+    # The index is already in memory, so the finer histogram over its core range is a second pass over the array
+    core = core_histogram(stats, bins)
+    for window in windows:
+        core.update(values[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width])
+    stats.update(histogram=core.counts, bin_edges=core.edges())
+    return values, bounds, metadata, stats